@@ -6,6 +6,8 @@ from django.db.models import Count
 from tresor.models.collection_operation import CollectionOperation
 from tresor.models.disbursement_operation import DisbursementOperation
 from django.db.models import OuterRef, Subquery 
+from django.db.models.functions import Coalesce
+from tresor.sparse import SparseFieldsMixin
 
 class UserManager(BaseUserManager):
     def create_user(self, username, name, password):
@@ -30,6 +32,14 @@ class UserManager(BaseUserManager):
     def get_queryset(self):
         ret = super().get_queryset()
         return ret
+
+    def with_operation_counts(self):
+        # the counts the serializer shows, in the query of the users instead of two queries per user
+        counts = {}
+        for name, model in (('collection_operations_count', CollectionOperation), ('disbursement_operations_count', DisbursementOperation)):
+            operations = model._base_manager.filter(created_by=OuterRef('pk')).values('created_by').annotate(count=Count('pk')).values('count')
+            counts[name] = Coalesce(Subquery(operations), 0)
+        return self.get_queryset().annotate(**counts)
     
 class User(AbstractBaseUser): 
     username = models.CharField(max_length=255, unique=True)
@@ -48,14 +58,19 @@ class User(AbstractBaseUser):
     def is_staff(self):
         return self.is_admin or self.is_superuser
 
-class UserSerializer(serializers.ModelSerializer): 
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer): 
     total_collection_operations = serializers.SerializerMethodField()
     total_disbursement_operations = serializers.SerializerMethodField()
 
     def get_total_collection_operations(self, obj):
+        # annotated by User.objects.with_operation_counts()
+        if hasattr(obj, 'collection_operations_count'):
+            return obj.collection_operations_count
         return obj.collection_operations.count()
     
     def get_total_disbursement_operations(self, obj):
+        if hasattr(obj, 'disbursement_operations_count'):
+            return obj.disbursement_operations_count
         return obj.disbursement_operations.count()
     
     def create(self, validated_data):
@@ -0,0 +1,26 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from rest_framework.authtoken.models import Token
+
+from authentication.models import User
+from authentication.tokens import token_cache
+
+
+def invalidate_user_tokens(sender, instance, **kwargs):
+    # a deactivated user or a new password, set by PasswordUpdateView or UserSerializer.update, is seen by the next request
+    invalidate_on_commit(list(Token.objects.filter(user=instance.pk).values_list('key', flat=True)))
+
+
+def invalidate_token(sender, instance, **kwargs):
+    invalidate_on_commit([instance.key])
+
+
+def invalidate_on_commit(keys):
+    # after the commit, a request during the transaction would put the user as it was back in the cache
+    if keys:
+        transaction.on_commit(lambda: token_cache.invalidate(keys))
+
+
+post_save.connect(invalidate_user_tokens, sender=User)
+post_delete.connect(invalidate_user_tokens, sender=User)
+post_delete.connect(invalidate_token, sender=Token)
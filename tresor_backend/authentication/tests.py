@@ -1,3 +1,64 @@
-from django.test import TestCase
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from authentication.models import User
+from authentication.tokens import token_cache
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, TOKEN_CACHE_SHARED=False)
+class CachedTokenAuthenticationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'Admin', 'password')
+        cls.token = Token.objects.create(user=cls.admin)
+
+    def setUp(self):
+        token_cache.entries.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get(self):
+        return self.client.get('/collections/')
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get().status_code, 200)
+        return [query for query in queries.captured_queries if 'authtoken_token' in query['sql']]
+
+    def test_second_request_is_cached(self):
+        self.assertTrue(self.token_queries())
+        self.assertFalse(self.token_queries())
+
+    def test_password_hash_not_cached(self):
+        self.get()
+        values = token_cache.get(self.token.key)
+        self.assertIsNotNone(values)
+        self.assertNotIn(self.admin.password, values)
+
+    def test_deactivation_invalidates_after_commit(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.admin.pk).update(is_active=False)
+            admin = User.objects.get(pk=self.admin.pk)
+            admin.save()
+            # still cached until the commit
+            self.assertIsNotNone(token_cache.get(self.token.key))
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_password_update_invalidates(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/users/{self.admin.pk}/update_password/', {'password': 'new password'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(self.get().status_code, 200)
+
+    def test_deleted_token_is_refused(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.filter(pk=self.token.pk).delete()
+        self.assertEqual(self.get().status_code, 401)
@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+from authentication.models import User
+
+TOKEN_CACHE_PREFIX = "auth_token"
+
+
+class TokenCache:
+    # token key => field values of the user, the least recently used keys are dropped past max_size and
+    # the entries expire after ttl seconds. The shared Django cache is a second level for the other processes when
+    # TOKEN_CACHE_SHARED is set; the entries of the other processes are not invalidated, they expire after ttl
+    def __init__(self, max_size, ttl, shared):
+        self.max_size, self.ttl, self.shared = max_size, ttl, shared
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    return entry[1]
+                del self.entries[key]
+        if self.shared:
+            value = cache.get(f"{TOKEN_CACHE_PREFIX}:{key}")
+            if value is not None:
+                self.set(key, value, shared=False)
+            return value
+        return None
+
+    def set(self, key, value, shared=True):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        if shared and self.shared:
+            cache.set(f"{TOKEN_CACHE_PREFIX}:{key}", value, self.ttl)
+
+    def invalidate(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+        if self.shared:
+            cache.delete_many([f"{TOKEN_CACHE_PREFIX}:{key}" for key in keys])
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL, settings.TOKEN_CACHE_SHARED)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # TokenAuthentication without the query of the token and its user on every request, see TokenCache.
+    # request.auth is the token key
+    # the fields the permissions read, the others (the password hash...) are not cached and loaded when read
+    cached_fields = ['id', 'username', 'name', 'is_active', 'is_admin', 'is_superuser', 'has_accounts_access']
+
+    def authenticate_credentials(self, key):
+        values = token_cache.get(key)
+        if values is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, tuple(getattr(user, field) for field in self.cached_fields))
+            return user, key
+        # a new instance on each request, nothing a request changes on its user is seen by the next ones
+        user = User.from_db(None, self.cached_fields, values)
+        return user, key
@@ -11,6 +11,7 @@ from authentication.models import User
 from django.db.models import Count
 from rest_framework.views import APIView
 from tresor.models import Account , AccountSerializer
+from tresor.sparse import load_only, sparse_fields
 
 from rest_framework import viewsets, filters
 from django_filters.rest_framework import DjangoFilterBackend
@@ -63,8 +64,16 @@ class UsersViewSet(viewsets.ModelViewSet):
     
 
     def get_queryset(self):
-        ret = User.objects.all()
-        return ret
+        fields = sparse_fields(self.get_serializer())
+        kept = fields if fields is not None else self.get_serializer().fields
+        # the counts and the vault groups are only queried when they are shown
+        if 'total_collection_operations' in kept or 'total_disbursement_operations' in kept:
+            ret = User.objects.with_operation_counts()
+        else:
+            ret = User.objects.all()
+        if 'assigned_vault_groups' in kept:
+            ret = ret.prefetch_related('assigned_vault_groups')
+        return load_only(ret, fields)
     
     def partial_update(self, request, *args, **kwargs):
         if "password" in request.data:
@@ -80,6 +89,6 @@ class PasswordUpdateView(APIView):
         if password is None:
             return Response({"error" : "Password is required"}, status=400)
         user.set_password(password)
-        user.save()
+        user.save(update_fields=['password'])
         return Response({"message" : "Password updated"})
         
\ No newline at end of file
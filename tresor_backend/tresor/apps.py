@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TresorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tresor'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,266 @@
+import csv
+import json
+import os
+import re
+import time
+import uuid
+import zipfile
+import zlib
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.db.models import Case, OuterRef, Subquery, TextField, When
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.utils.encoders import JSONEncoder
+
+from tresor.models import CollectionOperationDetail, DisbursementOperation, VaultDeposit, VaultWithdrawal
+
+
+class Echo:
+    # file like object that gives back what is written, used to stream csv rows
+    def write(self, value):
+        return value
+
+
+class ZipBuffer:
+    # unseekable file for zipfile, the written bytes are taken out after every write to be streamed
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(files):
+    # files is an iterable of (name, iterable of bytes, compress_type)
+    # the archive is generated while it is sent, it is never held in memory
+    buffer = ZipBuffer()
+    zip_file = zipfile.ZipFile(buffer, 'w')
+    for name, chunks, compress_type in files:
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = compress_type
+        with zip_file.open(info, 'w', force_zip64=True) as f:
+            for chunk in chunks:
+                f.write(chunk)
+                data = buffer.pop()
+                if data:
+                    yield data
+        yield buffer.pop()
+    zip_file.close()
+    yield buffer.pop()
+
+
+def file_chunks(field_file):
+    # the content of a FileField, opened when the archive gets to it
+    with field_file.open('rb') as f:
+        yield from f.chunks()
+
+
+def stream_to_file(chunks, path):
+    # sends the chunks while writing them to path, the file is only there once it is complete:
+    # an interrupted download leaves nothing behind
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        with open(part, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(part, path)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(Echo())
+    # the BOM makes excel read the file as utf-8
+    yield "\ufeff" + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+XLSX_FILES = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def xlsx_cell(value):
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def xlsx_sheet(header, rows):
+    yield b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+    yield ("<row>" + "".join(xlsx_cell(value) for value in header) + "</row>").encode()
+    for row in rows:
+        yield ("<row>" + "".join(xlsx_cell("" if value is None else value) for value in row) + "</row>").encode()
+    yield b'</sheetData></worksheet>'
+
+
+def stream_xlsx(header, rows, sheet_name="Sheet1"):
+    # minimal spreadsheet with inline strings, written row by row
+    sheet_name = re.sub(r'[\[\]:*?/\\]', ' ', sheet_name)[:31]
+    workbook = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name, {chr(34): "&quot;"})}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    )
+    files = [(name, [content.encode()], zipfile.ZIP_DEFLATED) for name, content in XLSX_FILES.items()]
+    files.append(("xl/workbook.xml", [workbook.encode()], zipfile.ZIP_DEFLATED))
+    files.append(("xl/worksheets/sheet1.xml", xlsx_sheet(header, rows), zipfile.ZIP_DEFLATED))
+    return stream_zip(files)
+
+
+def export_response(format, file_name, header, rows, sheet_name="Sheet1"):
+    # rows is an iterable of lists, it is consumed while the response is sent
+    if format == "csv":
+        response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv; charset=utf-8')
+    else:
+        response = StreamingHttpResponse(stream_xlsx(header, rows, sheet_name), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response['Content-Disposition'] = f'attachment; filename="{file_name}.{format}"'
+    return response
+
+
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+STREAM_CHUNK_SIZE = 2000
+
+
+def serialized_chunks(view, queryset, chunk_size=STREAM_CHUNK_SIZE):
+    # the representation of the rows of a list view, read from a server side cursor and serialized chunk by chunk
+    # (the prefetches of the queryset are done per chunk too), only one chunk is in memory at a time
+    rows = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        rows.append(row)
+        if len(rows) == chunk_size:
+            yield view.get_serializer(rows, many=True).data
+            rows = []
+    if rows:
+        yield view.get_serializer(rows, many=True).data
+
+
+def ndjson_lines(chunks):
+    for chunk in chunks:
+        yield "".join(json.dumps(item, cls=JSONEncoder) + "\n" for item in chunk)
+
+
+def csv_lines(fields, chunks):
+    # one column per field, the nested fields (details, account_data) are written as json
+    writer = csv.writer(Echo())
+    yield "\ufeff" + writer.writerow(fields)
+    for chunk in chunks:
+        yield "".join(writer.writerow([
+            json.dumps(item.get(name), cls=JSONEncoder) if isinstance(item.get(name), (dict, list)) else item.get(name)
+            for name in fields
+        ]) for item in chunk)
+
+
+def gzip_stream(parts):
+    # gzip of the parts, the compressor sends its output as soon as it has a block of it
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for part in parts:
+        data = compressor.compress(part.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_list(view, queryset, format, file_name):
+    # ?stream=ndjson|csv on a list view: the whole filtered list, compressed when the client takes gzip
+    request = view.request
+    if format == "csv":
+        fields = [name for name, field in view.get_serializer().fields.items() if not field.write_only]
+        parts = csv_lines(fields, serialized_chunks(view, queryset))
+    else:
+        parts = ndjson_lines(serialized_chunks(view, queryset))
+    gzip = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+    response = StreamingHttpResponse(gzip_stream(parts) if gzip else parts, content_type=STREAM_FORMATS[format])
+    if gzip:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    if format == "csv":
+        response["Content-Disposition"] = f'attachment; filename="{file_name}.csv"'
+    return response
+
+
+RELEVE_HEADER = ["Date", "Opération", "Type", "Débit", "Crédit", "Solde"]
+RELEVE_CREDIT_TYPES = ["collection", "fund_transfer", "deposit"]
+
+
+def releve_rows(balances, lines):
+    # lines are the releve lines of AccountReleve / VaultReleve, in order
+    yield ["", "Solde initial", "", "", "", balances["start_date_balance"]]
+    for line in lines:
+        credit = line["type"] in RELEVE_CREDIT_TYPES
+        yield [
+            line["date"].isoformat(),
+            line["operation_name"],
+            line["type"],
+            "" if credit else line["amount"],
+            line["amount"] if credit else "",
+            line["balance"],
+        ]
+    yield ["", "Solde final", "", "", "", balances["end_date_balance"]]
+
+
+def releve_entries(entries, *collection_fields):
+    # the ledger entries of a releve with the motif of their operation and the type and collection_fields of the
+    # collection details, the source fields are read with primary key lookups
+    def source(model, field):
+        return Subquery(model._base_manager.filter(pk=OuterRef('source_id')).values(field)[:1])
+
+    def collection(field):
+        return Case(When(source_type='collection', then=source(CollectionOperationDetail, field)))
+
+    return entries.annotate(
+        operation_name=Case(
+            When(source_type='collection', then=source(CollectionOperationDetail, 'parent__motif')),
+            When(source_type='disbursement', then=source(DisbursementOperation, 'motif')),
+            When(source_type='deposit', then=source(VaultDeposit, 'motif')),
+            default=source(VaultWithdrawal, 'motif'),
+            output_field=TextField(),
+        ),
+        operation_type=collection('parent__type'),
+        **{field: collection(field) for field in collection_fields},
+    )
+
+
+def stream_releve(balances, lines):
+    # same document as the non paginated response of a releve, written line by line
+    yield json.dumps(balances, cls=JSONEncoder)[:-1] + ', "data": ['
+    separator = ""
+    for line in lines:
+        yield separator + json.dumps(line, cls=JSONEncoder)
+        separator = ","
+    yield "]}"
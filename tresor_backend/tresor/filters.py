@@ -0,0 +1,35 @@
+import re
+from django.db.models import Q
+from rest_framework.filters import SearchFilter
+
+
+class RefSearchFilter(SearchFilter):
+    # a search for a ref ("0023/2024/DTNDB", "0023/2024", "0023", "23", "002") is done with ranges on the indexed (ref_year, ref_number)
+    # instead of ref__icontains, any other search is left to SearchFilter. A 4 digit search is a year too ("2024").
+    # The refs without a number (given twice before the counters, see migration 0032) are not found by a ref search
+    ref_pattern = re.compile(r'(\d+)(?:/(\d{4})(?:/[A-Za-z]*)?)?')
+    padding = 4
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        match = self.ref_pattern.fullmatch(terms[0]) if len(terms) == 1 else None
+        if match is None:
+            return super().filter_queryset(request, queryset, view)
+
+        return queryset.filter(self.ref_condition(match))
+
+    def ref_condition(self, match):
+        digits, year = match[1], match[2]
+        number = int(digits)
+        if year is not None:
+            return Q(ref_year=int(year), ref_number=number)
+        if digits.startswith("0"):
+            # the start of the padded number, 002 => 0020 to 0029
+            scale = 10 ** max(self.padding - len(digits), 0)
+            return Q(ref_number__gte=number * scale, ref_number__lt=(number + 1) * scale)
+        # the numbers starting with these digits, 21 => 21, 210 to 219, 2100 to 2199
+        condition = Q(ref_year=number) if len(digits) == 4 else Q()
+        for size in range(max(self.padding - len(digits), 0) + 1):
+            scale = 10 ** size
+            condition |= Q(ref_number__gte=number * scale, ref_number__lt=(number + 1) * scale)
+        return condition
@@ -0,0 +1,405 @@
+import abc
+import csv
+import datetime
+import io
+import re
+import zipfile
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from xml.etree import ElementTree
+
+from django.db import transaction
+
+from .models import (
+    Account, Vault, LedgerEntry, OperationRollup, RefCounter,
+    CollectionOperation, CollectionOperationDetail, DisbursementOperation, DisbursementOperationDetail, VaultDeposit, VaultWithdrawal,
+)
+from .utils import invalidate_stats
+
+
+XLSX_NAMESPACE = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+def read_csv(file):
+    text = file.read().decode('utf-8-sig')
+    # excel writes ";" separated files with a french locale
+    dialect = csv.Sniffer().sniff(text.split("\n", 1)[0], delimiters=",;")
+    return list(csv.reader(io.StringIO(text), dialect))
+
+
+def read_xlsx(file):
+    # first sheet of the workbook as a list of rows, the values are strings like in a csv
+    with zipfile.ZipFile(file) as archive:
+        names = archive.namelist()
+        shared = []
+        if "xl/sharedStrings.xml" in names:
+            for item in ElementTree.fromstring(archive.read("xl/sharedStrings.xml")).iter(XLSX_NAMESPACE + "si"):
+                shared.append("".join(text.text or "" for text in item.iter(XLSX_NAMESPACE + "t")))
+        sheet = sorted(name for name in names if re.fullmatch(r'xl/worksheets/sheet\d+\.xml', name))[0]
+        rows = []
+        for row in ElementTree.fromstring(archive.read(sheet)).iter(XLSX_NAMESPACE + "row"):
+            values = {}
+            column = 0
+            for cell in row.iter(XLSX_NAMESPACE + "c"):
+                # without a reference ("B3") the cell is the one after the previous cell
+                column += 1
+                if cell.get("r"):
+                    column = 0
+                    for letter in re.match(r'[A-Z]+', cell.get("r")).group():
+                        column = column * 26 + ord(letter) - ord("A") + 1
+                value = cell.find(XLSX_NAMESPACE + "v")
+                if cell.get("t") == "s":
+                    values[column] = shared[int(value.text)]
+                elif cell.get("t") == "inlineStr":
+                    values[column] = "".join(text.text or "" for text in cell.iter(XLSX_NAMESPACE + "t"))
+                elif value is not None:
+                    values[column] = value.text or ""
+            rows.append([values.get(column, "") for column in range(1, max(values, default=0) + 1)])
+        return rows
+
+
+def read_rows(file, format):
+    # rows as dicts by lower case column name
+    rows = read_xlsx(file) if format == "xlsx" else read_csv(file)
+    if not rows:
+        return []
+    header = [column.strip().lower() for column in rows[0]]
+    return [dict(zip(header, row)) for row in rows[1:] if any(str(value).strip() for value in row)]
+
+
+class BalanceError(Exception):
+    # a debit that did not pass once the batch was written, the transaction is rolled back
+    def __init__(self, error):
+        self.error = error
+
+
+class OperationImport(abc.ABC):
+    # every row is validated before anything is written, then the whole batch is written in one transaction:
+    # bulk inserts, one ledger / snapshot / rollup update per owner and date and one balance update per account or vault
+    fields = {}
+    optional = {}
+
+    def __init__(self, rows, user):
+        self.rows = rows
+        self.user = user
+        self.errors = []
+        self.created = []
+
+    def run(self):
+        # returns the errors by row, nothing is written if there is one
+        rows = self.clean()
+        if self.errors:
+            return self.errors
+        return self.write(rows)
+
+    def write(self, rows):
+        # rows are cleaned values, like the ones of clean(), with their "row" number used in the errors
+        self.check(rows)
+        if self.errors:
+            return self.errors
+        try:
+            with transaction.atomic():
+                self.created = self.save(rows)
+                transaction.on_commit(invalidate_stats)
+        except BalanceError as e:
+            self.errors.append(e.error)
+        return self.errors
+
+    def clean(self):
+        accounts = self.lookup(Account, [column for column, kind in self.fields.items() if kind == "account"])
+        vaults = self.lookup(Vault, [column for column, kind in self.fields.items() if kind == "vault"])
+        rows = []
+        # the first line of the file is the header
+        for number, row in enumerate(self.rows, start=2):
+            values, errors = {"row": number}, {}
+            for column, kind in self.fields.items():
+                value = str(row.get(column) or "").strip()
+                if not value:
+                    if column in self.optional:
+                        values[column] = self.optional[column]
+                    else:
+                        errors[column] = ["REQUIRED"]
+                    continue
+                try:
+                    values[column] = self.clean_value(kind, value, accounts, vaults)
+                except ValueError as e:
+                    errors[column] = [str(e)]
+            if errors:
+                self.errors.append({"row": number, "errors": errors})
+            rows.append(values)
+        return rows
+
+    def lookup(self, model, columns):
+        ids = set()
+        for row in self.rows:
+            for column in columns:
+                value = str(row.get(column) or "").strip()
+                if value.isdigit():
+                    ids.add(int(value))
+        return model.objects.in_bulk(ids)
+
+    def clean_value(self, kind, value, accounts, vaults):
+        if kind == "text":
+            return value
+        if kind == "date":
+            if re.fullmatch(r'\d+(\.0+)?', value):
+                # a date cell of a spreadsheet is a number of days
+                return datetime.date(1899, 12, 30) + datetime.timedelta(days=int(float(value)))
+            try:
+                return datetime.date.fromisoformat(value)
+            except ValueError:
+                raise ValueError("INVALID_DATE")
+        if kind == "amount":
+            try:
+                amount = Decimal(value.replace(" ", "").replace(",", "."))
+            except InvalidOperation:
+                raise ValueError("INVALID_AMOUNT")
+            if not amount.is_finite() or amount <= 0 or amount >= 10 ** 8 or amount != round(amount, 2):
+                raise ValueError("INVALID_AMOUNT")
+            return amount
+        if kind in ("account", "vault"):
+            owners = accounts if kind == "account" else vaults
+            if not value.isdigit() or int(value) not in owners:
+                raise ValueError(f"UNKNOWN_{kind.upper()}")
+            return owners[int(value)]
+        # a list of choices
+        if value not in kind:
+            raise ValueError("INVALID_CHOICE")
+        return value
+
+    def check_debits(self, debits):
+        # debits is {owner: (total, first row)}, checked against the balances read with the rows
+        for owner, (total, row) in debits.items():
+            if total > owner.balance:
+                column = "vault" if isinstance(owner, Vault) else "account"
+                self.errors.append({"row": row, "errors": {column: ["NOT_ENOUGH_BALANCE"]}})
+
+    def debit(self, model, debits):
+        for owner, (total, row) in debits.items():
+            if not model.objects.filter(pk=owner.pk).debit(total):
+                column = "vault" if model is Vault else "account"
+                raise BalanceError({"row": row, "errors": {column: ["NOT_ENOUGH_BALANCE"]}})
+
+    def check(self, rows):
+        pass
+
+    @abc.abstractmethod
+    def save(self, rows):
+        # writes the cleaned and checked rows, returns the created operations
+        pass
+
+
+class DetailedOperationImport(OperationImport):
+    # one line per detail, the lines with the same `operation` value are the details of one operation
+    # the operation fields are read on its first line
+    model = None
+    detail_model = None
+    series = ""
+    operation_fields = []
+    detail_fields = []
+
+    def group(self, rows):
+        operations = {}
+        for values in rows:
+            key = values.get("operation") or f"row {values['row']}"
+            operations.setdefault(key, []).append(values)
+        return list(operations.values())
+
+    def check(self, rows):
+        for details in self.group(rows):
+            error = self.check_details(details)
+            if error is not None:
+                self.errors.append({"row": details[0]["row"], "errors": {"details": [error]}})
+
+    def check_details(self, details):
+        return None
+
+    @abc.abstractmethod
+    def save_balances(self, operations, groups, details):
+        # the ledger entries, rollups and balances of the created operations and details
+        pass
+
+    def save(self, rows):
+        groups = self.group(rows)
+        operations = [self.model(created_by=self.user, **{field: details[0][field] for field in self.operation_fields}) for details in groups]
+        RefCounter.objects.assign(self.series, operations, self.model.first_ref_number)
+        self.model.objects.bulk_create(operations, batch_size=1000)
+        details = []
+        for operation, group in zip(operations, groups):
+            details += [self.detail_model(parent=operation, **{field: values[field] for field in self.detail_fields}) for values in group]
+        self.detail_model.objects.bulk_create(details, batch_size=1000)
+        self.save_balances(operations, groups, details)
+        return operations
+
+
+class CollectionImport(DetailedOperationImport):
+    model = CollectionOperation
+    detail_model = CollectionOperationDetail
+    series = "collection"
+    fields = {
+        "operation": "text",
+        "date": "date",
+        "motif": "text",
+        "beneficiaire": "text",
+        "type": [choice for choice, _ in CollectionOperation._meta.get_field('type').choices],
+        "cheque_number": "text",
+        "name": "text",
+        "banq_name": "text",
+        "montant": "amount",
+        "destination_account": "account",
+    }
+    optional = {"operation": None, "type": "operation"}
+    operation_fields = ["date", "motif", "beneficiaire", "type"]
+    detail_fields = ["cheque_number", "name", "banq_name", "montant", "destination_account"]
+
+    def check_details(self, details):
+        if details[0]["type"] == "rejected" and len(details) > 1:
+            return "REJECTED_OPERATION_MULTIPLE_DETAILS"
+
+    def save_balances(self, operations, groups, details):
+        LedgerEntry.objects.record_many([
+            LedgerEntry(source_type='collection', source_id=detail.pk, date=detail.parent.date, amount=detail.montant, account=detail.destination_account)
+            for detail in details
+        ])
+        changes = {}
+        for operation, group in zip(operations, groups):
+            OperationRollup.objects.merge(changes, OperationRollup.objects.collection_change(
+                operation, [(values["destination_account"].pk, values["montant"]) for values in group]))
+        OperationRollup.objects.apply(changes)
+        credits = defaultdict(int)
+        for detail in details:
+            credits[detail.destination_account_id] += detail.montant
+        for account_id, total in credits.items():
+            Account.objects.filter(pk=account_id).credit(total)
+
+
+class DisbursementImport(DetailedOperationImport):
+    model = DisbursementOperation
+    detail_model = DisbursementOperationDetail
+    series = "disbursement"
+    fields = {
+        "operation": "text",
+        "date": "date",
+        "account": "account",
+        "motif": "text",
+        "beneficiaire": "text",
+        "type": [choice for choice, _ in DisbursementOperation._meta.get_field('type').choices],
+        "name": "text",
+        "banq_name": "text",
+        "banq_number": "text",
+        "montant": "amount",
+    }
+    optional = {"operation": None, "type": "operation"}
+    operation_fields = ["date", "account", "motif", "beneficiaire", "type"]
+    detail_fields = ["name", "banq_name", "banq_number", "montant"]
+
+    def check_details(self, details):
+        if details[0]["type"] == "frais" and len(details) != 1:
+            return "INVALID_DETAILS"
+
+    def check(self, rows):
+        super().check(rows)
+        self.check_debits(self.get_debits(self.group(rows)))
+
+    def get_debits(self, groups):
+        debits = {}
+        for group in groups:
+            account = group[0]["account"]
+            total, row = debits.get(account, (0, group[0]["row"]))
+            debits[account] = (total + sum(values["montant"] for values in group), row)
+        return debits
+
+    def save_balances(self, operations, groups, details):
+        totals = [sum(values["montant"] for values in group) for group in groups]
+        LedgerEntry.objects.record_many([
+            LedgerEntry(source_type='disbursement', source_id=operation.pk, date=operation.date, amount=-total, account=operation.account)
+            for operation, total in zip(operations, totals)
+        ])
+        changes = {}
+        for operation, total in zip(operations, totals):
+            OperationRollup.objects.merge(changes, OperationRollup.objects.disbursement_change(operation, total))
+        OperationRollup.objects.apply(changes)
+        self.debit(Account, self.get_debits(groups))
+
+
+class DepositImport(OperationImport):
+    fields = {
+        "date": "date",
+        "vault": "vault",
+        "amount": "amount",
+        "motif": "text",
+        "versement_number": "text",
+        "ref": "text",
+    }
+    optional = {"versement_number": None, "ref": ""}
+
+    def save(self, rows):
+        deposits = VaultDeposit.objects.bulk_create([
+            VaultDeposit(created_by=self.user, **{field: values[field] for field in self.fields}) for values in rows
+        ], batch_size=1000)
+        LedgerEntry.objects.record_many([
+            LedgerEntry(source_type='deposit', source_id=deposit.pk, date=deposit.date, amount=deposit.amount, vault=deposit.vault)
+            for deposit in deposits
+        ])
+        changes = {}
+        credits = defaultdict(int)
+        for deposit in deposits:
+            OperationRollup.objects.merge(changes, OperationRollup.objects.deposit_change(deposit))
+            credits[deposit.vault_id] += deposit.amount
+        OperationRollup.objects.apply(changes)
+        for vault_id, total in credits.items():
+            Vault.objects.filter(pk=vault_id).credit(total)
+        return deposits
+
+
+class WithdrawalImport(OperationImport):
+    # a line with an account is a fund transfer from the vault to the account
+    fields = {
+        "date": "date",
+        "vault": "vault",
+        "amount": "amount",
+        "motif": "text",
+        "account": "account",
+        "ref": "text",
+    }
+    optional = {"account": None, "ref": ""}
+
+    def get_debits(self, rows):
+        debits = {}
+        for values in rows:
+            total, row = debits.get(values["vault"], (0, values["row"]))
+            debits[values["vault"]] = (total + values["amount"], row)
+        return debits
+
+    def check(self, rows):
+        self.check_debits(self.get_debits(rows))
+
+    def save(self, rows):
+        withdrawals = VaultWithdrawal.objects.bulk_create([
+            VaultWithdrawal(created_by=self.user, **{field: values[field] for field in self.fields}) for values in rows
+        ], batch_size=1000)
+        entries = []
+        for withdrawal in withdrawals:
+            entries.append(LedgerEntry(source_type='withdrawal', source_id=withdrawal.pk, date=withdrawal.date, amount=-withdrawal.amount, vault=withdrawal.vault))
+            if withdrawal.account is not None:
+                entries.append(LedgerEntry(source_type='fund_transfer', source_id=withdrawal.pk, date=withdrawal.date, amount=withdrawal.amount, account=withdrawal.account))
+        LedgerEntry.objects.record_many(entries)
+        changes = {}
+        credits = defaultdict(int)
+        for withdrawal in withdrawals:
+            OperationRollup.objects.merge(changes, OperationRollup.objects.withdrawal_change(withdrawal))
+            if withdrawal.account is not None:
+                credits[withdrawal.account_id] += withdrawal.amount
+        OperationRollup.objects.apply(changes)
+        self.debit(Vault, self.get_debits(rows))
+        for account_id, total in credits.items():
+            Account.objects.filter(pk=account_id).credit(total)
+        return withdrawals
+
+
+IMPORTS = {
+    "collections": CollectionImport,
+    "disbursements": DisbursementImport,
+    "deposits": DepositImport,
+    "withdrawals": WithdrawalImport,
+}
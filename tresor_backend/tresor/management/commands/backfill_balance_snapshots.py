@@ -0,0 +1,48 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum, F
+
+from tresor.models import Account, Vault, BalanceSnapshot, CollectionOperationDetail, DisbursementOperationDetail, VaultDeposit, VaultWithdrawal
+
+
+class Command(BaseCommand):
+    help = "Rebuild the end of day balance snapshots of every account and vault from the operations history"
+
+    def handle(self, *args, **options):
+        # net change per owner and per day, one grouped query per kind of operation
+        account_changes = defaultdict(lambda: defaultdict(int))
+        vault_changes = defaultdict(lambda: defaultdict(int))
+
+        for row in CollectionOperationDetail.objects.values('destination_account', date=F('parent__date')).annotate(amount=Sum('montant')):
+            account_changes[row['destination_account']][row['date']] += row['amount']
+        for row in DisbursementOperationDetail.objects.values(account=F('parent__account'), date=F('parent__date')).annotate(amount=Sum('montant')):
+            account_changes[row['account']][row['date']] -= row['amount']
+        for row in VaultWithdrawal.objects.filter(account__isnull=False).values('account', 'date').annotate(amount=Sum('amount')):
+            account_changes[row['account']][row['date']] += row['amount']
+        for row in VaultDeposit.objects.values('vault', 'date').annotate(amount=Sum('amount')):
+            vault_changes[row['vault']][row['date']] += row['amount']
+        for row in VaultWithdrawal.objects.values('vault', 'date').annotate(amount=Sum('amount')):
+            vault_changes[row['vault']][row['date']] -= row['amount']
+
+        snapshots = []
+        for account in Account.objects.all():
+            snapshots += self.build_snapshots(account.balance, account_changes[account.pk], account=account)
+        for vault in Vault.objects.all():
+            snapshots += self.build_snapshots(vault.balance, vault_changes[vault.pk], vault=vault)
+
+        with transaction.atomic():
+            BalanceSnapshot.objects.all().delete()
+            BalanceSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(f"{len(snapshots)} balance snapshots created"))
+
+    def build_snapshots(self, balance, changes, **owner):
+        # the current balance is the closing balance of the last day, we work backwards from there
+        ret = []
+        for date in sorted(changes, reverse=True):
+            if changes[date] == 0:
+                continue
+            ret.append(BalanceSnapshot(date=date, balance=balance, delta=changes[date], **owner))
+            balance -= changes[date]
+        return ret
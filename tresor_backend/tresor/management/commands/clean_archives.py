@@ -0,0 +1,23 @@
+import glob
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Remove the attachment archives not downloaded for ARCHIVE_EXPIRY_DAYS, and the ones left unfinished"
+
+    def handle(self, *args, **options):
+        limit = time.time() - settings.ARCHIVE_EXPIRY_DAYS * 24 * 3600
+        count = size = 0
+        for pattern in ("*.zip", "*.part"):
+            for path in glob.glob(os.path.join(glob.escape(settings.ARCHIVES_ROOT), pattern)):
+                # an archive being written is a part touched less than an hour ago
+                stat = os.stat(path)
+                if stat.st_mtime < (limit if pattern == "*.zip" else time.time() - 3600):
+                    os.remove(path)
+                    count += 1
+                    size += stat.st_size
+        self.stdout.write(self.style.SUCCESS(f"{count} archives removed, {size} bytes"))
@@ -0,0 +1,19 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tresor.models import Upload
+
+
+class Command(BaseCommand):
+    help = "Remove the uploads that were not given to an operation after UPLOAD_EXPIRY_HOURS, with their file"
+
+    def handle(self, *args, **options):
+        expired = Upload.objects.filter(updated_at__lt=timezone.now() - datetime.timedelta(hours=settings.UPLOAD_EXPIRY_HOURS))
+        count = 0
+        for upload in expired.iterator():
+            upload.discard()
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"{count} uploads removed"))
@@ -0,0 +1,52 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.http import QueryDict
+
+from tresor.models import CollectionOperation, DisbursementOperation, VaultDeposit, VaultWithdrawal
+from tresor.utils import filter_query_by_params
+
+
+class Command(BaseCommand):
+    help = "Print the query plan of the first page of the operation lists, --check fails when one of them scans a whole table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', default=str(datetime.date.today().year), help="value of ?date= for the filtered lists")
+        parser.add_argument('--check', action='store_true', help="fail if a list query is not answered by an index (postgresql only)")
+
+    def get_queries(self, date):
+        params = QueryDict(f"date={date}")
+        ordering = ['-date', '-created_at']
+        for model, filters in [
+            (CollectionOperation, [{}, {"type": "operation"}, {"created_by": 1}]),
+            (DisbursementOperation, [{}, {"account": 1}, {"type": "operation"}, {"created_by": 1}]),
+            (VaultDeposit, [{}, {"vault__group": 1}, {"created_by": 1}]),
+            (VaultWithdrawal, [{}, {"vault__group": 1}, {"account": 1}, {"created_by": 1}]),
+        ]:
+            for filter in filters:
+                name = f"{model.__name__} {filter or ''}".strip()
+                queryset = model.objects.filter(**filter).order_by(*ordering)
+                yield name, queryset[:10]
+                yield f"{name} date={date}", filter_query_by_params(queryset, params)[:10]
+
+    def handle(self, *args, **options):
+        postgresql = connection.vendor == "postgresql"
+        if options['check'] and not postgresql:
+            raise CommandError("--check needs postgresql, the plans of the other databases are only printed")
+        failures = []
+        with transaction.atomic():
+            if postgresql:
+                # with few rows a sequential scan is always cheaper, this tells whether an index *can* answer the query
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            for name, queryset in self.get_queries(options['date']):
+                plan = queryset.explain()
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                self.stdout.write(plan + "\n")
+                if postgresql and f'Seq Scan on {queryset.model._meta.db_table}' in plan:
+                    failures.append(name)
+
+        if failures:
+            raise CommandError("no index used for: " + ", ".join(failures))
+        if options['check']:
+            self.stdout.write(self.style.SUCCESS("every list query uses an index"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.models import User
+from tresor.imports import IMPORTS, read_rows
+
+
+class Command(BaseCommand):
+    help = "Import a csv or xlsx file of collections, disbursements, deposits or withdrawals in one transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(IMPORTS))
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help="username of the creator of the operations")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"unknown user {options['user']}")
+        format = "xlsx" if options['path'].lower().endswith(".xlsx") else "csv"
+        with open(options['path'], 'rb') as file:
+            rows = read_rows(file, format)
+
+        operation_import = IMPORTS[options['kind']](rows, user)
+        errors = operation_import.run()
+        for error in errors:
+            self.stderr.write(f"line {error['row']}: " + ", ".join(f"{column} {' '.join(codes)}" for column, codes in error['errors'].items()))
+        if errors:
+            raise CommandError(f"{len(errors)} lines with errors, nothing was imported")
+        self.stdout.write(self.style.SUCCESS(f"{len(operation_import.created)} operations imported from {len(rows)} lines"))
@@ -0,0 +1,52 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from tresor.models import Account, Vault, LedgerEntry, CollectionOperationDetail, DisbursementOperation, VaultDeposit, VaultWithdrawal
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ledger entries of every account and vault from the operations history"
+
+    def handle(self, *args, **options):
+        # (date, created_at, source_type, source_id, amount) per owner
+        account_movements = defaultdict(list)
+        vault_movements = defaultdict(list)
+
+        details = CollectionOperationDetail.objects.values_list('destination_account', 'parent__date', 'created_at', 'pk', 'montant')
+        for account, date, created_at, pk, amount in details.iterator():
+            account_movements[account].append((date, created_at, 'collection', pk, amount))
+        disbursements = DisbursementOperation.objects.annotate(amount=Sum('details__montant')).values_list('account', 'date', 'created_at', 'pk', 'amount')
+        for account, date, created_at, pk, amount in disbursements.iterator():
+            account_movements[account].append((date, created_at, 'disbursement', pk, -(amount or 0)))
+        fund_transfers = VaultWithdrawal.objects.filter(account__isnull=False).values_list('account', 'date', 'created_at', 'pk', 'amount')
+        for account, date, created_at, pk, amount in fund_transfers.iterator():
+            account_movements[account].append((date, created_at, 'fund_transfer', pk, amount))
+        for vault, date, created_at, pk, amount in VaultDeposit.objects.values_list('vault', 'date', 'created_at', 'pk', 'amount').iterator():
+            vault_movements[vault].append((date, created_at, 'deposit', pk, amount))
+        for vault, date, created_at, pk, amount in VaultWithdrawal.objects.values_list('vault', 'date', 'created_at', 'pk', 'amount').iterator():
+            vault_movements[vault].append((date, created_at, 'withdrawal', pk, -amount))
+
+        entries = []
+        for account in Account.objects.all():
+            entries += self.build_entries(account.balance, account_movements[account.pk], account=account)
+        for vault in Vault.objects.all():
+            entries += self.build_entries(vault.balance, vault_movements[vault.pk], vault=vault)
+
+        with transaction.atomic():
+            LedgerEntry.objects.all().delete()
+            LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(f"{len(entries)} ledger entries created"))
+
+    def build_entries(self, balance, movements, **owner):
+        # the current balance is the balance after the last movement, we work backwards from there
+        movements.sort(key=lambda movement: movement[:2])
+        ret = []
+        for date, created_at, source_type, source_id, amount in reversed(movements):
+            ret.append(LedgerEntry(date=date, amount=amount, balance=balance, source_type=source_type, source_id=source_id, **owner))
+            balance -= amount
+        # ids follow the insertion order, which must be the chronological one
+        ret.reverse()
+        return ret
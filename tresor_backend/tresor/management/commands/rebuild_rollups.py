@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum, Count, F, OuterRef, Subquery
+from django.db.models.functions import TruncMonth
+
+from tresor.models import OperationRollup, CollectionOperation, CollectionOperationDetail, DisbursementOperation, VaultDeposit, VaultWithdrawal
+
+
+class Command(BaseCommand):
+    help = "Rebuild the monthly operation rollups from the operations history"
+
+    def handle(self, *args, **options):
+        # (period, kind, type, created_by, account, vault) => rollup, one grouped query per kind of operation
+        rollups = {}
+
+        def rollup(row, kind, **fields):
+            key = (row['period'], kind, row.get('type', ""), row['created_by'], row.get('account'), row.get('vault'))
+            if key not in rollups:
+                rollups[key] = OperationRollup(period=key[0], kind=kind, type=key[2], created_by_id=key[3], account_id=key[4], vault_id=key[5])
+            for name, value in fields.items():
+                setattr(rollups[key], name, getattr(rollups[key], name) + value)
+
+        details = CollectionOperationDetail.objects.values(
+            period=TruncMonth('parent__date'), account=F('destination_account'), type=F('parent__type'), created_by=F('parent__created_by'),
+        ).annotate(total=Sum('montant'), count=Count('parent', distinct=True))
+        for row in details:
+            rollup(row, 'collection', total=row['total'], count=row['count'])
+        # a collection is counted once in `operations`, on the account of its first detail
+        first_account = CollectionOperationDetail.objects.filter(parent=OuterRef('pk')).order_by('pk').values('destination_account')[:1]
+        collections = CollectionOperation._base_manager.annotate(first_account=Subquery(first_account)).filter(first_account__isnull=False).values(
+            'type', 'created_by', period=TruncMonth('date'), account=F('first_account'),
+        ).annotate(operations=Count('id'))
+        for row in collections:
+            rollup(row, 'collection', operations=row['operations'])
+
+        disbursements = DisbursementOperation._base_manager.values('account', 'type', 'created_by', period=TruncMonth('date')).annotate(
+            total=Sum('details__montant'), count=Count('id', distinct=True))
+        for row in disbursements:
+            rollup(row, 'disbursement', total=row['total'] or 0, count=row['count'], operations=row['count'])
+        for row in VaultDeposit.objects.values('vault', 'created_by', period=TruncMonth('date')).annotate(total=Sum('amount'), count=Count('id')):
+            rollup(row, 'deposit', total=row['total'], count=row['count'], operations=row['count'])
+        for row in VaultWithdrawal.objects.values('vault', 'account', 'created_by', period=TruncMonth('date')).annotate(total=Sum('amount'), count=Count('id')):
+            rollup(row, 'withdrawal', total=row['total'], count=row['count'], operations=row['count'])
+
+        with transaction.atomic():
+            OperationRollup.objects.all().delete()
+            OperationRollup.objects.bulk_create(rollups.values(), batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(f"{len(rollups)} rollups created"))
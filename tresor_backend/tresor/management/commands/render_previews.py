@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tresor.models import CollectionOperation, DisbursementOperation, Rendition
+from tresor.renditions import render
+
+
+class Command(BaseCommand):
+    help = "Build the thumbnails and previews of the uploaded attachments, the background worker of the uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', action='store_true', help="keep running and wait for new uploads")
+        parser.add_argument('--interval', type=float, default=5, help="seconds to wait when there is nothing to build")
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--missing', action='store_true', help="queue the attachments stored before the renditions first")
+        parser.add_argument('--retry-failed', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['missing']:
+            for model in (CollectionOperation, DisbursementOperation):
+                names = model._base_manager.exclude(file=None).exclude(file="").values_list('file', flat=True).distinct()
+                Rendition.objects.request(names.iterator())
+        if options['retry_failed']:
+            Rendition.objects.filter(status='failed').update(status='pending', error="")
+
+        built = 0
+        while True:
+            renditions = Rendition.objects.claim(options['batch_size'])
+            for rendition in renditions:
+                try:
+                    render(rendition)
+                    rendition.error = ""
+                except Exception as e:
+                    # a broken file does not stop the worker, it is kept for --retry-failed
+                    rendition.status, rendition.error = 'failed', str(e)[:255]
+                    self.stderr.write(f"{rendition.source}: {e}")
+                rendition.save()
+                built += 1
+            if not renditions:
+                if not options['watch']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"{built} renditions built"))
@@ -0,0 +1,49 @@
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from tresor.models import CollectionOperation, DisbursementOperation
+from tresor.storage import ContentAddressedStorage
+
+
+class Command(BaseCommand):
+    help = "Move the attachments stored before the content addressed storage to it, the copies of a same file are stored once"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-originals', action='store_true', help="do not recompress the large images")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        if not isinstance(storage, ContentAddressedStorage):
+            self.stderr.write("the default storage is not tresor.storage.ContentAddressedStorage")
+            return
+        prefix = f"{ContentAddressedStorage.directory}/"
+        # old name => new name
+        stored, old_size = {}, 0
+        for model in (CollectionOperation, DisbursementOperation):
+            operations = model._base_manager.exclude(file=None).exclude(file="").exclude(file__startswith=prefix)
+            for pk, name in operations.values_list('pk', 'file').iterator():
+                if name not in stored:
+                    if not storage.exists(name):
+                        self.stderr.write(f"{model.__name__} {pk}: {name} is missing")
+                        continue
+                    old_size += storage.size(name)
+                    if options['dry_run']:
+                        stored[name] = name
+                        continue
+                    with storage.open(name, 'rb') as f:
+                        content = File(f, name=name)
+                        content.keep_original = options['keep_originals']
+                        stored[name] = storage.save(name, content)
+                if not options['dry_run']:
+                    # update() so the operations keep their updated_at
+                    model._base_manager.filter(pk=pk).update(file=stored[name])
+
+        if options['dry_run']:
+            self.stdout.write(f"{len(stored)} files to move, {old_size} bytes")
+            return
+        for name in stored:
+            storage.delete(name)
+        new_size = sum(storage.size(name) for name in set(stored.values()))
+        self.stdout.write(f"{len(stored)} files moved to {len(set(stored.values()))}, {old_size} bytes before, {new_size} after")
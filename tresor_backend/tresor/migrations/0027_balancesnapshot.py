@@ -0,0 +1,37 @@
+# Generated by Django 5.0.4 on 2026-10-18 15:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tresor', '0026_alter_vaultwithdrawal_ref'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('delta', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='tresor.account')),
+                ('vault', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='tresor.vault')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='balancesnapshot',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('account__isnull', False), ('vault__isnull', True)), models.Q(('account__isnull', True), ('vault__isnull', False)), _connector='OR'), name='balance_snapshot_single_owner'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancesnapshot',
+            constraint=models.UniqueConstraint(condition=models.Q(('account__isnull', False)), fields=('account', 'date'), name='unique_account_balance_snapshot'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancesnapshot',
+            constraint=models.UniqueConstraint(condition=models.Q(('vault__isnull', False)), fields=('vault', 'date'), name='unique_vault_balance_snapshot'),
+        ),
+    ]
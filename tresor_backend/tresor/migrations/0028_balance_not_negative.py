@@ -0,0 +1,21 @@
+# Generated by Django 5.0.4 on 2026-10-18 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tresor', '0027_balancesnapshot'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='account',
+            constraint=models.CheckConstraint(check=models.Q(('balance__gte', 0)), name='account_balance_not_negative'),
+        ),
+        migrations.AddConstraint(
+            model_name='vault',
+            constraint=models.CheckConstraint(check=models.Q(('balance__gte', 0)), name='vault_balance_not_negative'),
+        ),
+    ]
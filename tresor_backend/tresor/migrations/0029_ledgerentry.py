@@ -0,0 +1,35 @@
+# Generated by Django 5.0.4 on 2026-10-18 15:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tresor', '0028_balance_not_negative'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('source_type', models.CharField(choices=[('collection', 'Collection'), ('disbursement', 'Disbursement'), ('fund_transfer', 'Fund transfer'), ('deposit', 'Deposit'), ('withdrawal', 'Withdrawal')], max_length=20)),
+                ('source_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='tresor.account')),
+                ('vault', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='tresor.vault')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'date', 'id'], name='ledger_account_date_idx'), models.Index(fields=['vault', 'date', 'id'], name='ledger_vault_date_idx'), models.Index(fields=['source_type', 'source_id'], name='ledger_source_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ledgerentry',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('account__isnull', False), ('vault__isnull', True)), models.Q(('account__isnull', True), ('vault__isnull', False)), _connector='OR'), name='ledger_entry_single_owner'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.4 on 2026-10-18 15:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tresor', '0029_ledgerentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('kind', models.CharField(choices=[('collection', 'Collection'), ('disbursement', 'Disbursement'), ('deposit', 'Deposit'), ('withdrawal', 'Withdrawal')], max_length=20)),
+                ('type', models.CharField(blank=True, default='', max_length=255)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('operations', models.IntegerField(default=0)),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='tresor.account')),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to=settings.AUTH_USER_MODEL)),
+                ('vault', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='tresor.vault')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='operationrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('account__isnull', False), ('vault__isnull', True)), fields=('period', 'kind', 'type', 'created_by', 'account'), name='unique_account_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='operationrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('account__isnull', True), ('vault__isnull', False)), fields=('period', 'kind', 'type', 'created_by', 'vault'), name='unique_vault_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='operationrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('account__isnull', False), ('vault__isnull', False)), fields=('period', 'kind', 'type', 'created_by', 'account', 'vault'), name='unique_fund_transfer_rollup'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.0.4 on 2026-10-18 15:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tresor', '0030_operationrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collectionoperation',
+            index=models.Index(fields=['-date', '-created_at'], name='collection_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='collectionoperation',
+            index=models.Index(fields=['type', '-date', '-created_at'], name='collection_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='collectionoperation',
+            index=models.Index(fields=['created_by', '-date', '-created_at'], name='collection_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='disbursementoperation',
+            index=models.Index(fields=['-date', '-created_at'], name='disbursement_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='disbursementoperation',
+            index=models.Index(fields=['account', '-date', '-created_at'], name='disbursement_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='disbursementoperation',
+            index=models.Index(fields=['type', '-date', '-created_at'], name='disbursement_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='disbursementoperation',
+            index=models.Index(fields=['created_by', '-date', '-created_at'], name='disbursement_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaultdeposit',
+            index=models.Index(fields=['-date', '-created_at'], name='deposit_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaultdeposit',
+            index=models.Index(fields=['vault', '-date', '-created_at'], name='deposit_vault_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaultdeposit',
+            index=models.Index(fields=['created_by', '-date', '-created_at'], name='deposit_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaultwithdrawal',
+            index=models.Index(fields=['-date', '-created_at'], name='withdrawal_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaultwithdrawal',
+            index=models.Index(fields=['vault', '-date', '-created_at'], name='withdrawal_vault_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaultwithdrawal',
+            index=models.Index(fields=['account', '-date', '-created_at'], name='withdrawal_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaultwithdrawal',
+            index=models.Index(fields=['created_by', '-date', '-created_at'], name='withdrawal_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.0.4 on 2026-10-18 15:52
+
+from django.conf import settings
+import re
+from django.db import migrations, models
+
+
+def fill_ref_numbers(apps, schema_editor):
+    # "0023/2024/DTNDB" => ref_number 23, ref_year 2024, and the counter of every year starts after its last number
+    RefCounter = apps.get_model('tresor', 'RefCounter')
+    for model_name, series, minimum in [('CollectionOperation', 'collection', 216), ('DisbursementOperation', 'disbursement', 465)]:
+        model = apps.get_model('tresor', model_name)
+        counters = {}
+        for obj in model.objects.filter(type="operation").order_by('created_at', 'pk'):
+            match = re.match(r'^(\d+)/(\d{4})/', obj.ref)
+            if match is None:
+                continue
+            ref_number, ref_year = int(match[1]), int(match[2])
+            if ref_number in counters.setdefault(ref_year, set()):
+                # a number given twice before the counter existed, the first operation keeps it
+                continue
+            counters[ref_year].add(ref_number)
+            model.objects.filter(pk=obj.pk).update(ref_number=ref_number, ref_year=ref_year)
+        for year, numbers in counters.items():
+            last = max(numbers)
+            if year == 2024:
+                last = max(last, minimum - 1)
+            RefCounter.objects.create(series=series, year=year, last=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tresor', '0031_operation_list_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(max_length=20)),
+                ('year', models.IntegerField()),
+                ('last', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='collectionoperation',
+            name='ref_number',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='collectionoperation',
+            name='ref_year',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='disbursementoperation',
+            name='ref_number',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='disbursementoperation',
+            name='ref_year',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_ref_numbers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='collectionoperation',
+            constraint=models.UniqueConstraint(fields=('ref_year', 'ref_number'), name='unique_collection_ref'),
+        ),
+        migrations.AddConstraint(
+            model_name='disbursementoperation',
+            constraint=models.UniqueConstraint(fields=('ref_year', 'ref_number'), name='unique_disbursement_ref'),
+        ),
+        migrations.AddConstraint(
+            model_name='refcounter',
+            constraint=models.UniqueConstraint(fields=('series', 'year'), name='unique_ref_counter'),
+        ),
+        migrations.AddIndex(
+            model_name='collectionoperation',
+            index=models.Index(fields=['ref_number'], name='collection_ref_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='disbursementoperation',
+            index=models.Index(fields=['ref_number'], name='disbursement_ref_number_idx'),
+        ),
+    ]
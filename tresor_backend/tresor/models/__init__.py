@@ -1,3 +1,9 @@
+from .balance_snapshot import *
+from .ledger import *
+from .rollup import *
+from .ref_counter import *
+from .rendition import *
+from .upload import *
 from .account import *
 from .collection_operation import *
 from .disbursement_operation import *
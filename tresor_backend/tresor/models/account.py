@@ -1,5 +1,21 @@
 from django.db import models    
+from django.db.models import F, Q
+from django.utils import timezone
 from rest_framework import serializers
+from .balance_snapshot import BalanceSnapshot
+from ..sparse import SparseFieldsMixin
+
+
+class BalanceQuerySet(models.QuerySet):
+    # balance changes are done with a single UPDATE so concurrent operations can not lose each other's changes
+
+    def credit(self, amount):
+        return self.update(balance=F('balance') + amount, updated_at=timezone.now())
+
+    def debit(self, amount):
+        # returns 0 when the balance is not enough, the check and the change are the same statement
+        return self.filter(balance__gte=amount).update(balance=F('balance') - amount, updated_at=timezone.now())
+
 
 class Account(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -7,29 +23,23 @@ class Account(models.Model):
     balance = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BalanceQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(check=Q(balance__gte=0), name='account_balance_not_negative'),
+        ]
     
     def __str__(self):
         return self.name + " - " + self.number
     
     def get_solde_at_date(self, date):
-        # we will get all the operrations done after the date and we will calculate the balance
-        # we will get all the collection operations details and disbursement operations
-        collection_operations_details = self.collection_operations_details.filter(parent__date__gt=date)
-        disbursement_operations = self.disbursement_operations.filter(date__gt=date)
-        fund_transfers = self.fund_transfers.filter(date__gt=date)
-
-        solde = self.balance
-        for operation_detail in collection_operations_details:
-            solde -= operation_detail.montant
-        for fund_transfer in fund_transfers:
-            solde -= fund_transfer.amount
-        for operation in disbursement_operations:
-            solde += operation.total
-        return solde
+        return BalanceSnapshot.objects.balance_at(date, account=self)
         
 
     
-class AccountSerializer(serializers.ModelSerializer):
+class AccountSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Account
         fields = '__all__'
@@ -0,0 +1,82 @@
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q, Case, When, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+class BalanceSnapshotManager(models.Manager):
+
+    def _owner(self, account=None, vault=None):
+        if account is not None:
+            return {"account": account}
+        return {"vault": vault}
+
+    def record(self, date, amount, account=None, vault=None):
+        # keeps the end of day balance of the owner up to date after a change of `amount` at `date`
+        # must be called inside the transaction of the operation, before the owner balance is changed
+        owner = self._owner(account, vault)
+        snapshots = self.filter(**owner)
+        if not snapshots.filter(date=date).exists():
+            try:
+                with transaction.atomic():
+                    self.create(date=date, balance=self._opening_balance(snapshots, date, account or vault), delta=0, **owner)
+            except IntegrityError:
+                # created by a concurrent operation of the same owner and day
+                pass
+        snapshots.filter(date__gte=date).update(
+            balance=F('balance') + amount,
+            delta=Case(When(date=date, then=F('delta') + amount), default=F('delta')),
+        )
+        # a day whose operations cancel out is the same as a day without operations
+        snapshots.filter(date=date, delta=0).delete()
+
+    def _opening_balance(self, snapshots, date, owner):
+        previous = snapshots.filter(date__lt=date).order_by('-date').first()
+        if previous is not None:
+            return previous.balance
+        following = snapshots.filter(date__gt=date).order_by('date').first()
+        if following is not None:
+            return following.balance - following.delta
+        # no history yet, every operation of the owner happened on or before this date
+        return type(owner).objects.filter(pk=owner.pk).values_list('balance', flat=True).get()
+
+    def balance_at(self, date, account=None, vault=None):
+        owner = self._owner(account, vault)
+        snapshots = self.filter(**owner)
+        snapshot = snapshots.filter(date__lte=date).order_by('-date').first()
+        if snapshot is not None:
+            return snapshot.balance
+        # the date is before the first snapshot, the balance is the opening balance of that day
+        snapshot = snapshots.filter(date__gt=date).order_by('date').first()
+        if snapshot is not None:
+            return snapshot.balance - snapshot.delta
+        return (account or vault).balance
+
+    def balance_at_expression(self, date, owner_field):
+        # same as balance_at but as an annotation for a queryset of accounts or vaults
+        snapshots = self.filter(**{owner_field: OuterRef('pk')})
+        return Coalesce(
+            Subquery(snapshots.filter(date__lte=date).order_by('-date').values('balance')[:1]),
+            Subquery(snapshots.filter(date__gt=date).order_by('date').annotate(opening=F('balance') - F('delta')).values('opening')[:1]),
+            F('balance'),
+        )
+
+
+class BalanceSnapshot(models.Model):
+    # end of day balance of an account or a vault, one row per day where the balance changed
+    account = models.ForeignKey('Account', on_delete=models.CASCADE, null=True, blank=True, related_name='balance_snapshots')
+    vault = models.ForeignKey('Vault', on_delete=models.CASCADE, null=True, blank=True, related_name='balance_snapshots')
+    date = models.DateField()
+    balance = models.DecimalField(max_digits=10, decimal_places=2)
+    delta = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    objects = BalanceSnapshotManager()
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=(Q(account__isnull=False) & Q(vault__isnull=True)) | (Q(account__isnull=True) & Q(vault__isnull=False)),
+                name='balance_snapshot_single_owner',
+            ),
+            models.UniqueConstraint(fields=['account', 'date'], condition=Q(account__isnull=False), name='unique_account_balance_snapshot'),
+            models.UniqueConstraint(fields=['vault', 'date'], condition=Q(vault__isnull=False), name='unique_vault_balance_snapshot'),
+        ]
@@ -2,16 +2,70 @@ from collections import defaultdict
 from django.db import models
 from rest_framework import serializers
 from django.db import transaction
+from django.utils import timezone
 from ..models.account import AccountSerializer, Account
+from ..models.ledger import LedgerEntry
+from ..models.rollup import OperationRollup
+from ..models.ref_counter import RefCounter
+from ..models.rendition import Rendition
+from ..nested import diff_details, apply_balance_changes
+from ..sparse import SparseFieldsMixin, load_only
+from ..models.upload import UploadField
+from ..storage import MediaFileField, RenditionField, take_file
 
 
 class CollectionOperationManager(models.Manager):
+    # the values the serializer reads from the annotations
+    annotations = {
+        'total': models.Sum('details__montant'),
+        'created_by_name': models.F('created_by__username'),
+        # the renditions of the file, see render_previews
+        'thumbnail': Rendition.objects.url_expression('thumbnail'),
+        'preview': Rendition.objects.url_expression('preview'),
+    }
+
     def get_queryset(self):
         ret = super().get_queryset()
-        ret = ret.annotate(total = models.Sum('details__montant'))
-        ret =  ret.annotate(created_by_name = models.F('created_by__username'))
+        ret = ret.annotate(**self.annotations)
+        return ret
+
+    def with_details(self, fields=None):
+        # everything the serializer reads, in one query for the operations and one for all their details
+        # with the fields of a sparse read (?fields=, ?expand=), only what they read is queried
+        if fields is None:
+            details = CollectionOperationDetail.objects.select_related('destination_account').order_by('pk')
+            return self.get_queryset().prefetch_related(models.Prefetch('details', queryset=details))
+        ret = super().get_queryset().annotate(**{name: value for name, value in self.annotations.items() if name in fields})
+        ret = load_only(ret, fields)
+        if 'details' in fields:
+            detail_fields = fields['details'].child.fields
+            details = load_only(CollectionOperationDetail.objects.order_by('pk'), detail_fields, 'parent')
+            if 'account_data' in detail_fields:
+                details = details.select_related('destination_account')
+            ret = ret.prefetch_related(models.Prefetch('details', queryset=details))
         return ret
 
+    def remove(self, operations):
+        # deletes the operations with their ledger entries and rollups and takes back what they gave to the accounts,
+        # once per account. False when an account has not enough left, the caller rolls back its transaction
+        details = defaultdict(list)
+        debits = defaultdict(int)
+        for detail in CollectionOperationDetail.objects.filter(parent__in=operations).order_by('pk'):
+            details[detail.parent_id].append(detail)
+            debits[detail.destination_account_id] += detail.montant
+        LedgerEntry.objects.remove('collection', [detail.pk for operation_details in details.values() for detail in operation_details])
+        changes = {}
+        for operation in operations:
+            if details[operation.pk]:
+                OperationRollup.objects.merge(changes, OperationRollup.objects.collection_change(
+                    operation, [(detail.destination_account_id, detail.montant) for detail in details[operation.pk]], sign=-1))
+        OperationRollup.objects.apply(changes)
+        for pk, total in debits.items():
+            if not Account.objects.filter(pk=pk).debit(total):
+                return False
+        self.model._base_manager.filter(pk__in=[operation.pk for operation in operations]).delete()
+        return True
+
 class CollectionOperation(models.Model):
     date = models.DateField()
     motif = models.CharField(max_length=255)
@@ -23,24 +77,36 @@ class CollectionOperation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey('authentication.User', on_delete=models.PROTECT, related_name='collection_operations')
+    # number and year of the ref, set for the "operation" type only
+    ref_number = models.IntegerField(null=True, blank=True, editable=False)
+    ref_year = models.IntegerField(null=True, blank=True, editable=False)
 
     objects = CollectionOperationManager()
 
+    class Meta:
+        # the lists are ordered by -date, -created_at and filtered on these fields
+        indexes = [
+            models.Index(fields=['-date', '-created_at'], name='collection_date_idx'),
+            models.Index(fields=['type', '-date', '-created_at'], name='collection_type_date_idx'),
+            models.Index(fields=['created_by', '-date', '-created_at'], name='collection_user_date_idx'),
+            # ref searches without a year
+            models.Index(fields=['ref_number'], name='collection_ref_number_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['ref_year', 'ref_number'], name='unique_collection_ref'),
+        ]
+
+    @classmethod
+    def first_ref_number(cls, year):
+        # used once per year, when its counter is created
+        last = cls._base_manager.filter(ref_year=year).aggregate(last=models.Max('ref_number'))['last'] or 0
+        if year == 2024:
+            return max(last + 1, 216)
+        return last + 1
+
     def save(self, *args, **kwargs):
         if not self.pk:
-            if self.type != "operation":
-                self.ref = "-"
-            else:
-                last = CollectionOperation.objects.filter(date__year=self.date.year, type="operation").order_by('created_at').last()
-                ref_number = 1
-                if last and len(last.ref.split("/")) > 1:
-                    # 0023/2024/DTNCR
-                    
-                    last_ref = last.ref.split('/')[0]
-                    ref_number = int(last_ref) + 1
-                if self.date.year == 2024 and ref_number <= 215:
-                    ref_number = 216
-                self.ref = f"{ref_number:04d}/{self.date.year}/DTNDB"  
+            RefCounter.objects.assign("collection", [self], self.first_ref_number)
         super().save(*args, **kwargs)
 
 class CollectionOperationDetail(models.Model):
@@ -55,46 +121,97 @@ class CollectionOperationDetail(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
 
-class CollectionOperationDetailSerializer(serializers.ModelSerializer):
+class CollectionOperationDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # sent back on update to change that detail, the details without id are new ones
+    id = serializers.IntegerField(required=False)
     account_data = AccountSerializer(source='destination_account', read_only=True)
     class Meta:
         model = CollectionOperationDetail
         exclude = ['parent']
 
 
-class CollectionOperationSerializer(serializers.ModelSerializer):
+class CollectionOperationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     details = CollectionOperationDetailSerializer(many=True)
     total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     created_by_name = serializers.CharField(read_only=True)
+    file = MediaFileField(max_length=100, required=False, allow_null=True)
+    # small images of the file for the lists, built in the background after the upload
+    thumbnail = RenditionField()
+    preview = RenditionField()
+    # an uploaded image is stored as it is instead of recompressed
+    keep_original = serializers.BooleanField(write_only=True, required=False, default=False)
+    # a file sent before in parts to /uploads/, instead of the file
+    upload = UploadField()
 
     def validate_details(self, value):  
-        type = self.initial_data.get('type' , "operation")
-
         if len(value) == 0:
             raise serializers.ValidationError("EMPTY_DETAILS")
-        if type == "rejected" and len(value) > 1:
-            raise serializers.ValidationError("REJECTED_OPERATION_MULTIPLE_DETAILS")
         return value
 
+    def validate(self, attrs):
+        # the type is read from the validated data, initial_data is not set on the items of a batch
+        type = attrs.get('type', getattr(self.instance, 'type', "operation"))
+        if type == "rejected" and 'details' in attrs and len(attrs['details']) > 1:
+            raise serializers.ValidationError({"details": ["REJECTED_OPERATION_MULTIPLE_DETAILS"]})
+        return attrs
+
     class Meta:
         model = CollectionOperation
         fields = '__all__'
         read_only_fields = ['created_by']
 
 
+    detail_fields = ['cheque_number', 'name', 'banq_name', 'montant', 'destination_account']
+
     def create(self, validated_data):
         validated_data['created_by'] = self.context['request'].user
-        children = validated_data.pop('details')
-        account_increments = defaultdict(int)
+        children = [{field: value for field, value in child.items() if field != 'id'} for child in validated_data.pop('details')]
         with transaction.atomic():
+            take_file(validated_data)
             parent = CollectionOperation.objects.create(**validated_data)
-            for child in children:
-                c =CollectionOperationDetail.objects.create(parent=parent, **child)
-                account_increments[c.destination_account] += c.montant
-  
-            for account, increment in account_increments.items():
-                account.balance += increment
-                account.save()
+            self.save_details(parent, children, [], {})
         return parent
 
-                
+    def update(self, instance, validated_data):
+        children = validated_data.pop('details', None)
+        with transaction.atomic():
+            take_file(validated_data)
+            instance = CollectionOperation._base_manager.select_for_update().get(pk=instance.pk)
+            existing = list(instance.details.select_related('destination_account').order_by('pk'))
+            # the operation as it was is taken out of the rollups, before its fields change
+            changes = OperationRollup.objects.collection_change(instance, [(detail.destination_account_id, detail.montant) for detail in existing], sign=-1) if existing else {}
+            date, type = instance.date, instance.type
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            RefCounter.objects.reassign("collection", instance, type, date)
+            instance.save()
+            self.save_details(instance, children, existing, changes, moved=instance.date != date)
+        return CollectionOperation.objects.with_details().get(pk=instance.pk)
+
+    def save_details(self, parent, children, existing, changes, moved=False):
+        # writes the details with bulk queries, then only the net change of every account goes to the ledger, the rollups and the balances
+        balances = defaultdict(int)
+        for detail in existing:
+            balances[detail.destination_account_id] -= detail.montant
+        if children is None:
+            created, changed, unchanged, deleted = [], [], existing, []
+        else:
+            created, changed, unchanged, deleted = diff_details(existing, children, self.detail_fields)
+        created = CollectionOperationDetail.objects.bulk_create([CollectionOperationDetail(parent=parent, **values) for values in created])
+        for detail in changed:
+            detail.updated_at = timezone.now()
+        CollectionOperationDetail.objects.bulk_update(changed, self.detail_fields + ['updated_at'])
+        CollectionOperationDetail.objects.filter(pk__in=[detail.pk for detail in deleted]).delete()
+        details = sorted(unchanged + changed + created, key=lambda detail: detail.pk)
+
+        # the entries of the removed details and of the ones that changed, or of all of them when the date changed, are written again
+        rewritten = details if moved else changed + created
+        LedgerEntry.objects.replace('collection', [detail.pk for detail in deleted + rewritten], [
+            LedgerEntry(source_type='collection', source_id=detail.pk, date=parent.date, amount=detail.montant, account=detail.destination_account)
+            for detail in rewritten
+        ])
+        OperationRollup.objects.apply(OperationRollup.objects.merge(changes, OperationRollup.objects.collection_change(
+            parent, [(detail.destination_account_id, detail.montant) for detail in details])))
+        for detail in details:
+            balances[detail.destination_account_id] += detail.montant
+        apply_balance_changes(Account.objects, balances, {"details": ["NOT_ENOUGH_BALANCE"]})
@@ -1,18 +1,67 @@
-from datetime import timezone
+from collections import defaultdict
 from django.db import models
 from django.db import transaction
-from django.db.models import F, Sum
+from django.utils import timezone
+from django.db.models import F, Prefetch, Sum
 from rest_framework import serializers
 from ..models.account import Account, AccountSerializer
+from ..models.ledger import LedgerEntry
+from ..models.rollup import OperationRollup
+from ..models.ref_counter import RefCounter
+from ..models.rendition import Rendition
+from ..nested import diff_details, apply_balance_changes
+from ..sparse import SparseFieldsMixin, load_only
+from ..models.upload import UploadField
+from ..storage import MediaFileField, RenditionField, take_file
 
 class DisbursementOperationManager(models.Manager):
+    # the values the serializer reads from the annotations
+    annotations = {
+        'total': Sum('details__montant'),
+        'account_name': F('account__name'),
+        'created_by_name': F('created_by__username'),
+        # the renditions of the file, see render_previews
+        'thumbnail': Rendition.objects.url_expression('thumbnail'),
+        'preview': Rendition.objects.url_expression('preview'),
+    }
+
     def get_queryset(self):
         ret = super().get_queryset()
-        ret = ret.annotate(total = Sum('details__montant'))
-        ret = ret.annotate(account_name = F('account__name'))
-        ret = ret.annotate(created_by_name = F('created_by__username'))
+        ret = ret.annotate(**self.annotations)
+        return ret
+
+    def with_details(self, fields=None):
+        # everything the serializer reads, in one query for the operations and their account and one for all their details
+        # with the fields of a sparse read (?fields=, ?expand=), only what they read is queried
+        if fields is None:
+            details = DisbursementOperationDetail.objects.order_by('pk')
+            return self.get_queryset().select_related('account').prefetch_related(Prefetch('details', queryset=details))
+        ret = super().get_queryset().annotate(**{name: value for name, value in self.annotations.items() if name in fields})
+        ret = load_only(ret, fields)
+        if 'account_data' in fields:
+            ret = ret.select_related('account')
+        if 'details' in fields:
+            details = load_only(DisbursementOperationDetail.objects.order_by('pk'), fields['details'].child.fields, 'parent')
+            ret = ret.prefetch_related(Prefetch('details', queryset=details))
         return ret
-    
+
+    def remove(self, operations):
+        # deletes the operations with their ledger entries and rollups and gives back their total to the accounts,
+        # once per account
+        totals = dict(DisbursementOperationDetail.objects.filter(parent__in=operations).values_list('parent').annotate(total=Sum('montant')).order_by())
+        LedgerEntry.objects.remove('disbursement', [operation.pk for operation in operations])
+        changes = {}
+        credits = defaultdict(int)
+        for operation in operations:
+            total = totals.get(operation.pk, 0)
+            OperationRollup.objects.merge(changes, OperationRollup.objects.disbursement_change(operation, total, sign=-1))
+            credits[operation.account_id] += total
+        OperationRollup.objects.apply(changes)
+        for pk, total in credits.items():
+            Account.objects.filter(pk=pk).credit(total)
+        self.model._base_manager.filter(pk__in=[operation.pk for operation in operations]).delete()
+        return True
+
 class DisbursementOperation(models.Model):
     date = models.DateField()
     account = models.ForeignKey('Account', on_delete=models.CASCADE, related_name='disbursement_operations') 
@@ -26,22 +75,37 @@ class DisbursementOperation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey('authentication.User', on_delete=models.PROTECT, related_name='disbursement_operations')
+    # number and year of the ref, set for the "operation" type only
+    ref_number = models.IntegerField(null=True, blank=True, editable=False)
+    ref_year = models.IntegerField(null=True, blank=True, editable=False)
 
     objects = DisbursementOperationManager()
 
+    class Meta:
+        # the lists are ordered by -date, -created_at and filtered on these fields
+        indexes = [
+            models.Index(fields=['-date', '-created_at'], name='disbursement_date_idx'),
+            models.Index(fields=['account', '-date', '-created_at'], name='disbursement_account_date_idx'),
+            models.Index(fields=['type', '-date', '-created_at'], name='disbursement_type_date_idx'),
+            models.Index(fields=['created_by', '-date', '-created_at'], name='disbursement_user_date_idx'),
+            # ref searches without a year
+            models.Index(fields=['ref_number'], name='disbursement_ref_number_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['ref_year', 'ref_number'], name='unique_disbursement_ref'),
+        ]
+
+    @classmethod
+    def first_ref_number(cls, year):
+        # used once per year, when its counter is created
+        last = cls._base_manager.filter(ref_year=year).aggregate(last=models.Max('ref_number'))['last'] or 0
+        if year == 2024:
+            return max(last + 1, 465)
+        return last + 1
+
     def save(self, *args, **kwargs):
         if not self.pk:
-            if self.type != "operation":
-                self.ref = "-"
-            else:
-                last = DisbursementOperation.objects.filter(date__year=self.date.year, type="operation").order_by('created_at').last()
-                ref_number = 1
-                if last and len(last.ref.split("/")) > 1:
-                    last_ref = last.ref.split('/')[0]
-                    ref_number = int(last_ref) + 1
-                if self.date.year == 2024 and ref_number <= 464:
-                    ref_number = 465
-                self.ref = f"{ref_number:04d}/{self.date.year}/DTNDB"  
+            RefCounter.objects.assign("disbursement", [self], self.first_ref_number)
         super().save(*args, **kwargs)
 
 class DisbursementOperationDetail(models.Model):
@@ -55,16 +119,27 @@ class DisbursementOperationDetail(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
 
-class DisbursementOperationDetailSerializer(serializers.ModelSerializer):
+class DisbursementOperationDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+        # sent back on update to change that detail, the details without id are new ones
+        id = serializers.IntegerField(required=False)
+
         class Meta:
             model = DisbursementOperationDetail
             exclude = ['parent']
 
-class DisbursementOperationSerializer(serializers.ModelSerializer):
+class DisbursementOperationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
      
     details = DisbursementOperationDetailSerializer(many=True)
     total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     created_by_name = serializers.CharField(read_only=True)
+    file = MediaFileField(max_length=100, required=False, allow_null=True)
+    # small images of the file for the lists, built in the background after the upload
+    thumbnail = RenditionField()
+    preview = RenditionField()
+    # an uploaded image is stored as it is instead of recompressed
+    keep_original = serializers.BooleanField(write_only=True, required=False, default=False)
+    # a file sent before in parts to /uploads/, instead of the file
+    upload = UploadField()
     account_name = serializers.CharField( read_only=True)
     account_data = AccountSerializer(source='account', read_only=True)
 
@@ -74,38 +149,68 @@ class DisbursementOperationSerializer(serializers.ModelSerializer):
         read_only_fields = ["created_by"]
 
     def validate_details(self, value):  
-        type = self.initial_data['type'] or "operation"
-
         if len(value) == 0:
             raise serializers.ValidationError("EMPTY_DETAILS")
-        if type == "frais" and len(value) != 1:
-            raise serializers.ValidationError("INVALID_DETAILS")
+        return value
 
+    def validate(self, attrs):
+        # the type is read from the validated data, initial_data is not set on the items of a batch
+        type = attrs.get('type', getattr(self.instance, 'type', "operation"))
+        if type == "frais" and 'details' in attrs and len(attrs['details']) != 1:
+            raise serializers.ValidationError({"details": ["INVALID_DETAILS"]})
+        return attrs
 
-        account = Account.objects.get(pk=self.initial_data['account'])
-        total = 0
-        for item in value:
-            total += item['montant']
-        if total > account.balance:
-            raise serializers.ValidationError("NOT_ENOUGH_BALANCE")
-        return value
 
+    detail_fields = ['montant', 'name', 'banq_name', 'banq_number']
 
     def create(self, validated_data):
         validated_data['created_by'] = self.context['request'].user
-        children = validated_data.pop('details')
+        children = [{field: value for field, value in child.items() if field != 'id'} for child in validated_data.pop('details')]
         with transaction.atomic():
+            take_file(validated_data)
             parent = DisbursementOperation.objects.create(**validated_data)
-            total = 0
-            for child in children:
-                c =DisbursementOperationDetail.objects.create(parent=parent, **child)
-
-                total += c.montant
-            
-            account = parent.account
-            account.balance -= total
-            account.save()
+            self.save_details(parent, children, [], {}, {}, moved=True)
         return parent
 
-
-        
+    def update(self, instance, validated_data):
+        children = validated_data.pop('details', None)
+        with transaction.atomic():
+            take_file(validated_data)
+            instance = DisbursementOperation._base_manager.select_for_update().get(pk=instance.pk)
+            existing = list(instance.details.order_by('pk'))
+            # the operation as it was is taken out of the rollups and its debit given back, before its fields change
+            total = sum(detail.montant for detail in existing)
+            changes = OperationRollup.objects.disbursement_change(instance, total, sign=-1)
+            balances = {instance.account_id: total}
+            date, account_id, type = instance.date, instance.account_id, instance.type
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            RefCounter.objects.reassign("disbursement", instance, type, date)
+            instance.save()
+            moved = (instance.date, instance.account_id) != (date, account_id)
+            self.save_details(instance, children, existing, changes, balances, moved)
+        return DisbursementOperation.objects.with_details().get(pk=instance.pk)
+
+    def save_details(self, parent, children, existing, changes, balances, moved):
+        # writes the details with bulk queries, then only the net change goes to the ledger, the rollups and the balances
+        previous_total = sum(detail.montant for detail in existing)
+        if children is None:
+            created, changed, unchanged, deleted = [], [], existing, []
+        else:
+            created, changed, unchanged, deleted = diff_details(existing, children, self.detail_fields)
+        created = DisbursementOperationDetail.objects.bulk_create([DisbursementOperationDetail(parent=parent, **values) for values in created])
+        for detail in changed:
+            detail.updated_at = timezone.now()
+        DisbursementOperationDetail.objects.bulk_update(changed, self.detail_fields + ['updated_at'])
+        DisbursementOperationDetail.objects.filter(pk__in=[detail.pk for detail in deleted]).delete()
+        total = sum(detail.montant for detail in unchanged + changed + created)
+
+        if moved or total != previous_total:
+            LedgerEntry.objects.replace('disbursement', [parent.pk], [
+                LedgerEntry(source_type='disbursement', source_id=parent.pk, date=parent.date, amount=-total, account=parent.account)
+            ])
+        OperationRollup.objects.apply(OperationRollup.objects.merge(changes, OperationRollup.objects.disbursement_change(parent, total)))
+        balances = defaultdict(int, balances)
+        balances[parent.account_id] -= total
+        # the balance check is part of the update, raising rolls back the whole operation
+        apply_balance_changes(Account.objects, balances, {"details": ["NOT_ENOUGH_BALANCE"]})
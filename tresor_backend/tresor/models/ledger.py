@@ -0,0 +1,137 @@
+from collections import defaultdict
+from django.db import models
+from django.db.models import F, Q
+from .balance_snapshot import BalanceSnapshot
+
+
+class LedgerEntryManager(models.Manager):
+
+    def record(self, source_type, source_id, date, amount, account=None, vault=None):
+        # writes the entry of an operation and keeps the running balances after it right
+        # must be called inside the transaction of the operation, before the owner balance is changed
+        owner = {"account": account} if account is not None else {"vault": vault}
+        self._lock([account or vault])
+        BalanceSnapshot.objects.record(date, amount, account=account, vault=vault)
+        entries = self.filter(**owner)
+        balance = self._balance_before(entries, date, account or vault)
+        entries.filter(date__gt=date).update(balance=F('balance') + amount)
+        return self.create(source_type=source_type, source_id=source_id, date=date, amount=amount, balance=balance + amount, **owner)
+
+    def record_many(self, entries):
+        # same as record for a batch of unsaved entries (with their account or vault set), one update per owner and date
+        # instead of one per entry, the entries of a same owner and date are ordered as given
+        by_owner = defaultdict(list)
+        for entry in entries:
+            owner = ("account", entry.account) if entry.account_id is not None else ("vault", entry.vault)
+            by_owner[owner].append(entry)
+        self._lock([owner for _, owner in by_owner])
+        for (field, owner), owner_entries in by_owner.items():
+            existing = self.filter(**{field: owner})
+            by_date = defaultdict(list)
+            for entry in owner_entries:
+                by_date[entry.date].append(entry)
+            # the balances are computed from the existing entries, before any of them is moved
+            earlier = 0
+            for date in sorted(by_date):
+                balance = self._balance_before(existing, date, owner) + earlier
+                for entry in by_date[date]:
+                    balance += entry.amount
+                    entry.balance = balance
+                earlier += sum(entry.amount for entry in by_date[date])
+            for date, date_entries in by_date.items():
+                amount = sum(entry.amount for entry in date_entries)
+                BalanceSnapshot.objects.record(date, amount, **{field: owner})
+                existing.filter(date__gt=date).update(balance=F('balance') + amount)
+        return self.bulk_create(entries, batch_size=1000)
+
+    def replace(self, source_type, source_ids, entries):
+        # rewrites the entries of edited operations, the new entries are written before the old ones are removed:
+        # an owner left without entries would have its balance before the edit read by record_many
+        previous = list(self.filter(source_type=source_type, source_id__in=source_ids).select_related('account', 'vault'))
+        self._lock([entry.account or entry.vault for entry in previous + list(entries)])
+        created = self.record_many(entries)
+        self._remove(self.filter(pk__in=[entry.pk for entry in previous]))
+        return created
+
+    def remove(self, source_type, source_ids):
+        self._remove(self.filter(source_type=source_type, source_id__in=source_ids))
+
+    def _remove(self, queryset):
+        removed = list(queryset.select_related('account', 'vault'))
+        self._lock([entry.account or entry.vault for entry in removed])
+        for entry in removed:
+            owner = {"account": entry.account} if entry.account is not None else {"vault": entry.vault}
+            BalanceSnapshot.objects.record(entry.date, -entry.amount, **owner)
+            self.filter(**owner).filter(Q(date__gt=entry.date) | Q(date=entry.date, id__gt=entry.id)).update(balance=F('balance') - entry.amount)
+            entry.delete()
+
+    def _lock(self, owners):
+        # the rows of the accounts and vaults are locked before their running balance is read: a concurrent operation
+        # on the same owner waits for the commit and then reads the entries written by this one. The vaults are locked
+        # before the accounts, in the order of the fund transfers, so two operations never wait for each other
+        by_model = defaultdict(set)
+        for owner in owners:
+            by_model[type(owner)].add(owner.pk)
+        for model in sorted(by_model, key=lambda model: model._meta.model_name != 'vault'):
+            list(model.objects.select_for_update().filter(pk__in=by_model[model]).order_by('pk').values_list('pk', flat=True))
+
+    def _balance_before(self, entries, date, owner):
+        previous = entries.filter(date__lte=date).order_by('-date', '-id').first()
+        if previous is not None:
+            return previous.balance
+        following = entries.filter(date__gt=date).order_by('date', 'id').first()
+        if following is not None:
+            return following.balance - following.amount
+        return type(owner).objects.filter(pk=owner.pk).values_list('balance', flat=True).get()
+
+    def balance_at(self, date, account=None, vault=None):
+        owner = {"account": account} if account is not None else {"vault": vault}
+        entries = self.filter(**owner)
+        entry = entries.filter(date__lte=date).order_by('-date', '-id').first()
+        if entry is not None:
+            return entry.balance
+        entry = entries.filter(date__gt=date).order_by('date', 'id').first()
+        if entry is not None:
+            return entry.balance - entry.amount
+        return (account or vault).balance
+
+    def between(self, start_date, end_date, account=None, vault=None):
+        owner = {"account": account} if account is not None else {"vault": vault}
+        return self.filter(date__gte=start_date, date__lte=end_date, **owner).order_by('date', 'id')
+
+
+class LedgerEntry(models.Model):
+    # one row per balance change of an account or a vault, with the balance right after it
+    SOURCE_TYPES = [
+        ('collection', 'Collection'),
+        ('disbursement', 'Disbursement'),
+        ('fund_transfer', 'Fund transfer'),
+        ('deposit', 'Deposit'),
+        ('withdrawal', 'Withdrawal'),
+    ]
+
+    account = models.ForeignKey('Account', on_delete=models.CASCADE, null=True, blank=True, related_name='ledger_entries')
+    vault = models.ForeignKey('Vault', on_delete=models.CASCADE, null=True, blank=True, related_name='ledger_entries')
+    date = models.DateField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    balance = models.DecimalField(max_digits=10, decimal_places=2)
+    # collection => CollectionOperationDetail, disbursement => DisbursementOperation, the others => VaultDeposit / VaultWithdrawal
+    source_type = models.CharField(max_length=20, choices=SOURCE_TYPES)
+    source_id = models.BigIntegerField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = LedgerEntryManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'date', 'id'], name='ledger_account_date_idx'),
+            models.Index(fields=['vault', 'date', 'id'], name='ledger_vault_date_idx'),
+            models.Index(fields=['source_type', 'source_id'], name='ledger_source_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=(Q(account__isnull=False) & Q(vault__isnull=True)) | (Q(account__isnull=True) & Q(vault__isnull=False)),
+                name='ledger_entry_single_owner',
+            ),
+        ]
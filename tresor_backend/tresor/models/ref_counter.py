@@ -0,0 +1,60 @@
+from collections import defaultdict
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+
+
+class RefCounterManager(models.Manager):
+
+    def assign(self, series, operations, first):
+        # sets the ref of new operations, numbered in the given order with one counter update per year
+        # `first(year)` gives the number to start from when the year has no counter yet
+        by_year = defaultdict(list)
+        for operation in operations:
+            if operation.type != "operation":
+                operation.ref = "-"
+            else:
+                by_year[operation.date.year].append(operation)
+        for year, year_operations in by_year.items():
+            number = self.reserve(series, year, len(year_operations), lambda: first(year))
+            for operation in year_operations:
+                operation.ref_year = year
+                operation.ref_number = number
+                operation.ref = f"{number:04d}/{year}/DTNDB"
+                number += 1
+
+    def reassign(self, series, operation, type, date):
+        # after an update, a new ref when the operation changed of year or of type, `type` and `date` are the ones it had
+        # before. The number it had is not given again
+        before = date.year if type == "operation" else None
+        after = operation.date.year if operation.type == "operation" else None
+        if before != after:
+            operation.ref_number = operation.ref_year = None
+            self.assign(series, [operation], operation.first_ref_number)
+
+    def reserve(self, series, year, count, first):
+        # gives the first of `count` following numbers, the update locks the counter row until the end of the transaction
+        # of the caller, concurrent operations wait for it
+        # `first` gives the number to start from when the year has no counter yet
+        counters = self.filter(series=series, year=year)
+        if not counters.update(last=F('last') + count):
+            try:
+                with transaction.atomic():
+                    return self.create(series=series, year=year, last=first() + count - 1).last - count + 1
+            except IntegrityError:
+                # created by a concurrent operation
+                counters.update(last=F('last') + count)
+        return counters.values_list('last', flat=True).get() - count + 1
+
+
+class RefCounter(models.Model):
+    # last ref number given per series (collection, disbursement) and per year
+    series = models.CharField(max_length=20)
+    year = models.IntegerField()
+    last = models.IntegerField(default=0)
+
+    objects = RefCounterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['series', 'year'], name='unique_ref_counter'),
+        ]
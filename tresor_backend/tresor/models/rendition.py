@@ -0,0 +1,49 @@
+import datetime
+from django.db import models, transaction
+from django.utils import timezone
+
+
+class RenditionManager(models.Manager):
+    # a worker that stopped while rendering leaves its renditions running, they are taken again after this delay
+    stale_after = datetime.timedelta(minutes=10)
+
+    def request(self, names):
+        # queues the renditions of stored files, the files that already have one are left as they are
+        self.bulk_create([Rendition(source=name) for name in set(names) if name], ignore_conflicts=True, batch_size=1000)
+
+    def claim(self, limit):
+        # the next renditions to build for a worker, the rows are locked while they are taken so two workers
+        # never build the same ones
+        with transaction.atomic():
+            stale = timezone.now() - self.stale_after
+            pks = list(
+                self.filter(models.Q(status='pending') | models.Q(status='running', updated_at__lt=stale))
+                .order_by('pk').select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit]
+            )
+            self.filter(pk__in=pks).update(status='running', updated_at=timezone.now())
+        return list(self.filter(pk__in=pks).order_by('pk'))
+
+    def url_expression(self, name, file_field='file'):
+        # the stored name of a rendition of the file of an operation, as an annotation (None while it is not built)
+        return models.Subquery(self.filter(source=models.OuterRef(file_field), status='done').values(name)[:1])
+
+
+class Rendition(models.Model):
+    # the small images of an attachment shown in the lists instead of the file: a thumbnail and a preview of the
+    # image or of the first page of the pdf, built by the render_previews worker after the upload.
+    # The attachments are stored by content hash so one row serves every operation with the same file
+    source = models.CharField(max_length=100, unique=True)
+    status = models.CharField(max_length=20, choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('unsupported', 'Unsupported'), ('failed', 'Failed')], default='pending')
+    thumbnail = models.CharField(max_length=100, blank=True, db_index=True)
+    preview = models.CharField(max_length=100, blank=True, db_index=True)
+    error = models.CharField(max_length=255, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RenditionManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='rendition_status_idx'),
+        ]
@@ -0,0 +1,101 @@
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
+
+
+class OperationRollupManager(models.Manager):
+
+    def change(self, kind, date, created_by_id, total, count, operations, type="", account_id=None, vault_id=None):
+        # {key: [total, count, operations]}, changes of several operations are added together with merge()
+        return {(date.replace(day=1), kind, type, created_by_id, account_id, vault_id): [total, count, operations]}
+
+    def merge(self, changes, more):
+        for key, values in more.items():
+            changes[key] = [a + b for a, b in zip(changes.get(key, [0, 0, 0]), values)]
+        return changes
+
+    def apply(self, changes):
+        # must be called inside the transaction of the operations, one update per key
+        for (period, kind, type, created_by_id, account_id, vault_id), (total, count, operations) in changes.items():
+            if not (total or count or operations):
+                # an edit that left this key as it was
+                continue
+            key = {
+                "period": period,
+                "kind": kind,
+                "type": type,
+                "created_by_id": created_by_id,
+                "account_id": account_id,
+                "vault_id": vault_id,
+            }
+            rollups = self.filter(**key)
+            if not rollups.update(total=F('total') + total, count=F('count') + count, operations=F('operations') + operations):
+                try:
+                    with transaction.atomic():
+                        self.create(total=total, count=count, operations=operations, **key)
+                except IntegrityError:
+                    # created by a concurrent operation
+                    rollups.update(total=F('total') + total, count=F('count') + count, operations=F('operations') + operations)
+            rollups.filter(count=0, total=0).delete()
+
+    def record_collection(self, operation, details, sign=1):
+        self.apply(self.collection_change(operation, details, sign))
+
+    def collection_change(self, operation, details, sign=1):
+        # details is a list of (account id, montant) in creation order
+        # an operation is counted in `count` of every account it touches and in `operations` of the account of its first detail
+        totals = {}
+        for account_id, montant in details:
+            totals[account_id] = totals.get(account_id, 0) + montant
+        changes = {}
+        for account_id, total in totals.items():
+            operations = sign if account_id == details[0][0] else 0
+            self.merge(changes, self.change('collection', operation.date, operation.created_by_id, sign * total, sign, operations, type=operation.type, account_id=account_id))
+        return changes
+
+    def record_disbursement(self, operation, total, sign=1):
+        self.apply(self.disbursement_change(operation, total, sign))
+
+    def disbursement_change(self, operation, total, sign=1):
+        return self.change('disbursement', operation.date, operation.created_by_id, sign * total, sign, sign, type=operation.type, account_id=operation.account_id)
+
+    def record_deposit(self, deposit, sign=1):
+        self.apply(self.deposit_change(deposit, sign))
+
+    def deposit_change(self, deposit, sign=1):
+        return self.change('deposit', deposit.date, deposit.created_by_id, sign * deposit.amount, sign, sign, vault_id=deposit.vault_id)
+
+    def record_withdrawal(self, withdrawal, sign=1):
+        self.apply(self.withdrawal_change(withdrawal, sign))
+
+    def withdrawal_change(self, withdrawal, sign=1):
+        return self.change('withdrawal', withdrawal.date, withdrawal.created_by_id, sign * withdrawal.amount, sign, sign, vault_id=withdrawal.vault_id, account_id=withdrawal.account_id)
+
+
+class OperationRollup(models.Model):
+    # monthly sums of the operations, read by the stats instead of the operation rows
+    # group by account => sum `count`, otherwise => sum `operations` (a collection can touch several accounts)
+    KINDS = [
+        ('collection', 'Collection'),
+        ('disbursement', 'Disbursement'),
+        ('deposit', 'Deposit'),
+        ('withdrawal', 'Withdrawal'),
+    ]
+
+    period = models.DateField()
+    kind = models.CharField(max_length=20, choices=KINDS)
+    type = models.CharField(max_length=255, blank=True, default="")
+    account = models.ForeignKey('Account', on_delete=models.CASCADE, null=True, blank=True, related_name='rollups')
+    vault = models.ForeignKey('Vault', on_delete=models.CASCADE, null=True, blank=True, related_name='rollups')
+    created_by = models.ForeignKey('authentication.User', on_delete=models.CASCADE, related_name='rollups')
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+    operations = models.IntegerField(default=0)
+
+    objects = OperationRollupManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'kind', 'type', 'created_by', 'account'], condition=Q(account__isnull=False, vault__isnull=True), name='unique_account_rollup'),
+            models.UniqueConstraint(fields=['period', 'kind', 'type', 'created_by', 'vault'], condition=Q(account__isnull=True, vault__isnull=False), name='unique_vault_rollup'),
+            models.UniqueConstraint(fields=['period', 'kind', 'type', 'created_by', 'account', 'vault'], condition=Q(account__isnull=False, vault__isnull=False), name='unique_fund_transfer_rollup'),
+        ]
@@ -0,0 +1,77 @@
+import os
+import uuid
+from django.conf import settings
+from django.core.files import File
+from django.db import models
+from rest_framework import serializers
+
+
+class Upload(models.Model):
+    # a file sent in parts before the operation it is for (tresor.views.uploads), the parts are written to
+    # UPLOADS_ROOT as they come. Once complete and checked, the id is given as `upload` to the operation serializers
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    # bytes received, the offset of the next part
+    offset = models.BigIntegerField(default=0)
+    complete = models.BooleanField(default=False)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    created_by = models.ForeignKey('authentication.User', on_delete=models.CASCADE, related_name='uploads')
+
+    @property
+    def path(self):
+        return os.path.join(settings.UPLOADS_ROOT, f"{self.pk}.part")
+
+    def open(self):
+        # the received file, saved by the storage like an uploaded one
+        self.file = File(open(self.path, 'rb'), name=self.file_name)
+        return self.file
+
+    def finish(self):
+        # the upload is removed once the operation that took its file is committed
+        if getattr(self, 'file', None) is not None:
+            self.file.close()
+        self.discard()
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.delete()
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    sha256 = serializers.RegexField(r"^[0-9a-fA-F]{64}$")
+
+    class Meta:
+        model = Upload
+        fields = ['id', 'file_name', 'size', 'sha256', 'offset', 'complete', 'created_at']
+        read_only_fields = ['offset', 'complete']
+
+    def validate_size(self, value):
+        if value <= 0 or value > settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError("INVALID_UPLOAD_SIZE")
+        return value
+
+    def validate_sha256(self, value):
+        return value.lower()
+
+
+class UploadField(serializers.PrimaryKeyRelatedField):
+    # the id of a complete upload of the user, instead of the file of an operation
+    def __init__(self, **kwargs):
+        kwargs.setdefault('write_only', True)
+        kwargs.setdefault('required', False)
+        super().__init__(**kwargs)
+
+    def get_queryset(self):
+        return Upload.objects.filter(complete=True, created_by=self.context['request'].user)
+
+    def to_internal_value(self, data):
+        upload = super().to_internal_value(data)
+        # the parts are gone after clean_uploads or a new container without the uploads volume
+        if not os.path.exists(upload.path):
+            raise serializers.ValidationError("UPLOAD_FILE_MISSING")
+        return upload
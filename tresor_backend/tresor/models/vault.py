@@ -1,13 +1,18 @@
+from collections import defaultdict
 from django.db import models
-from .account import Account
+from .account import Account, BalanceQuerySet
+from .balance_snapshot import BalanceSnapshot
+from .ledger import LedgerEntry
+from .rollup import OperationRollup
 from rest_framework import serializers
+from ..sparse import SparseFieldsMixin
 from django.db import transaction
 
 class VaultGroup(models.Model):
     name = models.CharField(max_length=255)
     can_fund_transfer = models.BooleanField(default=False)
 
-class VaultGroupSerializer(serializers.ModelSerializer):
+class VaultGroupSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = VaultGroup
         fields = '__all__'
@@ -27,23 +32,41 @@ class Vault(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BalanceQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(check=models.Q(balance__gte=0), name='vault_balance_not_negative'),
+        ]
+
     def get_solde_at_date(self, date):
-        deposits = self.deposits.filter(date__gt=date)
-        withdrawals = self.withdrawals.filter(date__gt=date)
-        solde = self.balance
-        for deposit in deposits:
-            solde -= deposit.amount
-        for withdrawal in withdrawals:
-            solde += withdrawal.amount
-        return solde
+        return BalanceSnapshot.objects.balance_at(date, vault=self)
 
-class VaultSerializer(serializers.ModelSerializer):
+class VaultSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     can_fund_transfer = serializers.BooleanField(read_only=True)
     group_name = serializers.CharField(read_only=True)
     class Meta:
         model = Vault
         fields = '__all__'
 
+class VaultDepositManager(models.Manager):
+
+    def remove(self, deposits):
+        # deletes the deposits with their ledger entries and rollups and takes them back from the vaults, once per vault.
+        # False when a vault has not enough left, the caller rolls back its transaction
+        LedgerEntry.objects.remove('deposit', [deposit.pk for deposit in deposits])
+        changes = {}
+        debits = defaultdict(int)
+        for deposit in deposits:
+            OperationRollup.objects.merge(changes, OperationRollup.objects.deposit_change(deposit, sign=-1))
+            debits[deposit.vault_id] += deposit.amount
+        OperationRollup.objects.apply(changes)
+        for pk, total in debits.items():
+            if not Vault.objects.filter(pk=pk).debit(total):
+                return False
+        self.filter(pk__in=[deposit.pk for deposit in deposits]).delete()
+        return True
+
 class VaultDeposit(models.Model):
     vault = models.ForeignKey(Vault, on_delete=models.CASCADE, related_name="deposits")
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -57,7 +80,17 @@ class VaultDeposit(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-class VaultDepositSerializer(serializers.ModelSerializer):
+    objects = VaultDepositManager()
+
+    class Meta:
+        # the lists are ordered by -date, -created_at and filtered on these fields
+        indexes = [
+            models.Index(fields=['-date', '-created_at'], name='deposit_date_idx'),
+            models.Index(fields=['vault', '-date', '-created_at'], name='deposit_vault_date_idx'),
+            models.Index(fields=['created_by', '-date', '-created_at'], name='deposit_user_date_idx'),
+        ]
+
+class VaultDepositSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     vault_name = serializers.CharField(read_only=True)
     
     class Meta:
@@ -67,12 +100,39 @@ class VaultDepositSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data['created_by'] = self.context['request'].user
-        instance = super().create(validated_data)
-        vault = instance.vault
-        vault.balance += instance.amount
-        vault.save()
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            vault = instance.vault
+            LedgerEntry.objects.record('deposit', instance.pk, instance.date, instance.amount, vault=vault)
+            OperationRollup.objects.record_deposit(instance)
+            Vault.objects.filter(pk=vault.pk).credit(instance.amount)
         return instance
 
+class VaultWithdrawalManager(models.Manager):
+
+    def remove(self, withdrawals):
+        # deletes the withdrawals with their ledger entries and rollups, gives them back to the vaults and takes the fund
+        # transfers back from their accounts, once per vault and account. False when an account has not enough left,
+        # the caller rolls back its transaction
+        LedgerEntry.objects.remove('withdrawal', [withdrawal.pk for withdrawal in withdrawals])
+        LedgerEntry.objects.remove('fund_transfer', [withdrawal.pk for withdrawal in withdrawals if withdrawal.account_id is not None])
+        changes = {}
+        credits = defaultdict(int)
+        debits = defaultdict(int)
+        for withdrawal in withdrawals:
+            OperationRollup.objects.merge(changes, OperationRollup.objects.withdrawal_change(withdrawal, sign=-1))
+            credits[withdrawal.vault_id] += withdrawal.amount
+            if withdrawal.account_id is not None:
+                debits[withdrawal.account_id] += withdrawal.amount
+        OperationRollup.objects.apply(changes)
+        for pk, total in credits.items():
+            Vault.objects.filter(pk=pk).credit(total)
+        for pk, total in debits.items():
+            if not Account.objects.filter(pk=pk).debit(total):
+                return False
+        self.filter(pk__in=[withdrawal.pk for withdrawal in withdrawals]).delete()
+        return True
+
 class VaultWithdrawal(models.Model):
     vault = models.ForeignKey(Vault, on_delete=models.CASCADE, related_name="withdrawals")
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -86,7 +146,18 @@ class VaultWithdrawal(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-class VaultWithdrawalSerializer(serializers.ModelSerializer):
+    objects = VaultWithdrawalManager()
+
+    class Meta:
+        # the lists are ordered by -date, -created_at and filtered on these fields
+        indexes = [
+            models.Index(fields=['-date', '-created_at'], name='withdrawal_date_idx'),
+            models.Index(fields=['vault', '-date', '-created_at'], name='withdrawal_vault_date_idx'),
+            models.Index(fields=['account', '-date', '-created_at'], name='withdrawal_account_date_idx'),
+            models.Index(fields=['created_by', '-date', '-created_at'], name='withdrawal_user_date_idx'),
+        ]
+
+class VaultWithdrawalSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     vault_name = serializers.CharField(read_only=True)
     account_name = serializers.CharField(read_only=True)
     
@@ -99,10 +170,6 @@ class VaultWithdrawalSerializer(serializers.ModelSerializer):
     def validate_amount(self, value):
         if value <= 0:
             raise serializers.ValidationError("Amount must be greater than zero.")
-        vault = self.initial_data.get('vault')
-        vault = Vault.objects.get(pk=vault)
-        if vault is not None and value > vault.balance:
-            raise serializers.ValidationError("NOT_ENOUGH_BALANCE")
         return value
 
     def create(self, validated_data):
@@ -111,12 +178,14 @@ class VaultWithdrawalSerializer(serializers.ModelSerializer):
         with transaction.atomic():
             instance = super().create(validated_data)
             vault = instance.vault
-            vault.balance -= instance.amount
-            vault.save()
+            LedgerEntry.objects.record('withdrawal', instance.pk, instance.date, -instance.amount, vault=vault)
+            OperationRollup.objects.record_withdrawal(instance)
+            if not Vault.objects.filter(pk=vault.pk).debit(instance.amount):
+                raise serializers.ValidationError({"amount": ["NOT_ENOUGH_BALANCE"]})
 
             if instance.account is not None:
-                instance.account.balance += instance.amount
-                instance.account.save()
+                LedgerEntry.objects.record('fund_transfer', instance.pk, instance.date, instance.amount, account=instance.account)
+                Account.objects.filter(pk=instance.account_id).credit(instance.amount)
         return instance
 
 # from django.test import TestCase
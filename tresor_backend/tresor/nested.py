@@ -0,0 +1,35 @@
+from rest_framework import serializers
+
+
+def diff_details(existing, incoming, fields):
+    # matches the incoming details (validated data) with the existing details of an operation:
+    # with an id => update of that detail, without => new detail, existing details not sent => deleted
+    # returns (new details values, changed details, unchanged details, deleted details), the changed details have their new values set
+    by_id = {detail.pk: detail for detail in existing}
+    created, changed, unchanged = [], [], []
+    for values in incoming:
+        values = dict(values)
+        pk = values.pop('id', None)
+        if pk is None:
+            created.append(values)
+            continue
+        if pk not in by_id:
+            raise serializers.ValidationError({"details": ["UNKNOWN_DETAIL"]})
+        detail = by_id.pop(pk)
+        if any(getattr(detail, field) != values[field] for field in fields if field in values):
+            for field in fields:
+                if field in values:
+                    setattr(detail, field, values[field])
+            changed.append(detail)
+        else:
+            unchanged.append(detail)
+    return created, changed, unchanged, list(by_id.values())
+
+
+def apply_balance_changes(queryset, changes, error):
+    # changes is {pk: amount}, the debits are checked by the update, raising rolls back the transaction of the caller
+    for pk, amount in changes.items():
+        if amount > 0:
+            queryset.filter(pk=pk).credit(amount)
+        elif amount < 0 and not queryset.filter(pk=pk).debit(-amount):
+            raise serializers.ValidationError(error)
@@ -0,0 +1,55 @@
+import io
+import os
+
+import pymupdf
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# largest side in pixels of the images built for an attachment, the thumbnail for the rows of the lists and the
+# preview for the detail of an operation
+RENDITION_SIZES = {"thumbnail": 240, "preview": 1024}
+RENDITION_QUALITY = 75
+
+
+def source_image(name):
+    # the image to reduce for a stored file, the first page of a pdf, None when the file is neither
+    extension = os.path.splitext(name)[1].lower()
+    with default_storage.open(name, 'rb') as f:
+        if extension == ".pdf":
+            with pymupdf.open(stream=f.read(), filetype="pdf") as document:
+                if document.page_count == 0:
+                    return None
+                page = document[0]
+                zoom = max(RENDITION_SIZES.values()) / max(page.rect.width, page.rect.height)
+                pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+                return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+        try:
+            image = Image.open(f)
+            image.load()
+        except (UnidentifiedImageError, Image.DecompressionBombError):
+            return None
+    # phone photos are rotated by their exif, which is not kept
+    return ImageOps.exif_transpose(image)
+
+
+def render(rendition):
+    # builds and stores the images of a rendition, its status is unsupported when the file is not an image or a pdf
+    image = source_image(rendition.source)
+    if image is None:
+        rendition.status = 'unsupported'
+        return rendition
+    if image.mode in ("RGBA", "LA", "P"):
+        # the transparent parts of a scan are white on paper
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image.convert("RGBA"), mask=image.convert("RGBA"))
+        image = background
+    for field, size in sorted(RENDITION_SIZES.items(), key=lambda item: -item[1]):
+        # the smaller ones are reduced from the larger, already reduced image
+        image.thumbnail((size, size), Image.LANCZOS)
+        output = io.BytesIO()
+        image.convert("RGB").save(output, format="JPEG", quality=RENDITION_QUALITY, optimize=True, progressive=True)
+        # the storage names it after its content, like the attachments
+        setattr(rendition, field, default_storage.save(f"{field}.jpg", ContentFile(output.getvalue())))
+    rendition.status = 'done'
+    return rendition
@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from authentication.models import User
+from tresor.models import Account, Rendition, CollectionOperation, CollectionOperationDetail, DisbursementOperation, DisbursementOperationDetail, Vault, VaultDeposit, VaultGroup, VaultWithdrawal
+from tresor.utils import invalidate_stats
+
+
+def invalidate_stats_on_write(sender, **kwargs):
+    # after the commit, so a stats request during the transaction can not cache the old values under the new version
+    transaction.on_commit(invalidate_stats)
+
+
+for model in [Account, Vault, VaultGroup, CollectionOperation, CollectionOperationDetail, DisbursementOperation, DisbursementOperationDetail, VaultDeposit, VaultWithdrawal]:
+    post_save.connect(invalidate_stats_on_write, sender=model)
+    post_delete.connect(invalidate_stats_on_write, sender=model)
+
+
+def invalidate_stats_on_user_write(sender, created=False, update_fields=None, **kwargs):
+    # the users are only in the counts of their paginated list, searched by name and username: the saves of the other
+    # fields (last_login on every login, a password) do not change them
+    if created or update_fields is None or {'name', 'username'} & set(update_fields):
+        invalidate_stats_on_write(sender, **kwargs)
+
+
+post_save.connect(invalidate_stats_on_user_write, sender=User)
+post_delete.connect(invalidate_stats_on_write, sender=User)
+
+
+def request_renditions(sender, instance, **kwargs):
+    # the previews of a new file are built by the render_previews worker once the operation is committed
+    if instance.file:
+        name = instance.file.name
+        transaction.on_commit(lambda: Rendition.objects.request([name]))
+
+
+for model in [CollectionOperation, DisbursementOperation]:
+    post_save.connect(request_renditions, sender=model)
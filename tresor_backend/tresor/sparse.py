@@ -0,0 +1,70 @@
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def requested_fields(request):
+    # the names given in ?fields= and ?expand=, None for a parameter that is not there
+    # they only change what is read, the writes always take and return every field
+    if request is None or request.method not in SAFE_METHODS:
+        return None, None
+    params = request.query_params
+    return tuple(
+        {name.strip() for name in params[param].split(',') if name.strip()} if param in params else None
+        for param in ('fields', 'expand')
+    )
+
+
+def first_names(names, prefix):
+    # the names of the fields of a serializer found at prefix, "details.montant" gives "details" at the top and "montant" in the details
+    return {name[len(prefix):].split('.')[0] for name in names if name.startswith(prefix) and len(name) > len(prefix)}
+
+
+class SparseFieldsMixin:
+    # ?fields=date,ref,total keeps only these fields, ?expand=details adds nested serializers: as soon as one of the two
+    # is given the nested serializers are left out unless they are named. The fields of nested serializers are dotted,
+    # ?fields=date,details.montant or ?expand=details.account_data
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested, expand = requested_fields(self.context.get('request'))
+        if requested is None and expand is None:
+            return fields
+        prefix = "".join(f"{name}." for name in self.field_path())
+        local = first_names(requested or (), prefix)
+        # a nested field named in fields (details.montant) is expanded too
+        deeper = {name for name in requested or () if '.' in name[len(prefix):]}
+        expanded = first_names(expand or (), prefix) | first_names(deeper, prefix)
+        for name, field in list(fields.items()):
+            if isinstance(field, serializers.BaseSerializer):
+                keep = name in local or name in expanded
+            else:
+                keep = not local or name in local
+            if not keep:
+                del fields[name]
+        return fields
+
+    def field_path(self):
+        # names of the nested fields from the root serializer to this one, the items of a list have no name
+        names, field = [], self
+        while field.parent is not None:
+            if field.field_name:
+                names.append(field.field_name)
+            field = field.parent
+        return names[::-1]
+
+
+def sparse_fields(serializer):
+    # the fields of the serializer when the request asks for some of them, None when it reads everything
+    requested, expand = requested_fields(serializer.context.get('request'))
+    if requested is None and expand is None:
+        return None
+    return serializer.fields
+
+
+def load_only(queryset, fields, *keep):
+    # loads only the model columns the fields read, with the ones in keep, all of them when fields is None
+    if fields is None:
+        return queryset
+    columns = {field.name for field in queryset.model._meta.concrete_fields}
+    sources = {field.source.split('.')[0] for field in fields.values() if not field.write_only}
+    return queryset.only(queryset.model._meta.pk.name, *keep, *(sources & columns))
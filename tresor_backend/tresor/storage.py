@@ -0,0 +1,169 @@
+import hashlib
+import io
+import os
+import re
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+
+class MediaSigner(signing.TimestampSigner):
+    # the timestamp is the start of the current half of MEDIA_URL_MAX_AGE: the url of a file stays the same during it,
+    # so the browser keeps the file in its cache, and is valid for half of MEDIA_URL_MAX_AGE at least
+    def timestamp(self):
+        period = settings.MEDIA_URL_MAX_AGE // 2
+        now = int(time.time())
+        return signing.b62_encode(now - now % period)
+
+
+MEDIA_SIGNER = MediaSigner(salt="tresor.media")
+CONTENT_NAME = re.compile(r"attachments/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})\.\w+")
+
+
+def media_token(request):
+    # the key of the token of the user of the request (request.auth with CachedTokenAuthentication), None without one
+    if isinstance(request.auth, str):
+        return request.auth
+    if not hasattr(request, '_media_token'):
+        request._media_token = Token.objects.filter(user=request.user).values_list('key', flat=True).first()
+    return request._media_token
+
+
+def sign_media(user, token, name):
+    # query params of the url of an attachment for a user, the links of the pages work without the token header.
+    # The key of the token is in the signature, not in the url: the urls stop working when the token is deleted
+    timestamp, signature = MEDIA_SIGNER.sign(f"{user.pk}:{token}:{name}").rsplit(MEDIA_SIGNER.sep, 2)[1:]
+    return {"u": user.pk, "t": timestamp, "s": signature}
+
+
+def signed_media_user(name, params):
+    # the id of the user the url was signed for, None when the signature does not match or is older than
+    # MEDIA_URL_MAX_AGE, or when the token it was signed with is not the one of an active user anymore
+    user, timestamp, signature = params.get("u", ""), params.get("t", ""), params.get("s", "")
+    if not user.isdigit():
+        return None
+    token = Token.objects.filter(user=user, user__is_active=True).values_list('key', flat=True).first()
+    if token is None:
+        return None
+    try:
+        MEDIA_SIGNER.unsign(f"{user}:{token}:{name}:{timestamp}:{signature}", max_age=settings.MEDIA_URL_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return int(user)
+
+
+def signed_url(url, name, request):
+    if not url or request is None or not request.user.is_authenticated:
+        return url
+    token = media_token(request)
+    if token is None:
+        return url
+    return f"{url}?{urlencode(sign_media(request.user, token, name))}"
+
+
+class MediaFileField(serializers.FileField):
+    # the url of the attachment signed for the user of the request, see MediaView
+
+    def to_representation(self, value):
+        return signed_url(super().to_representation(value), value.name, self.context.get('request', None))
+
+
+class RenditionField(serializers.CharField):
+    # the signed url of a rendition of the attachment (tresor.models.Rendition) from the stored name the manager of
+    # the operations annotates, null while it is not built
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request', None)
+        url = default_storage.url(value)
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        return signed_url(url, value, request)
+
+
+def media_etag(name):
+    # the content hash for the content addressed files, the size and the time of the others (their names are not reused)
+    match = CONTENT_NAME.fullmatch(name)
+    if match:
+        return f'"{match.group("digest")}"'
+    version = f"{name}:{default_storage.size(name)}:{default_storage.get_modified_time(name).timestamp()}"
+    return f'"{hashlib.sha256(version.encode()).hexdigest()}"'
+
+
+def take_file(validated_data):
+    # the file of the validated data of an operation serializer: the file of an upload given by id (`upload`), then
+    # the keep_original flag given to the storage with the file. Called in the transaction that saves the
+    # operation, the upload is removed once it is committed and kept for another try when it is rolled back
+    upload = validated_data.pop('upload', None)
+    if upload is not None:
+        try:
+            validated_data['file'] = upload.open()
+        except FileNotFoundError:
+            # removed by clean_uploads since the validation
+            raise serializers.ValidationError({"upload": ["UPLOAD_FILE_MISSING"]})
+        transaction.on_commit(upload.finish)
+    if validated_data.pop('keep_original', False) and validated_data.get('file'):
+        validated_data['file'].keep_original = True
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    # the attachments are stored under the sha256 of their content (attachments/ab/abcd...ef.pdf): the same scan
+    # uploaded again is the same file, written once. The upload_to of the fields is not used for the path.
+    # Images over max_image_side or max_image_bytes are recompressed first, unless the uploaded file has
+    # keep_original set (see the operation serializers)
+    directory = "attachments"
+    image_extensions = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+    max_image_side = 2000
+    max_image_bytes = 1024 * 1024
+    jpeg_quality = 80
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        if extension in self.image_extensions and not getattr(content, "keep_original", False):
+            content, extension = self.compress_image(content, extension)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        name = f"{self.directory}/{digest[:2]}/{digest}{extension}"
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+    def compress_image(self, content, extension):
+        # (content, extension) to store, the upload as it is when it is small enough, not an image or would not get smaller
+        content.seek(0)
+        try:
+            image = Image.open(content)
+            image.load()
+        except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+            content.seek(0)
+            return content, extension
+        if max(image.size) <= self.max_image_side and content.size <= self.max_image_bytes:
+            content.seek(0)
+            return content, extension
+
+        # phone photos are rotated by their exif, applied here as the exif is not kept
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((self.max_image_side, self.max_image_side), Image.LANCZOS)
+        output = io.BytesIO()
+        if image.mode in ("RGBA", "LA") or image.mode == "P" and "transparency" in image.info:
+            image.save(output, format="PNG", optimize=True)
+            compressed_extension = ".png"
+        else:
+            image.convert("RGB").save(output, format="JPEG", quality=self.jpeg_quality, optimize=True, progressive=True)
+            compressed_extension = ".jpg"
+        if output.tell() >= content.size:
+            content.seek(0)
+            return content, extension
+        return ContentFile(output.getvalue()), compressed_extension
@@ -0,0 +1,84 @@
+from decimal import Decimal
+
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from authentication.models import User
+from tresor.models import Account, BalanceSnapshot, LedgerEntry, OperationRollup, Vault, VaultGroup
+
+
+# the counts and stats are cached, a cache per test run so nothing is read from the cache directory
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, TOKEN_CACHE_SHARED=False)
+class OperationTestCase(APITestCase):
+    # an admin, two accounts and a vault that can fund them, with the requests of the operation endpoints
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'Admin', 'password')
+        cls.account = Account.objects.create(name='A1', number='1', balance=1000)
+        cls.other_account = Account.objects.create(name='A2', number='2', balance=0)
+        cls.group = VaultGroup.objects.create(name='G', can_fund_transfer=True)
+        cls.vault = Vault.objects.create(name='V1', code='v1', balance=500, group=cls.group)
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def create_collection(self, date, *details, type='operation'):
+        # details are (account, montant)
+        return self.client.post('/collections/', {
+            'date': date, 'motif': 'motif', 'beneficiaire': 'beneficiaire', 'type': type,
+            'details': [self.collection_detail(account, montant) for account, montant in details],
+        }, format='json')
+
+    def collection_detail(self, account, montant, **fields):
+        return {'cheque_number': '1', 'name': 'name', 'banq_name': 'bank', 'montant': montant, 'destination_account': account.pk, **fields}
+
+    def create_disbursement(self, date, account, *amounts, type='operation'):
+        return self.client.post('/disbursements/', {
+            'date': date, 'motif': 'motif', 'beneficiaire': 'beneficiaire', 'type': type, 'account': account.pk,
+            'details': [self.disbursement_detail(montant) for montant in amounts],
+        }, format='json')
+
+    def disbursement_detail(self, montant, **fields):
+        return {'name': 'name', 'banq_name': 'bank', 'banq_number': '1', 'montant': montant, **fields}
+
+    def create_deposit(self, date, vault, amount):
+        return self.client.post('/vaults/deposit/', {'date': date, 'vault': vault.pk, 'amount': amount, 'motif': 'motif'}, format='json')
+
+    def create_withdrawal(self, date, vault, amount, account=None):
+        data = {'date': date, 'vault': vault.pk, 'amount': amount, 'motif': 'motif'}
+        if account is not None:
+            data['account'] = account.pk
+        return self.client.post('/vaults/withdrawal/', data, format='json')
+
+    def balance(self, owner):
+        owner.refresh_from_db()
+        return owner.balance
+
+    def ledger(self, **owner):
+        # (date, amount, balance) of the entries of an owner in order
+        return [(str(date), amount, balance) for date, amount, balance in LedgerEntry.objects.filter(**owner).order_by('date', 'id').values_list('date', 'amount', 'balance')]
+
+    def state(self):
+        # everything an operation changes, to check that a refused one changed nothing
+        return {
+            "accounts": list(Account.objects.order_by('pk').values_list('pk', 'balance')),
+            "vaults": list(Vault.objects.order_by('pk').values_list('pk', 'balance')),
+            "ledger": list(LedgerEntry.objects.order_by('pk').values_list('source_type', 'source_id', 'date', 'amount', 'balance')),
+            "snapshots": list(BalanceSnapshot.objects.order_by('pk').values_list('account', 'vault', 'date', 'balance', 'delta')),
+            "rollups": list(OperationRollup.objects.order_by('pk').values_list('period', 'kind', 'account', 'vault', 'total', 'count', 'operations')),
+        }
+
+    def assertBalanceConsistent(self, owner, **lookup):
+        # the balance of the row is the one after the last ledger entry and the last snapshot
+        balance = self.balance(owner)
+        entries = self.ledger(**lookup)
+        if entries:
+            self.assertEqual(entries[-1][2], balance)
+        last = BalanceSnapshot.objects.filter(**lookup).order_by('-date').first()
+        if last is not None:
+            self.assertEqual(last.balance, balance)
+
+
+def D(value):
+    return Decimal(value).quantize(Decimal("0.01"))
@@ -0,0 +1,72 @@
+from django.db import IntegrityError, transaction
+
+from tresor.models import Account, CollectionOperation, VaultDeposit, VaultWithdrawal
+from tresor.tests.base import OperationTestCase, D
+
+
+class BalanceQuerySetTests(OperationTestCase):
+
+    def test_credit(self):
+        self.assertEqual(Account.objects.filter(pk=self.account.pk).credit(D(50)), 1)
+        self.assertEqual(self.balance(self.account), D(1050))
+
+    def test_debit_within_balance(self):
+        self.assertEqual(Account.objects.filter(pk=self.account.pk).debit(D(1000)), 1)
+        self.assertEqual(self.balance(self.account), D(0))
+
+    def test_debit_over_balance_changes_nothing(self):
+        updated_at = Account.objects.get(pk=self.account.pk).updated_at
+        self.assertEqual(Account.objects.filter(pk=self.account.pk).debit(D("1000.01")), 0)
+        account = Account.objects.get(pk=self.account.pk)
+        self.assertEqual(account.balance, D(1000))
+        self.assertEqual(account.updated_at, updated_at)
+
+    def test_negative_balance_is_refused_by_the_database(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Account.objects.filter(pk=self.account.pk).update(balance=-1)
+        self.assertEqual(self.balance(self.account), D(1000))
+
+
+class DestroyOverdraftTests(OperationTestCase):
+    # deleting an operation that brought money in is refused when the money was spent since
+
+    def test_deposit(self):
+        deposit = self.create_deposit('2024-01-10', self.vault, 100).data['id']
+        self.create_withdrawal('2024-01-11', self.vault, 550)
+        self.assertEqual(self.balance(self.vault), D(50))
+        before = self.state()
+
+        response = self.client.delete(f'/vaults/deposit/{deposit}/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, "NOT_ENOUGH_BALANCE")
+        self.assertEqual(self.state(), before)
+        self.assertTrue(VaultDeposit.objects.filter(pk=deposit).exists())
+
+    def test_fund_transfer(self):
+        withdrawal = self.create_withdrawal('2024-01-10', self.vault, 100, account=self.other_account).data['id']
+        self.create_disbursement('2024-01-11', self.other_account, 80)
+        self.assertEqual(self.balance(self.other_account), D(20))
+        before = self.state()
+
+        response = self.client.delete(f'/vaults/withdrawal/{withdrawal}/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.state(), before)
+        self.assertTrue(VaultWithdrawal.objects.filter(pk=withdrawal).exists())
+
+    def test_collection(self):
+        collection = self.create_collection('2024-01-10', (self.other_account, 100)).data['id']
+        self.create_disbursement('2024-01-11', self.other_account, 80)
+        before = self.state()
+
+        response = self.client.delete(f'/collections/{collection}/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, "NOT_ENOUGH_BALANCE")
+        self.assertEqual(self.state(), before)
+        self.assertTrue(CollectionOperation.objects.filter(pk=collection).exists())
+
+    def test_destroy_within_balance(self):
+        collection = self.create_collection('2024-01-10', (self.other_account, 100)).data['id']
+        self.assertEqual(self.client.delete(f'/collections/{collection}/').status_code, 200)
+        self.assertEqual(self.balance(self.other_account), D(0))
+        self.assertEqual(self.ledger(account=self.other_account), [])
+        self.assertEqual(self.state()["rollups"], [])
@@ -0,0 +1,104 @@
+from tresor.models import CollectionOperation, DisbursementOperation, VaultWithdrawal
+from tresor.tests.base import OperationTestCase, D
+
+
+class BatchCreateTests(OperationTestCase):
+
+    def disbursement(self, date, account, *amounts):
+        return {'date': date, 'motif': 'm', 'beneficiaire': 'b', 'type': 'operation', 'account': account.pk,
+                'details': [self.disbursement_detail(montant) for montant in amounts]}
+
+    def test_batch(self):
+        response = self.client.post('/disbursements/batch/', [
+            self.disbursement('2024-01-10', self.account, 100, 50),
+            self.disbursement('2024-01-09', self.account, 200),
+        ], format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([operation['total'] for operation in response.data], [D(150), D(200)])
+        self.assertEqual(self.balance(self.account), D(650))
+        self.assertEqual(self.ledger(account=self.account), [('2024-01-09', D(-200), D(800)), ('2024-01-10', D(-150), D(650))])
+        self.assertBalanceConsistent(self.account, account=self.account)
+
+    def test_overdraft_writes_nothing(self):
+        # each operation passes alone, not the three of them
+        self.create_disbursement('2024-01-01', self.account, 100)
+        before = self.state()
+        response = self.client.post('/disbursements/batch/', [
+            self.disbursement('2024-01-10', self.other_account, 0),
+            self.disbursement('2024-01-10', self.account, 500),
+            self.disbursement('2024-01-11', self.account, 500),
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["errors"], [{"row": 1, "errors": {"account": ["NOT_ENOUGH_BALANCE"]}}])
+        self.assertEqual(self.state(), before)
+        self.assertEqual(DisbursementOperation.objects.count(), 1)
+
+    def test_validation_error_writes_nothing(self):
+        response = self.client.post('/collections/batch/', [
+            {'date': '2024-01-10', 'motif': 'm', 'beneficiaire': 'b', 'details': [self.collection_detail(self.account, 10)]},
+            {'date': '2024-01-10', 'motif': 'm', 'beneficiaire': 'b', 'details': []},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CollectionOperation.objects.exists())
+
+    def test_attachments_are_refused(self):
+        operation = self.disbursement('2024-01-10', self.account, 10)
+        response = self.client.post('/disbursements/batch/', [operation, {**operation, 'upload': 'x', 'keep_original': True}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["errors"], [{"row": 1, "errors": {"upload": ["NOT_ALLOWED_IN_BATCH"], "keep_original": ["NOT_ALLOWED_IN_BATCH"]}}])
+        self.assertFalse(DisbursementOperation.objects.exists())
+
+
+class BatchDeleteTests(OperationTestCase):
+
+    def test_collections(self):
+        before = self.state()
+        ids = [
+            self.create_collection('2024-01-10', (self.account, 100), (self.other_account, 30)).data['id'],
+            self.create_collection('2024-01-05', (self.account, 20)).data['id'],
+        ]
+        kept = self.create_collection('2024-01-07', (self.account, 5)).data['id']
+        response = self.client.post('/collections/batch/delete/', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.delete(f'/collections/{kept}/')
+        # back to where it started, ledger, snapshots and rollups included
+        self.assertEqual(self.state(), before)
+
+    def test_disbursements(self):
+        before = self.state()
+        ids = [self.create_disbursement('2024-01-10', self.account, 100, 50).data['id'], self.create_disbursement('2024-02-10', self.account, 10).data['id']]
+        self.assertEqual(self.client.post('/disbursements/batch/delete/', {'ids': ids}, format='json').status_code, 200)
+        self.assertEqual(self.state(), before)
+
+    def test_deposits(self):
+        before = self.state()
+        ids = [self.create_deposit('2024-01-10', self.vault, 100).data['id'], self.create_deposit('2024-03-01', self.vault, 20).data['id']]
+        kept = self.create_deposit('2024-02-01', self.vault, 5).data['id']
+        self.assertEqual(self.client.post('/vaults/deposit/batch/delete/', {'ids': ids}, format='json').status_code, 200)
+        # the same delete as the one of the endpoint
+        self.assertEqual(self.client.delete(f'/vaults/deposit/{kept}/').status_code, 204)
+        self.assertEqual(self.state(), before)
+
+    def test_withdrawals(self):
+        before = self.state()
+        ids = [self.create_withdrawal('2024-01-10', self.vault, 100, account=self.other_account).data['id'], self.create_withdrawal('2024-01-11', self.vault, 50).data['id']]
+        self.assertEqual(self.client.post('/vaults/withdrawal/batch/delete/', {'ids': ids}, format='json').status_code, 200)
+        self.assertEqual(self.state(), before)
+
+    def test_overdraft_deletes_nothing(self):
+        ids = [self.create_collection('2024-01-10', (self.other_account, 100)).data['id']]
+        ids.append(self.create_withdrawal('2024-01-10', self.vault, 50, account=self.other_account).data['id'])
+        self.create_disbursement('2024-01-11', self.other_account, 120)
+        before = self.state()
+        response = self.client.post('/collections/batch/delete/', {'ids': ids[:1]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.state(), before)
+        response = self.client.post('/vaults/withdrawal/batch/delete/', {'ids': ids[1:]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.state(), before)
+        self.assertTrue(VaultWithdrawal.objects.filter(pk=ids[1]).exists())
+
+    def test_unknown_ids(self):
+        response = self.client.post('/collections/batch/delete/', {'ids': [404]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data["ids"], [404])
@@ -0,0 +1,123 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from unittest import mock
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from tresor.tests.base import OperationTestCase
+
+
+class AttachmentTestCase(OperationTestCase):
+    # a disbursement of january 2024 with an attachment, stored in a temporary MEDIA_ROOT
+
+    def setUp(self):
+        super().setUp()
+        # the urls of the attachments are signed with the token of the user
+        self.token = Token.objects.create(user=self.admin)
+        self.client.force_authenticate(self.admin, self.token.key)
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        paths = override_settings(MEDIA_ROOT=f"{root}/media", ARCHIVES_ROOT=f"{root}/archives", MEDIA_ACCEL_PREFIX="")
+        paths.enable()
+        self.addCleanup(paths.disable)
+        self.operation = self.create_disbursement('2024-01-10', self.account, 10).data['id']
+        response = self.client.patch(f'/disbursements/{self.operation}/', {'file': SimpleUploadedFile('scan.pdf', b'%PDF-1.4 scan')}, format='multipart')
+        self.url = urlsplit(response.data['file'])
+        self.anonymous = APIClient()
+
+
+class AttachmentAccessTests(AttachmentTestCase):
+    # the attachments are sent by /media/ and in the archives of /files/, both need a token or a signed url
+
+    def test_media(self):
+        self.assertEqual(self.anonymous.get(self.url.path).status_code, 403)
+        self.assertEqual(self.anonymous.get(self.url.path + "?" + self.url.query.replace("s=", "s=x")).status_code, 403)
+        response = self.anonymous.get(self.url.path + "?" + self.url.query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b'%PDF-1.4 scan')
+        self.assertEqual(self.client.get(self.url.path).status_code, 200)
+        self.assertEqual(self.client.get('/media/attachments/00/unknown.pdf').status_code, 404)
+
+    def test_media_signature_expires(self):
+        url = self.url.path + "?" + self.url.query
+        with mock.patch('time.time', return_value=time.time() + settings.MEDIA_URL_MAX_AGE):
+            self.assertEqual(self.anonymous.get(url).status_code, 403)
+        # the url stays the same during half of MEDIA_URL_MAX_AGE
+        self.assertEqual(urlsplit(self.client.get(f'/disbursements/{self.operation}/').data['file']), self.url)
+
+    def test_media_signature_ends_with_the_token(self):
+        url = self.url.path + "?" + self.url.query
+        self.token.delete()
+        self.assertEqual(self.anonymous.get(url).status_code, 403)
+        Token.objects.create(user=self.admin)
+        self.assertEqual(self.anonymous.get(url).status_code, 403)
+
+    def test_files(self):
+        for path in ['/files/2024/1/?count=false&type=disbursement', '/files/?count=false&type=disbursement&start_date=2024-01-01&end_date=2024-01-31']:
+            self.assertEqual(self.anonymous.get(path).status_code, 401)
+        response = self.client.get('/files/2024/1/?count=false&type=disbursement')
+        self.assertEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(len(archive.namelist()), 1)
+
+    def test_files_signed_link(self):
+        # the app downloads the archives from a signed link, without the token
+        self.assertEqual(self.anonymous.get('/files/2024/1/?count=false&type=disbursement&link=true').status_code, 401)
+        link = urlsplit(self.client.get('/files/2024/1/?count=false&type=disbursement&link=true').data['url'])
+        self.assertNotIn('link=', link.query)
+        response = self.anonymous.get(link.path + "?" + link.query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))).namelist()), 1)
+        # the signature is the one of the month and type it was given for
+        self.assertEqual(self.anonymous.get(link.path.replace('/1/', '/2/') + "?" + link.query).status_code, 401)
+        self.assertEqual(self.anonymous.get(link.path + "?" + link.query.replace('disbursement', 'collection')).status_code, 401)
+        with mock.patch('time.time', return_value=time.time() + settings.MEDIA_URL_MAX_AGE):
+            self.assertEqual(self.anonymous.get(link.path + "?" + link.query).status_code, 401)
+
+
+class ArchiveCacheTests(AttachmentTestCase):
+
+    def archives(self):
+        return sorted(os.listdir(settings.ARCHIVES_ROOT)) if os.path.isdir(settings.ARCHIVES_ROOT) else []
+
+    def download(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_months_are_kept(self):
+        content = self.download('/files/2024/1/?count=false&type=disbursement')
+        self.assertEqual(len(self.archives()), 1)
+        # the same month given as a range is the same archive
+        self.assertEqual(self.download('/files/?count=false&type=disbursement&start_date=2024-01-01&end_date=2024-01-31'), content)
+        self.assertEqual(len(self.archives()), 1)
+
+    def test_other_ranges_are_not_kept(self):
+        content = self.download('/files/?count=false&type=disbursement&start_date=2024-01-05&end_date=2024-02-20')
+        self.assertEqual(len(zipfile.ZipFile(io.BytesIO(content)).namelist()), 1)
+        self.assertEqual(self.archives(), [])
+
+    def test_range_is_limited(self):
+        for start, end in [('1900-01-01', '2100-12-31'), ('2024-02-01', '2024-01-01')]:
+            response = self.client.get(f'/files/?count=false&type=disbursement&start_date={start}&end_date={end}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_clean_archives(self):
+        self.download('/files/2024/1/?count=false&type=disbursement')
+        call_command('clean_archives', stdout=io.StringIO())
+        self.assertEqual(len(self.archives()), 1)
+        path = os.path.join(settings.ARCHIVES_ROOT, self.archives()[0])
+        old = time.time() - (settings.ARCHIVE_EXPIRY_DAYS + 1) * 24 * 3600
+        os.utime(path, (old, old))
+        call_command('clean_archives', stdout=io.StringIO())
+        self.assertEqual(self.archives(), [])
@@ -0,0 +1,69 @@
+import datetime
+
+from tresor.models import CollectionOperation, DisbursementOperation
+from tresor.tests.base import OperationTestCase
+
+
+class RefSearchFilterTests(OperationTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # the first collection of 2024 is 0216
+        cls.operation = CollectionOperation.objects.create(date=datetime.date(2024, 3, 1), motif='m', beneficiaire='b', created_by=cls.admin)
+        cls.next_year = CollectionOperation.objects.create(date=datetime.date(2025, 3, 1), motif='m', beneficiaire='b', created_by=cls.admin)
+        # a ref given twice before the counters, left without a number by the migration
+        cls.duplicate = CollectionOperation.objects.create(date=datetime.date(2024, 3, 2), motif='m', beneficiaire='b', created_by=cls.admin, type='versement')
+        CollectionOperation.objects.filter(pk=cls.duplicate.pk).update(ref="0216/2024/DTNDB")
+
+    def search(self, term):
+        response = self.client.get('/collections/', {'search': term, 'fields': 'id'})
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['id'] for row in response.data['data'])
+
+    def test_ref(self):
+        self.assertEqual(self.operation.ref, "0216/2024/DTNDB")
+        # the ref without a number is not found by a ref search
+        self.assertEqual(self.search("0216/2024/DTNDB"), [self.operation.pk])
+        self.assertEqual(self.search("0001/2025"), [self.next_year.pk])
+        self.assertEqual(self.search("16/2024"), [])
+
+    def test_number(self):
+        self.assertEqual(self.search("216"), [self.operation.pk])
+        self.assertEqual(self.search("0001"), [self.next_year.pk])
+        self.assertEqual(self.search("02"), [self.operation.pk])
+
+    def test_year(self):
+        self.assertEqual(self.search("2024"), [self.operation.pk])
+        self.assertEqual(self.search("2025"), [self.next_year.pk])
+
+    def test_text(self):
+        # not a ref, searched by SearchFilter
+        self.assertEqual(self.search("DTNDB"), sorted([self.operation.pk, self.next_year.pk, self.duplicate.pk]))
+
+
+class RefUpdateTests(OperationTestCase):
+    # the ref follows the year and the type of an edited operation
+
+    def refs(self, model, pk):
+        return model.objects.filter(pk=pk).values_list('ref', 'ref_year', 'ref_number').get()
+
+    def test_collection(self):
+        first = self.create_collection('2024-01-10', (self.account, 10)).data['id']
+        second = self.create_collection('2024-01-11', (self.account, 10)).data['id']
+        self.assertEqual(self.client.patch(f'/collections/{first}/', {'date': '2025-02-01'}, format='json').status_code, 200)
+        self.assertEqual(self.refs(CollectionOperation, first), ("0001/2025/DTNDB", 2025, 1))
+        # same year, the ref stays
+        self.assertEqual(self.client.patch(f'/collections/{first}/', {'date': '2025-03-01'}, format='json').status_code, 200)
+        self.assertEqual(self.refs(CollectionOperation, first), ("0001/2025/DTNDB", 2025, 1))
+        self.assertEqual(self.client.patch(f'/collections/{second}/', {'type': 'rejected'}, format='json').status_code, 200)
+        self.assertEqual(self.refs(CollectionOperation, second), ("-", None, None))
+        # back to an operation, a new number
+        self.assertEqual(self.client.patch(f'/collections/{second}/', {'type': 'operation'}, format='json').status_code, 200)
+        self.assertEqual(self.refs(CollectionOperation, second), ("0218/2024/DTNDB", 2024, 218))
+
+    def test_disbursement(self):
+        pk = self.create_disbursement('2024-01-10', self.account, 10).data['id']
+        self.assertEqual(self.refs(DisbursementOperation, pk), ("0465/2024/DTNDB", 2024, 465))
+        self.assertEqual(self.client.patch(f'/disbursements/{pk}/', {'date': '2023-12-31'}, format='json').status_code, 200)
+        self.assertEqual(self.refs(DisbursementOperation, pk), ("0001/2023/DTNDB", 2023, 1))
@@ -0,0 +1,104 @@
+import datetime
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from tresor.exports import stream_xlsx
+from tresor.models import CollectionOperation, DisbursementOperation, LedgerEntry, VaultDeposit
+from tresor.tests.base import OperationTestCase, D
+
+
+class ImportTests(OperationTestCase):
+
+    def post(self, kind, name, content):
+        return self.client.post(f'/import/{kind}/', {'file': SimpleUploadedFile(name, content)}, format='multipart')
+
+    def csv(self, *lines):
+        # a french excel export, ";" separated with decimal commas
+        return ("﻿" + "\r\n".join(";".join(line) for line in lines) + "\r\n").encode('utf-8')
+
+    def test_collections_csv(self):
+        content = self.csv(
+            ["operation", "date", "motif", "beneficiaire", "cheque_number", "name", "banq_name", "montant", "destination_account"],
+            ["1", "2024-01-10", "m", "b", "c1", "n", "bq", "100,50", str(self.account.pk)],
+            ["1", "2024-01-10", "m", "b", "c2", "n", "bq", "1 000,25", str(self.other_account.pk)],
+            ["2", "2024-01-11", "m", "b", "c3", "n", "bq", "10", str(self.account.pk)],
+        )
+        response = self.post('collections', 'operations.csv', content)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data, {"rows": 3, "operations": 2})
+        first = CollectionOperation.objects.get(details__cheque_number="c1")
+        self.assertEqual(first.total, D("1100.75"))
+        self.assertEqual(self.balance(self.account), D("1110.50"))
+        self.assertEqual(self.balance(self.other_account), D("1000.25"))
+        self.assertEqual(self.ledger(account=self.account), [('2024-01-10', D("100.50"), D("1100.50")), ('2024-01-11', D(10), D("1110.50"))])
+        self.assertBalanceConsistent(self.account, account=self.account)
+
+    def test_refs_are_consecutive(self):
+        self.create_collection('2024-01-01', (self.account, 1))
+        content = self.csv(
+            ["date", "motif", "beneficiaire", "cheque_number", "name", "banq_name", "montant", "destination_account", "type"],
+            *[["2024-02-01", "m", "b", str(i), "n", "bq", "1", str(self.account.pk), "operation"] for i in range(3)],
+            ["2024-02-01", "m", "b", "v", "n", "bq", "1", str(self.account.pk), "versement"],
+            ["2025-02-01", "m", "b", "x", "n", "bq", "1", str(self.account.pk), "operation"],
+        )
+        self.assertEqual(self.post('collections', 'operations.csv', content).status_code, 201)
+        refs = list(CollectionOperation.objects.order_by('pk').values_list('ref', flat=True))
+        self.assertEqual(refs, ["0216/2024/DTNDB", "0217/2024/DTNDB", "0218/2024/DTNDB", "0219/2024/DTNDB", "-", "0001/2025/DTNDB"])
+
+    def test_deposits_xlsx(self):
+        header = ["date", "vault", "amount", "motif"]
+        # the dates of a spreadsheet are numbers of days, 45301 is 2024-01-10
+        content = b"".join(stream_xlsx(header, [[45301, self.vault.pk, 100.5, "m"], ["2024-01-11", self.vault.pk, 20, "m"]]))
+        response = self.post('deposits', 'deposits.xlsx', content)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(list(VaultDeposit.objects.order_by('pk').values_list('date', 'amount')), [
+            (datetime.date(2024, 1, 10), D("100.50")), (datetime.date(2024, 1, 11), D(20)),
+        ])
+        self.assertEqual(self.balance(self.vault), D("620.50"))
+        self.assertBalanceConsistent(self.vault, vault=self.vault)
+
+    def test_row_errors_write_nothing(self):
+        before = self.state()
+        content = self.csv(
+            ["date", "motif", "beneficiaire", "cheque_number", "name", "banq_name", "montant", "destination_account"],
+            ["2024-01-10", "m", "b", "c1", "n", "bq", "10", str(self.account.pk)],
+            ["2024-13-10", "m", "b", "c2", "n", "bq", "-5", "999"],
+            ["2024-01-10", "", "b", "c3", "n", "bq", "10", str(self.account.pk)],
+        )
+        response = self.post('collections', 'operations.csv', content)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["errors"], [
+            {"row": 3, "errors": {"date": ["INVALID_DATE"], "montant": ["INVALID_AMOUNT"], "destination_account": ["UNKNOWN_ACCOUNT"]}},
+            {"row": 4, "errors": {"motif": ["REQUIRED"]}},
+        ])
+        self.assertEqual(self.state(), before)
+        self.assertFalse(CollectionOperation.objects.exists())
+
+    def test_debits_are_checked_per_account(self):
+        # 600 + 500 from an account of 1000, each line alone would pass
+        before = self.state()
+        content = self.csv(
+            ["operation", "date", "account", "motif", "beneficiaire", "name", "banq_name", "banq_number", "montant"],
+            ["1", "2024-01-10", str(self.other_account.pk), "m", "b", "n", "bq", "1", "0,01"],
+            ["2", "2024-01-10", str(self.account.pk), "m", "b", "n", "bq", "1", "600"],
+            ["3", "2024-01-11", str(self.account.pk), "m", "b", "n", "bq", "1", "500"],
+        )
+        response = self.post('disbursements', 'operations.csv', content)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["errors"], [
+            {"row": 2, "errors": {"account": ["NOT_ENOUGH_BALANCE"]}},
+            {"row": 3, "errors": {"account": ["NOT_ENOUGH_BALANCE"]}},
+        ])
+        self.assertEqual(self.state(), before)
+        self.assertFalse(DisbursementOperation.objects.exists())
+
+    def test_debits_within_balance(self):
+        content = self.csv(
+            ["date", "account", "motif", "beneficiaire", "name", "banq_name", "banq_number", "montant"],
+            ["2024-01-10", str(self.account.pk), "m", "b", "n", "bq", "1", "600"],
+            ["2024-01-11", str(self.account.pk), "m", "b", "n", "bq", "1", "400"],
+        )
+        self.assertEqual(self.post('disbursements', 'operations.csv', content).status_code, 201)
+        self.assertEqual(self.balance(self.account), D(0))
+        self.assertEqual(LedgerEntry.objects.filter(account=self.account).count(), 2)
+        self.assertBalanceConsistent(self.account, account=self.account)
@@ -0,0 +1,165 @@
+import datetime
+import io
+import threading
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TransactionTestCase, skipUnlessDBFeature
+
+from tresor.models import Account, BalanceSnapshot, LedgerEntry
+from tresor.tests.base import OperationTestCase, D
+
+
+class LedgerEntryManagerTests(OperationTestCase):
+    # the account starts at 1000 without entries
+
+    def record(self, date, amount, source_id):
+        # as the operations do: the entry first, then the balance of the account
+        entry = LedgerEntry.objects.record('collection', source_id, datetime.date.fromisoformat(date), D(amount), account=self.account)
+        Account.objects.filter(pk=self.account.pk).credit(D(amount))
+        return entry
+
+    def remove(self, source_id, amount):
+        LedgerEntry.objects.remove('collection', [source_id])
+        Account.objects.filter(pk=self.account.pk).credit(-D(amount))
+
+    def test_record(self):
+        self.record('2024-01-10', 100, 1)
+        self.record('2024-01-20', 50, 2)
+        self.assertEqual(self.ledger(account=self.account), [('2024-01-10', D(100), D(1100)), ('2024-01-20', D(50), D(1150))])
+        self.assertBalanceConsistent(self.account, account=self.account)
+
+    def test_back_dated_record_shifts_the_later_balances(self):
+        self.record('2024-01-10', 100, 1)
+        self.record('2024-01-20', 50, 2)
+        self.record('2024-01-05', 10, 3)
+        self.record('2024-01-10', -30, 4)
+        self.assertEqual(self.ledger(account=self.account), [
+            ('2024-01-05', D(10), D(1010)),
+            ('2024-01-10', D(100), D(1110)),
+            ('2024-01-10', D(-30), D(1080)),
+            ('2024-01-20', D(50), D(1130)),
+        ])
+        self.assertBalanceConsistent(self.account, account=self.account)
+        self.assertEqual(self.account.get_solde_at_date('2024-01-10'), D(1080))
+
+    def test_record_many_matches_record(self):
+        dates = [('2024-01-10', 100), ('2024-01-05', 10), ('2024-01-10', -30), ('2024-01-20', 50)]
+        self.record('2024-01-07', 5, 99)
+        entries = [LedgerEntry(source_type='collection', source_id=i, date=datetime.date.fromisoformat(date), amount=D(amount), account=self.account) for i, (date, amount) in enumerate(dates)]
+        LedgerEntry.objects.record_many(entries)
+        Account.objects.filter(pk=self.account.pk).credit(sum(D(amount) for _, amount in dates))
+        self.assertEqual(self.ledger(account=self.account), [
+            ('2024-01-05', D(10), D(1010)),
+            ('2024-01-07', D(5), D(1015)),
+            ('2024-01-10', D(100), D(1115)),
+            ('2024-01-10', D(-30), D(1085)),
+            ('2024-01-20', D(50), D(1135)),
+        ])
+        self.assertBalanceConsistent(self.account, account=self.account)
+
+    def test_remove_in_the_middle_of_a_day(self):
+        self.record('2024-01-10', 10, 1)
+        self.record('2024-01-10', 20, 2)
+        self.record('2024-01-10', 30, 3)
+        self.record('2024-01-11', 40, 4)
+        self.remove(2, 20)
+        self.assertEqual(self.ledger(account=self.account), [
+            ('2024-01-10', D(10), D(1010)),
+            ('2024-01-10', D(30), D(1040)),
+            ('2024-01-11', D(40), D(1080)),
+        ])
+        self.assertEqual(BalanceSnapshot.objects.balance_at('2024-01-10', account=self.account), D(1040))
+        self.assertBalanceConsistent(self.account, account=self.account)
+
+    def test_remove_every_entry_of_a_day(self):
+        self.record('2024-01-10', 10, 1)
+        self.record('2024-01-11', 40, 2)
+        self.remove(1, 10)
+        self.assertEqual(self.ledger(account=self.account), [('2024-01-11', D(40), D(1040))])
+        self.assertFalse(BalanceSnapshot.objects.filter(account=self.account, date='2024-01-10').exists())
+
+    def test_replace(self):
+        first = self.record('2024-01-10', 100, 1)
+        self.record('2024-01-20', 50, 2)
+        # the entry of operation 1 moved to another day with another amount
+        LedgerEntry.objects.replace('collection', [1], [LedgerEntry(source_type='collection', source_id=1, date=datetime.date(2024, 1, 25), amount=D(70), account=self.account)])
+        Account.objects.filter(pk=self.account.pk).credit(D(-30))
+        self.assertFalse(LedgerEntry.objects.filter(pk=first.pk).exists())
+        self.assertEqual(self.ledger(account=self.account), [('2024-01-20', D(50), D(1050)), ('2024-01-25', D(70), D(1120))])
+        self.assertBalanceConsistent(self.account, account=self.account)
+
+    def test_balance_at(self):
+        self.record('2024-01-10', 100, 1)
+        self.record('2024-01-20', -50, 2)
+        # before the first entry it is the balance before it
+        self.assertEqual(LedgerEntry.objects.balance_at('2024-01-01', account=self.account), D(1000))
+        self.assertEqual(LedgerEntry.objects.balance_at('2024-01-15', account=self.account), D(1100))
+        self.assertEqual(LedgerEntry.objects.balance_at('2024-02-01', account=self.account), D(1050))
+        self.assertEqual(BalanceSnapshot.objects.balance_at('2024-01-01', account=self.account), D(1000))
+        # without any entry it is the current balance
+        self.assertEqual(LedgerEntry.objects.balance_at('2024-01-01', account=self.other_account), D(0))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentLedgerTests(TransactionTestCase):
+    # operations on the same account in parallel transactions, sqlite writes one transaction at a time
+
+    def setUp(self):
+        self.account = Account.objects.create(name='A1', number='1', balance=1000)
+        self.errors = []
+
+    def record(self, barrier, source_id, date, amount):
+        try:
+            barrier.wait()
+            with transaction.atomic():
+                LedgerEntry.objects.record('collection', source_id, date, amount, account=self.account)
+                Account.objects.filter(pk=self.account.pk).credit(amount)
+        except Exception as error:
+            self.errors.append(error)
+        finally:
+            connection.close()
+
+    def test_interleaved_records_keep_the_running_balances(self):
+        amounts = [D(10 * (i + 1)) for i in range(8)]
+        barrier = threading.Barrier(len(amounts))
+        threads = [
+            threading.Thread(target=self.record, args=(barrier, i, datetime.date(2024, 1, 10 + i % 3), amount))
+            for i, amount in enumerate(amounts)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.errors, [])
+
+        balance = D(1000)
+        for entry in LedgerEntry.objects.filter(account=self.account).order_by('date', 'id'):
+            balance += entry.amount
+            self.assertEqual(entry.balance, balance)
+        self.assertEqual(balance, D(1000) + sum(amounts))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, balance)
+        self.assertEqual(BalanceSnapshot.objects.filter(account=self.account).order_by('-date').first().balance, balance)
+
+
+class RebuildLedgerTests(OperationTestCase):
+
+    def rows(self):
+        # the entries per owner in order, without their ids
+        return list(LedgerEntry.objects.order_by('account', 'vault', 'date', 'id').values_list('account', 'vault', 'date', 'source_type', 'source_id', 'amount', 'balance'))
+
+    def test_rebuild_gives_the_incremental_entries(self):
+        self.create_collection('2024-01-10', (self.account, 100), (self.other_account, 30))
+        self.create_disbursement('2024-01-12', self.account, 40, 10)
+        # back-dated operations, before and in the middle of the existing ones
+        self.create_collection('2024-01-05', (self.other_account, 20))
+        self.create_disbursement('2024-01-10', self.other_account, 15)
+        self.create_deposit('2024-01-08', self.vault, 200)
+        self.create_withdrawal('2024-01-03', self.vault, 100, account=self.account)
+        deleted = self.create_collection('2024-01-11', (self.account, 5)).data['id']
+        self.client.delete(f'/collections/{deleted}/')
+        incremental = self.rows()
+        self.assertEqual(len(incremental), 8)
+
+        call_command('rebuild_ledger', stdout=io.StringIO())
+        self.assertEqual(self.rows(), incremental)
@@ -0,0 +1,125 @@
+from tresor.models import CollectionOperationDetail, DisbursementOperationDetail, LedgerEntry
+from tresor.tests.base import OperationTestCase, D
+
+
+class CollectionUpdateTests(OperationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        response = self.create_collection('2024-01-10', (self.account, 100), (self.other_account, 50), (self.account, 20))
+        self.operation = response.data['id']
+        self.details = [detail['id'] for detail in response.data['details']]
+        self.create_collection('2024-01-15', (self.account, 5))
+
+    def update(self, **data):
+        return self.client.patch(f'/collections/{self.operation}/', data, format='json')
+
+    def test_amount_account_and_dropped_detail(self):
+        # 100 => 70, the 50 moves to the first account, the 20 is dropped
+        response = self.update(details=[
+            self.collection_detail(self.account, 70, id=self.details[0]),
+            self.collection_detail(self.account, 50, id=self.details[1]),
+        ])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['total'], D(120))
+        self.assertEqual(self.balance(self.account), D(1125))
+        self.assertEqual(self.balance(self.other_account), D(0))
+        self.assertFalse(CollectionOperationDetail.objects.filter(pk=self.details[2]).exists())
+        self.assertEqual(self.ledger(account=self.account), [
+            ('2024-01-10', D(70), D(1070)),
+            ('2024-01-10', D(50), D(1120)),
+            ('2024-01-15', D(5), D(1125)),
+        ])
+        self.assertEqual(self.ledger(account=self.other_account), [])
+        self.assertEqual(self.account.get_solde_at_date('2024-01-09'), D(1000))
+        self.assertEqual(self.account.get_solde_at_date('2024-01-12'), D(1120))
+        self.assertEqual(self.other_account.get_solde_at_date('2024-01-12'), D(0))
+        self.assertBalanceConsistent(self.account, account=self.account)
+
+    def test_new_detail(self):
+        details = [self.collection_detail(self.account, 100, id=self.details[0]), self.collection_detail(self.other_account, 50, id=self.details[1]),
+                   self.collection_detail(self.account, 20, id=self.details[2]), self.collection_detail(self.other_account, 7)]
+        self.assertEqual(self.update(details=details).status_code, 200)
+        self.assertEqual(self.balance(self.other_account), D(57))
+        self.assertEqual(self.ledger(account=self.other_account), [('2024-01-10', D(50), D(50)), ('2024-01-10', D(7), D(57))])
+
+    def test_date_moved_backwards(self):
+        self.create_collection('2024-01-05', (self.account, 1))
+        self.assertEqual(self.update(date='2024-01-01').status_code, 200)
+        self.assertEqual(self.ledger(account=self.account), [
+            ('2024-01-01', D(100), D(1100)),
+            ('2024-01-01', D(20), D(1120)),
+            ('2024-01-05', D(1), D(1121)),
+            ('2024-01-15', D(5), D(1126)),
+        ])
+        self.assertEqual(self.account.get_solde_at_date('2023-12-31'), D(1000))
+        self.assertEqual(self.account.get_solde_at_date('2024-01-03'), D(1120))
+        self.assertEqual(self.account.get_solde_at_date('2024-01-12'), D(1121))
+        self.assertEqual(self.other_account.get_solde_at_date('2024-01-03'), D(50))
+        self.assertBalanceConsistent(self.account, account=self.account)
+        self.assertBalanceConsistent(self.other_account, account=self.other_account)
+
+    def test_overdraft(self):
+        # the 50 of the second account was spent, it can not be taken back
+        self.create_disbursement('2024-01-20', self.other_account, 40)
+        before = self.state()
+        response = self.update(details=[
+            self.collection_detail(self.account, 100, id=self.details[0]),
+            self.collection_detail(self.other_account, 5, id=self.details[1]),
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"details": ["NOT_ENOUGH_BALANCE"]})
+        self.assertEqual(self.state(), before)
+        self.assertEqual(CollectionOperationDetail.objects.filter(parent=self.operation).count(), 3)
+
+
+class DisbursementUpdateTests(OperationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        response = self.create_disbursement('2024-01-10', self.account, 100, 50)
+        self.operation = response.data['id']
+        self.details = [detail['id'] for detail in response.data['details']]
+        self.create_disbursement('2024-01-15', self.account, 10)
+
+    def update(self, **data):
+        return self.client.patch(f'/disbursements/{self.operation}/', data, format='json')
+
+    def test_amount_and_dropped_detail(self):
+        response = self.update(details=[self.disbursement_detail(120, id=self.details[0])])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.balance(self.account), D(870))
+        self.assertFalse(DisbursementOperationDetail.objects.filter(pk=self.details[1]).exists())
+        self.assertEqual(self.ledger(account=self.account), [('2024-01-10', D(-120), D(880)), ('2024-01-15', D(-10), D(870))])
+        self.assertEqual(self.account.get_solde_at_date('2024-01-12'), D(880))
+        self.assertBalanceConsistent(self.account, account=self.account)
+
+    def test_account_changed(self):
+        self.create_collection('2024-01-01', (self.other_account, 500))
+        self.assertEqual(self.update(account=self.other_account.pk).status_code, 200)
+        self.assertEqual(self.balance(self.account), D(990))
+        self.assertEqual(self.balance(self.other_account), D(350))
+        self.assertEqual(self.ledger(account=self.account), [('2024-01-15', D(-10), D(990))])
+        self.assertEqual(self.ledger(account=self.other_account), [('2024-01-01', D(500), D(500)), ('2024-01-10', D(-150), D(350))])
+        self.assertEqual(self.account.get_solde_at_date('2024-01-12'), D(1000))
+        self.assertBalanceConsistent(self.other_account, account=self.other_account)
+
+    def test_date_moved_backwards(self):
+        self.assertEqual(self.update(date='2024-01-01').status_code, 200)
+        self.assertEqual(self.ledger(account=self.account), [('2024-01-01', D(-150), D(850)), ('2024-01-15', D(-10), D(840))])
+        self.assertEqual(self.account.get_solde_at_date('2024-01-12'), D(850))
+        self.assertFalse(LedgerEntry.objects.filter(account=self.account, date='2024-01-10').exists())
+        self.assertBalanceConsistent(self.account, account=self.account)
+
+    def test_overdraft(self):
+        before = self.state()
+        response = self.update(details=[self.disbursement_detail(100, id=self.details[0]), self.disbursement_detail(891, id=self.details[1])])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"details": ["NOT_ENOUGH_BALANCE"]})
+        self.assertEqual(self.state(), before)
+        self.assertEqual(list(DisbursementOperationDetail.objects.filter(parent=self.operation).order_by('pk').values_list('montant', flat=True)), [D(100), D(50)])
+
+    def test_unknown_detail(self):
+        response = self.update(details=[self.disbursement_detail(100, id=404)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"details": ["UNKNOWN_DETAIL"]})
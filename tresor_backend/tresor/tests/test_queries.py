@@ -0,0 +1,36 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tresor.tests.base import OperationTestCase
+
+
+class OperationQueriesTests(OperationTestCase):
+    # the lists and the details of the operations read their details and accounts with a fixed number of queries
+
+    def queries(self, path):
+        # the counts of the pages are cached, every request is measured from an empty cache
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertSameQueries(self, endpoint, create):
+        first = create(0).data['id']
+        paths = [f'{endpoint}?all=true', endpoint, f'{endpoint}{first}/']
+        single = [self.queries(path) for path in paths]
+        # more operations than a page, with more details each
+        for i in range(1, 13):
+            self.assertEqual(create(i).status_code, 201)
+        self.assertEqual(len(self.client.get(paths[0]).data), 13)
+        self.assertEqual([self.queries(path) for path in paths], single)
+        self.assertEqual(self.queries(f'{endpoint}?page=2'), single[1])
+
+    def test_collections(self):
+        self.assertSameQueries('/collections/', lambda i: self.create_collection(
+            '2024-01-10', *[(self.account if j % 2 else self.other_account, 10) for j in range(i + 1)]))
+
+    def test_disbursements(self):
+        self.assertSameQueries('/disbursements/', lambda i: self.create_disbursement(
+            '2024-01-10', self.account, *[1] * (i + 1)))
@@ -0,0 +1,43 @@
+import json
+
+from tresor.tests.base import OperationTestCase, D
+
+
+class ReleveTests(OperationTestCase):
+    # the releves of an account, a vault and of several of them read the same ledger entries
+
+    def setUp(self):
+        super().setUp()
+        self.create_collection('2024-01-10', (self.account, 100))
+        self.create_disbursement('2024-01-12', self.account, 40)
+        self.create_deposit('2024-01-11', self.vault, 200)
+
+    def paths(self, query):
+        return [
+            f'/accounts/{self.account.pk}/releve/?{query}',
+            f'/vaults/{self.vault.pk}/releve/?{query}',
+            f'/releve/consolidated/?accounts={self.account.pk}&vaults={self.vault.pk}&{query}',
+        ]
+
+    def test_invalid_dates(self):
+        for query in ['start_date=2024-01-01&end_date=2024-13-40', 'start_date=2024-01&end_date=2024-01-31', 'start_date=2024-02-01&end_date=2024-01-01', 'start_date=2024-01-01']:
+            for path in self.paths(query):
+                self.assertEqual(self.client.get(path).status_code, 400, path)
+
+    def test_consolidated(self):
+        response = self.client.get(self.paths('start_date=2024-01-01&end_date=2024-01-31')[2])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['start_date_balance'], D(1500))
+        self.assertEqual(response.data['end_date_balance'], D(1760))
+        self.assertEqual([(line['type'], line['operation_name'], line['total_balance']) for line in response.data['data']], [
+            ('collection', 'Versement de cheque N° 1', D(1600)),
+            ('deposit', 'motif', D(1800)),
+            ('disbursement', 'motif', D(1760)),
+        ])
+
+    def test_stream_is_the_response(self):
+        account, _, consolidated = self.paths('start_date=2024-01-01&end_date=2024-01-31')
+        for path in [account, consolidated]:
+            expected = json.loads(self.client.get(path, HTTP_ACCEPT='application/json').content)
+            response = self.client.get(path + '&stream=true')
+            self.assertEqual(json.loads(b"".join(response.streaming_content)), expected)
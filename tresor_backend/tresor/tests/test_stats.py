@@ -0,0 +1,59 @@
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache
+
+from authentication.models import User
+from tresor.tests.base import OperationTestCase, D
+from tresor.utils import STATS_VERSION_KEY
+
+
+class DateRangeTests(OperationTestCase):
+    # the stats series and the balance sheet take a range of days, months or years
+
+    def setUp(self):
+        super().setUp()
+        self.create_collection('2024-01-10', (self.account, 100))
+        self.create_disbursement('2024-02-12', self.account, 40)
+
+    def test_invalid_dates(self):
+        for path in ['/stats/series/', '/balance_sheet/']:
+            for query in ['start_date=2024-01-01&end_date=2024-13-40', 'start_date=x&end_date=2024-01-31']:
+                response = self.client.get(f'{path}?{query}')
+                self.assertEqual(response.status_code, 400, path)
+                self.assertEqual(response.data, {"date": ["INVALID_DATE"]})
+            self.assertEqual(self.client.get(f'{path}?start_date=2024-02-01&end_date=2024-01-01').status_code, 400)
+
+    def test_months(self):
+        # 2024-01 to 2024-01 is the whole of january
+        response = self.client.get('/balance_sheet/?start_date=2024-01&end_date=2024-01')
+        self.assertEqual(response.status_code, 200)
+        account = next(row for row in response.data['accounts'] if row['id'] == self.account.pk)
+        self.assertEqual((account['total_collection'], account['total_disbursement'], account['closing_balance']), (D(100), 0, D(1100)))
+        response = self.client.get('/stats/series/?start_date=2024-01&end_date=2024-02&bucket=month')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['total'] for row in response.data['collections']], [D(100)])
+        self.assertEqual([row['total'] for row in response.data['disbursements']], [D(40)])
+
+
+class UserStatsInvalidationTests(OperationTestCase):
+    # the stats and the counts are cached under a version, changed by the writes that change them
+
+    def version(self):
+        return cache.get(STATS_VERSION_KEY)
+
+    def assertInvalidates(self, write, invalidates=True):
+        before = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.assertEqual(self.version() != before, invalidates)
+
+    def test_user_saves(self):
+        cache.set(STATS_VERSION_KEY, 1, None)
+        self.assertInvalidates(lambda: User.objects.create_user('agent', 'Agent', 'password'))
+        user = User.objects.get(username='agent')
+        # a login, a new password
+        self.assertInvalidates(lambda: update_last_login(None, user), invalidates=False)
+        self.assertInvalidates(lambda: self.client.post(f'/users/{user.pk}/update_password/', {'password': 'new password'}), invalidates=False)
+        self.assertTrue(User.objects.get(pk=user.pk).check_password('new password'))
+        user.name = 'Other'
+        self.assertInvalidates(lambda: user.save(update_fields=['name']))
+        self.assertInvalidates(user.delete)
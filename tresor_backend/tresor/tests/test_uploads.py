@@ -0,0 +1,87 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+
+from authentication.models import User
+from tresor.models import DisbursementOperation, Upload
+from tresor.tests.base import OperationTestCase
+
+
+class UploadTests(OperationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        paths = override_settings(MEDIA_ROOT=f"{root}/media", UPLOADS_ROOT=f"{root}/uploads", UPLOAD_CHUNK_MAX_SIZE=4)
+        paths.enable()
+        self.addCleanup(paths.disable)
+        self.content = b'%PDF-1.4 scan'
+
+    def start(self, content):
+        response = self.client.post('/uploads/', {'file_name': 'scan.pdf', 'size': len(content), 'sha256': hashlib.sha256(content).hexdigest()}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def send(self, upload, offset, part):
+        return self.client.put(f'/uploads/{upload}/', data=part, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def upload(self, content):
+        upload = self.start(content)
+        for offset in range(0, len(content), settings.UPLOAD_CHUNK_MAX_SIZE):
+            response = self.send(upload, offset, content[offset:offset + settings.UPLOAD_CHUNK_MAX_SIZE])
+            self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['complete'])
+        return upload
+
+    def create(self, upload):
+        return self.client.post('/disbursements/', {
+            'date': '2024-01-10', 'motif': 'm', 'beneficiaire': 'b', 'type': 'operation', 'account': self.account.pk,
+            'details': [self.disbursement_detail(10)], 'upload': upload,
+        }, format='json')
+
+    def test_upload(self):
+        upload = self.upload(self.content)
+        # the upload is removed once the operation is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.create(upload)
+        self.assertEqual(response.status_code, 201, response.data)
+        operation = DisbursementOperation.objects.get(pk=response.data['id'])
+        self.assertEqual(operation.file.read(), self.content)
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(os.listdir(settings.UPLOADS_ROOT), [])
+
+    def test_resume(self):
+        upload = self.start(self.content)
+        self.assertEqual(self.send(upload, 0, self.content[:4]).status_code, 200)
+        # the response of the first part was lost, it is sent again
+        response = self.send(upload, 0, self.content[:4])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 4)
+        self.assertEqual(self.client.get(f'/uploads/{upload}/').data['offset'], 4)
+        self.assertEqual(self.send(upload, 4, self.content[4:12]).status_code, 413)
+
+    def test_checksum_mismatch(self):
+        upload = self.start(self.content)
+        for offset in range(0, len(self.content), 4):
+            response = self.send(upload, offset, b'x' * len(self.content[offset:offset + 4]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], "CHECKSUM_MISMATCH")
+        self.assertEqual(response.data['offset'], 0)
+
+    def test_missing_part_file(self):
+        upload = self.upload(self.content)
+        os.remove(Upload.objects.get(pk=upload).path)
+        response = self.create(upload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"upload": ["UPLOAD_FILE_MISSING"]})
+        self.assertFalse(DisbursementOperation.objects.exists())
+
+    def test_other_user(self):
+        upload = self.upload(self.content)
+        Upload.objects.filter(pk=upload).update(created_by=User.objects.create_user('other', 'Other', 'password'))
+        self.assertEqual(self.create(upload).status_code, 400)
@@ -1,12 +1,57 @@
+import datetime
+from django.core.cache import cache
+from rest_framework.exceptions import ValidationError
+
+# the stats are cached until the next write on the operations, vaults or accounts
+STATS_CACHE_TIMEOUT = 60 * 60
+STATS_VERSION_KEY = "stats:version"
+
+
+def stats_cache_key(key):
+    # the version is part of the key, invalidating is changing the version
+    return f"{key}:{cache.get_or_set(STATS_VERSION_KEY, 1, None)}"
+
+
+def invalidate_stats():
+    try:
+        cache.incr(STATS_VERSION_KEY)
+    except ValueError:
+        cache.set(STATS_VERSION_KEY, 1, None)
+
+
+def date_range(date):
+    # "2024", "2024-05" or "2024-05-17" => [start, end) dates of that year, month or day
+    splited = date.split("-")
+    try:
+        if len(splited) == 1 and len(splited[0]) == 4:
+            start = datetime.date(int(splited[0]), 1, 1)
+            return start, start.replace(year=start.year + 1)
+        if len(splited) == 2:
+            start = datetime.date(int(splited[0]), int(splited[1]), 1)
+            return start, (start + datetime.timedelta(days=31)).replace(day=1)
+        if len(splited) == 3:
+            start = datetime.date.fromisoformat(date)
+            return start, start + datetime.timedelta(days=1)
+    except ValueError:
+        pass
+    raise ValidationError({"date": ["INVALID_DATE"]})
+
+
 def filter_query_by_date(queryset, date, filed_name = "date"):
+    # a range on the column and not date__year / date__month, so that the indexes on it can be used
     if not date:
         return queryset
-    
-    splited = date.split("-")
-    if len(splited) == 1 and len(splited[0]) == 4:
-        queryset = queryset.filter(**{f"{filed_name}__year": date})
-    elif len(splited) == 2:
-        queryset = queryset.filter(**{f"{filed_name}__year": splited[0], f"{filed_name}__month": splited[1]})
-    elif len(splited) == 3:
-        queryset = queryset.filter(**{f"{filed_name}__year": splited[0], f"{filed_name}__month": splited[1], f"{filed_name}__day": splited[2]})
-    return queryset
\ No newline at end of file
+    start, end = date_range(date)
+    return queryset.filter(**{f"{filed_name}__gte": start, f"{filed_name}__lt": end})
+
+
+def filter_query_by_params(queryset, params, filed_name = "date"):
+    # ?date=2024-05 and / or ?date_from=2024-05-03&date_to=2024-06-10 (both included)
+    queryset = filter_query_by_date(queryset, params.get('date', None), filed_name)
+    date_from = params.get('date_from', None)
+    date_to = params.get('date_to', None)
+    if date_from:
+        queryset = queryset.filter(**{f"{filed_name}__gte": date_range(date_from)[0]})
+    if date_to:
+        queryset = queryset.filter(**{f"{filed_name}__lt": date_range(date_to)[1]})
+    return queryset
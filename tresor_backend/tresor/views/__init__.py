@@ -1,4 +1,5 @@
 from .account import *
+from .balance_sheet import *
 from .collection_operation import *
 from .disbursement_operation import *
 from .files import *
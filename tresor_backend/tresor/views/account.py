@@ -1,13 +1,20 @@
+import datetime
+from django.http import StreamingHttpResponse
+from django.utils.text import slugify
 from rest_framework.viewsets import ModelViewSet
 
-from tresor.utils import filter_query_by_date
+from tresor.exports import RELEVE_HEADER, export_response, releve_entries, releve_rows, stream_releve
+from tresor.sparse import load_only, sparse_fields
+from tresor.utils import date_range, filter_query_by_date, stats_cache_key, STATS_CACHE_TIMEOUT
 from ..models.account import Account, AccountSerializer
 from rest_framework.permissions import IsAdminUser  , IsAuthenticated
 from rest_framework.views import APIView, Response
-from django.db.models import F , Value
-from ..models import DisbursementOperation, CollectionOperation, CollectionOperationDetail
+from django.db.models import F , Value, Q
+from ..models import DisbursementOperation, CollectionOperation, CollectionOperationDetail, LedgerEntry, OperationRollup
 from rest_framework import serializers
-from django.db.models import Sum
+from django.db.models import Sum, Count
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth
+from django.core.cache import cache
 from ..models import Vault, VaultGroup
 from tresor.models.vault import Vault, VaultDeposit, VaultWithdrawal
 
@@ -21,118 +28,219 @@ class AccountViewSet(ModelViewSet):
     ordering = ['-balance']
     pagination_class = None
 
+    def get_queryset(self):
+        return load_only(super().get_queryset(), sparse_fields(self.get_serializer()))
 
-class ReleveSerializer(serializers.Serializer):
-    date = serializers.DateField()
-    amount = serializers.DecimalField(max_digits=10, decimal_places=2)
-    operation_name = serializers.CharField()
-    type = serializers.CharField()
-    meta_data = serializers.DictField()
 
 class StatsView(APIView):
     def get(self, request):
         date = request.query_params.get('date', None)
-            
-        total_solde = Account.objects.aggregate(total_solde= Sum('balance'))['total_solde']
-        total_disbursement = filter_query_by_date(DisbursementOperation.objects, date).aggregate(total_disbursement= Sum('total'))['total_disbursement'] or 0
-        total_collection = filter_query_by_date(CollectionOperation.objects, date).aggregate(total_collection= Sum('total'))['total_collection'] or 0
-        collections_count = filter_query_by_date(CollectionOperation.objects, date).count()
-        disbursements_count = filter_query_by_date(DisbursementOperation.objects, date).count()
-        accounts_count = Account.objects.count()
+        key = stats_cache_key(f"stats:{date}")
+        ret = cache.get(key)
+        if ret is None:
+            ret = self.get_stats(date)
+            cache.set(key, ret, STATS_CACHE_TIMEOUT)
+        return Response(ret)
+
+    def get_stats(self, date):
+        # a fixed number of queries whatever the number of groups
+        accounts = Account.objects.aggregate(total_solde=Sum('balance'), accounts_count=Count('id'))
+        vault_soldes = dict(Vault.objects.values_list('group').annotate(total=Sum('balance')).order_by())
+        if date and len(date.split("-")) == 3:
+            # a single day is finer than the monthly rollups, the totals are summed on the details directly
+            disbursements = filter_query_by_date(DisbursementOperation._base_manager, date).aggregate(
+                total=Sum('details__montant'), count=Count('id', distinct=True))
+            collections = filter_query_by_date(CollectionOperation._base_manager, date).aggregate(
+                total=Sum('details__montant'), count=Count('id', distinct=True))
+            deposits = filter_query_by_date(VaultDeposit.objects, date).values('vault__group').annotate(total=Sum('amount'), count=Count('id'))
+            withdrawals = filter_query_by_date(VaultWithdrawal.objects, date).values('vault__group').annotate(total=Sum('amount'), count=Count('id'))
+        else:
+            rollups = filter_query_by_date(OperationRollup.objects, date, "period")
+            disbursements = rollups.filter(kind='disbursement').aggregate(total=Sum('total'), count=Sum('operations'))
+            collections = rollups.filter(kind='collection').aggregate(total=Sum('total'), count=Sum('operations'))
+            deposits = rollups.filter(kind='deposit').values('vault__group').annotate(total=Sum('total'), count=Sum('operations'))
+            withdrawals = rollups.filter(kind='withdrawal').values('vault__group').annotate(total=Sum('total'), count=Sum('operations'))
+        deposits = {row['vault__group']: row for row in deposits.order_by()}
+        withdrawals = {row['vault__group']: row for row in withdrawals.order_by()}
 
         groups_stats = {}
-        for group in VaultGroup.objects.all():
-            total_vault_solde = group.vaults.aggregate(total_solde= Sum('balance'))['total_solde']
-            total_vault_deposit = filter_query_by_date(VaultDeposit.objects.filter(vault__group=group), date).aggregate(total_deposit= Sum('amount'))['total_deposit'] or 0
-            total_vault_withdrawal = filter_query_by_date(VaultWithdrawal.objects.filter(vault__group=group), date).aggregate(total_withdrawal= Sum('amount'))['total_withdrawal'] or 0
-            deposits_count = filter_query_by_date(VaultDeposit.objects.filter(vault__group=group), date).count()
-            withdrawals_count = filter_query_by_date(VaultWithdrawal.objects.filter(vault__group=group), date).count()
-            groups_stats[group.name] = {
-                "total_vault_solde": total_vault_solde,
-                "total_vault_deposit": total_vault_deposit,
-                "total_vault_withdrawal": total_vault_withdrawal,
-                "deposits_count": deposits_count,
-                "withdrawals_count": withdrawals_count,
+        for group in VaultGroup.objects.values('id', 'name'):
+            deposit = deposits.get(group['id'], {})
+            withdrawal = withdrawals.get(group['id'], {})
+            groups_stats[group['name']] = {
+                "total_vault_solde": vault_soldes.get(group['id']),
+                "total_vault_deposit": deposit.get('total', 0),
+                "total_vault_withdrawal": withdrawal.get('total', 0),
+                "deposits_count": deposit.get('count', 0),
+                "withdrawals_count": withdrawal.get('count', 0),
             }
 
-
-        return Response({
-            "total_solde": total_solde,
-            "total_disbursement": total_disbursement,
-            "total_collection": total_collection, 
-            "collections_count": collections_count,
-            "disbursements_count": disbursements_count,
-            "accounts_count": accounts_count,
+        return {
+            "total_solde": accounts['total_solde'],
+            "total_disbursement": disbursements['total'] or 0,
+            "total_collection": collections['total'] or 0, 
+            "collections_count": collections['count'] or 0,
+            "disbursements_count": disbursements['count'] or 0,
+            "accounts_count": accounts['accounts_count'],
 
             "groups_stats": groups_stats
-        })
+        }
     
 
 
+class StatsSeriesView(APIView):
+    # totals and counts per day, week or month, optionally split by account, vault group or type
+    buckets = {"day": TruncDay, "week": TruncWeek, "month": TruncMonth}
+    splits = ["account", "group", "type"]
+
+    def get(self, request):
+        start_date = request.query_params.get('start_date', None)
+        end_date = request.query_params.get('end_date', None)
+        bucket = request.query_params.get('bucket', "month")
+        by = request.query_params.get('by', None)
+        if start_date is None or end_date is None:
+            return Response({"error": "start_date and end_date are required"}, status=400)
+        # INVALID_DATE when a date is not a year, a month or a day, the range goes to the end of end_date
+        start, end = date_range(start_date)[0], date_range(end_date)[1] - datetime.timedelta(days=1)
+        if start > end:
+            return Response({"error": "start_date must be less than end_date"}, status=400)
+        if bucket not in self.buckets:
+            return Response({"error": "bucket must be day, week or month"}, status=400)
+        if by is not None and by not in self.splits:
+            return Response({"error": "by must be account, group or type"}, status=400)
+
+        key = stats_cache_key(f"stats_series:{start}:{end}:{bucket}:{by}")
+        ret = cache.get(key)
+        if ret is None:
+            ret = self.get_series(start, end, bucket, by)
+            cache.set(key, ret, STATS_CACHE_TIMEOUT)
+        return Response(ret)
+
+    def get_series(self, start_date, end_date, bucket, by):
+        # one grouped query per series, the split field of each series (if it has one) is part of the group by
+        if bucket == "month" and self.covers_whole_months(start_date, end_date):
+            return self.get_rollup_series(start_date, end_date, by)
+        series = {
+            "collections": (CollectionOperation._base_manager, 'details__montant', {"account": 'details__destination_account', "type": 'type'}),
+            "disbursements": (DisbursementOperation._base_manager, 'details__montant', {"account": 'account', "type": 'type'}),
+            "deposits": (VaultDeposit.objects, 'amount', {"group": 'vault__group'}),
+            "withdrawals": (VaultWithdrawal.objects, 'amount', {"account": 'account', "group": 'vault__group'}),
+        }
+        ret = {"start_date": start_date, "end_date": end_date, "bucket": bucket, "by": by}
+        for name, (queryset, amount, split_fields) in series.items():
+            fields = {"period": self.buckets[bucket]('date')}
+            if by in split_fields:
+                fields["key"] = F(split_fields[by])
+            rows = queryset.filter(date__gte=start_date, date__lte=end_date).values(**fields).annotate(
+                total=Sum(amount), count=Count('id', distinct=True)).order_by('period')
+            ret[name] = [{"key": None, **row} for row in rows]
+        return ret
+
+    def covers_whole_months(self, start_date, end_date):
+        return start_date.day == 1 and (end_date + datetime.timedelta(days=1)).day == 1
+
+    def get_rollup_series(self, start_date, end_date, by):
+        # same series read from the monthly rollups, a collection split on several accounts is counted once per account
+        series = {
+            "collections": ('collection', {"account": 'account', "type": 'type'}),
+            "disbursements": ('disbursement', {"account": 'account', "type": 'type'}),
+            "deposits": ('deposit', {"group": 'vault__group'}),
+            "withdrawals": ('withdrawal', {"account": 'account', "group": 'vault__group'}),
+        }
+        ret = {"start_date": start_date, "end_date": end_date, "bucket": "month", "by": by}
+        count = 'count' if by == "account" else 'operations'
+        for name, (kind, split_fields) in series.items():
+            fields = {}
+            if by in split_fields:
+                fields["key"] = F(split_fields[by])
+            rows = OperationRollup.objects.filter(kind=kind, period__gte=start_date, period__lte=end_date).values('period', **fields).annotate(
+                total=Sum('total'), count=Sum(count)).order_by('period')
+            ret[name] = [{"key": None, **row} for row in rows]
+        return ret
+
+
 class AccountReleve(APIView):
     permission_classes = [IsAdminUser]
+    max_page_size = 1000
+
     def get(self, request, pk):
         start_date = request.query_params.get('start_date', None)
         end_date = request.query_params.get('end_date', None)
         if start_date is None or end_date is None:
             return Response({"error": "start_date and end_date are required"}, status=400)
-        if start_date > end_date:
+        try:
+            start, end = datetime.date.fromisoformat(start_date), datetime.date.fromisoformat(end_date)
+        except ValueError:
+            return Response({"error": "invalid start_date or end_date"}, status=400)
+        if start > end:
             return Response({"error": "start_date must be less than end_date"}, status=400)
         try:
             account = Account.objects.get(pk=pk)
         except Account.DoesNotExist:
             return Response({"error": "Account not found"}, status=404)
+        day_before_start = start - datetime.timedelta(days=1)
+
+        entries = self.get_entries(account, start, end)
+        balances = {
+            "start_date_balance": LedgerEntry.objects.balance_at(day_before_start, account=account),
+            "end_date_balance": LedgerEntry.objects.balance_at(end, account=account),
+        }
 
-        releve = []
-        total_change = 0
-        for operation_detail in account.collection_operations_details.filter(parent__date__gte=start_date, parent__date__lte=end_date):
-            total_change += operation_detail.montant
-            operation_name = operation_detail.parent.motif
-            if operation_detail.parent.type == "operation":
-                operation_name =  "Versement de cheque N° " + operation_detail.cheque_number
-            releve.append({
-                "date": operation_detail.parent.date,
-                "amount": operation_detail.montant,
-                "operation_name": operation_name,
-                "meta_data" : {
-                    "cheque_number": operation_detail.cheque_number,
-                    "name": operation_detail.name,
-                    "banq_name": operation_detail.banq_name,
-                    "destination_account": operation_detail.destination_account.name,
-                    "operation_type": operation_detail.parent.type
-                },
-                "type": "collection"    
-            })
-        for operation in account.disbursement_operations.filter(date__gte=start_date, date__lte=end_date):
-            total_change -= operation.total
-            releve.append({
-                "date": operation.date,
-                "amount": operation.total,
-                "operation_name": operation.motif,
-                "type": "disbursement",
-                "meta_data": {
-                    "account_name": operation.account.name
-                }
-            })
-        for fund_transfer in account.fund_transfers.filter(date__gte=start_date, date__lte=end_date):
-            total_change += fund_transfer.amount
-            releve.append({
-                "date": fund_transfer.date,
-                "amount": fund_transfer.amount, 
-                "operation_name": fund_transfer.motif,
-                "type": "fund_transfer",
-                "meta_data": {
-                    "account_name": fund_transfer.account.name
-                }
-            })
-        releve.sort(key=lambda x: x['date'])
-
-        serializer = ReleveSerializer(releve, many=True)
-
-        end_date_solde = account.get_solde_at_date(end_date)
-        return Response(
-           { 
-            "start_date_balance": end_date_solde - total_change,
-            "end_date_balance":  end_date_solde,
-            "data": serializer.data}
-        )
\ No newline at end of file
+        export = request.query_params.get('export', None)
+        if export in ("csv", "xlsx"):
+            lines = (self.to_line(account, entry) for entry in entries.iterator(chunk_size=2000))
+            return export_response(export, f"releve_{slugify(account.name)}_{start_date}_{end_date}", RELEVE_HEADER, releve_rows(balances, lines), account.name)
+
+        if request.query_params.get('stream', None) == "true":
+            # same document as the non paginated response, written line by line from a server side cursor
+            lines = (self.to_line(account, entry) for entry in entries.iterator(chunk_size=2000))
+            return StreamingHttpResponse(stream_releve(balances, lines), content_type='application/json')
+
+        page_size = request.query_params.get('page_size', None)
+        if page_size is None:
+            return Response({**balances, "data": [self.to_line(account, entry) for entry in entries]})
+        if not page_size.isdigit() or int(page_size) == 0:
+            return Response({"error": "invalid page_size"}, status=400)
+        page_size = min(int(page_size), self.max_page_size)
+
+        # keyset pagination on the (date, id) order of the ledger, the cursor is the last line of the previous page
+        cursor = request.query_params.get('cursor', None)
+        if cursor is not None:
+            cursor_date, _, cursor_id = cursor.partition('_')
+            try:
+                cursor_date, cursor_id = datetime.date.fromisoformat(cursor_date), int(cursor_id)
+            except ValueError:
+                return Response({"error": "invalid cursor"}, status=400)
+            entries = entries.filter(Q(date__gt=cursor_date) | Q(date=cursor_date, id__gt=cursor_id))
+        page = list(entries[:page_size])
+        next_cursor = None
+        if len(page) == page_size:
+            next_cursor = f"{page[-1]['date']}_{page[-1]['id']}"
+        return Response({**balances, "next": next_cursor, "data": [self.to_line(account, entry) for entry in page]})
+
+    def get_entries(self, account, start_date, end_date):
+        # one range scan on the ledger of the account, the source fields are read with primary key lookups
+        return releve_entries(LedgerEntry.objects.between(start_date, end_date, account=account), 'cheque_number', 'name', 'banq_name').values(
+            'id', 'date', 'amount', 'balance', 'source_type', 'operation_name', 'cheque_number', 'name', 'banq_name', 'operation_type')
+
+    def to_line(self, account, entry):
+        operation_name = entry['operation_name']
+        meta_data = {"account_name": account.name}
+        if entry['source_type'] == "collection":
+            if entry['operation_type'] == "operation":
+                operation_name = "Versement de cheque N° " + entry['cheque_number']
+            meta_data = {
+                "cheque_number": entry['cheque_number'],
+                "name": entry['name'],
+                "banq_name": entry['banq_name'],
+                "destination_account": account.name,
+                "operation_type": entry['operation_type'],
+            }
+        return {
+            "date": entry['date'],
+            "amount": abs(entry['amount']),
+            "balance": entry['balance'],
+            "operation_name": operation_name,
+            "type": entry['source_type'],
+            "meta_data": meta_data,
+        }
@@ -0,0 +1,70 @@
+import datetime
+from django.db.models import F, Q, Sum
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView, Response
+
+from tresor.utils import date_range
+from ..models import Account, BalanceSnapshot, CollectionOperationDetail, DisbursementOperationDetail, Vault, VaultDeposit, VaultWithdrawal
+
+
+class BalanceSheetView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        start_date = request.query_params.get('start_date', None)
+        end_date = request.query_params.get('end_date', None)
+        if start_date is None or end_date is None:
+            return Response({"error": "start_date and end_date are required"}, status=400)
+        # INVALID_DATE when a date is not a year, a month or a day, the range goes to the end of end_date
+        start, end = date_range(start_date)[0], date_range(end_date)[1] - datetime.timedelta(days=1)
+        if start > end:
+            return Response({"error": "start_date must be less than end_date"}, status=400)
+
+        return Response({
+            "start_date": start,
+            "end_date": end,
+            "accounts": self.get_accounts(start, end),
+            "vaults": self.get_vaults(start, end),
+        })
+
+    def get_accounts(self, start_date, end_date):
+        collections = dict(CollectionOperationDetail.objects.filter(parent__date__gte=start_date, parent__date__lte=end_date)
+                           .values_list('destination_account').annotate(total=Sum('montant')).order_by())
+        disbursements = dict(DisbursementOperationDetail.objects.filter(parent__date__gte=start_date, parent__date__lte=end_date)
+                             .values_list('parent__account').annotate(total=Sum('montant')).order_by())
+        fund_transfers = dict(VaultWithdrawal.objects.filter(account__isnull=False, date__gte=start_date, date__lte=end_date)
+                              .values_list('account').annotate(total=Sum('amount')).order_by())
+
+        accounts = Account.objects.annotate(closing_balance=BalanceSnapshot.objects.balance_at_expression(end_date, 'account')).order_by('name')
+        ret = []
+        for account in accounts.values('id', 'name', 'number', 'closing_balance'):
+            total_collection = collections.get(account['id'], 0)
+            total_disbursement = disbursements.get(account['id'], 0)
+            total_fund_transfer = fund_transfers.get(account['id'], 0)
+            account["opening_balance"] = account['closing_balance'] - total_collection + total_disbursement - total_fund_transfer
+            account["total_collection"] = total_collection
+            account["total_disbursement"] = total_disbursement
+            account["total_fund_transfer"] = total_fund_transfer
+            ret.append(account)
+        return ret
+
+    def get_vaults(self, start_date, end_date):
+        deposits = dict(VaultDeposit.objects.filter(date__gte=start_date, date__lte=end_date)
+                        .values_list('vault').annotate(total=Sum('amount')).order_by())
+        withdrawals = {
+            row['vault']: row for row in VaultWithdrawal.objects.filter(date__gte=start_date, date__lte=end_date).values('vault')
+            .annotate(total=Sum('amount'), fund_transfer=Sum('amount', filter=Q(account__isnull=False))).order_by()
+        }
+
+        vaults = Vault.objects.annotate(closing_balance=BalanceSnapshot.objects.balance_at_expression(end_date, 'vault')).order_by('group', 'name')
+        ret = []
+        for vault in vaults.values('id', 'name', 'code', 'group', 'closing_balance', group_name=F('group__name')):
+            withdrawal = withdrawals.get(vault['id'], {})
+            total_deposit = deposits.get(vault['id'], 0)
+            total_withdrawal = withdrawal.get('total') or 0
+            vault["opening_balance"] = vault['closing_balance'] - total_deposit + total_withdrawal
+            vault["total_deposit"] = total_deposit
+            vault["total_withdrawal"] = total_withdrawal
+            vault["total_fund_transfer"] = withdrawal.get('fund_transfer') or 0
+            ret.append(vault)
+        return ret
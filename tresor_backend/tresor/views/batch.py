@@ -0,0 +1,83 @@
+from django.db import transaction
+from django.db.models import F
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView, Response
+
+from ..imports import CollectionImport, DisbursementImport, DepositImport, WithdrawalImport
+from ..models import (
+    CollectionOperation, CollectionOperationSerializer, DisbursementOperation, DisbursementOperationSerializer,
+    VaultDeposit, VaultDepositSerializer, VaultWithdrawal, VaultWithdrawalSerializer,
+)
+from ..utils import invalidate_stats
+
+
+# the querysets are the ones of the list endpoints, with the annotations their serializer reads
+BATCHES = {
+    "collections": (CollectionOperation.objects.with_details(), CollectionOperationSerializer, CollectionImport),
+    "disbursements": (DisbursementOperation.objects.with_details(), DisbursementOperationSerializer, DisbursementImport),
+    "deposits": (VaultDeposit.objects.annotate(vault_name=F('vault__name')), VaultDepositSerializer, DepositImport),
+    "withdrawals": (VaultWithdrawal.objects.annotate(vault_name=F('vault__name'), account_name=F('account__name')), VaultWithdrawalSerializer, WithdrawalImport),
+}
+
+
+class BatchCreateView(APIView):
+    # POST a list of operations, in the format of the create endpoint, they are all created in one transaction
+    # with the balances checked against the total of the batch; the errors give the index of the operation
+    # the operations are written as the rows of an import, the attachments are added to them afterwards
+    permission_classes = [IsAuthenticated]
+    attachment_fields = ['file', 'upload', 'keep_original']
+
+    def post(self, request, kind):
+        queryset, serializer_class, writer_class = BATCHES[kind]
+        if not isinstance(request.data, list) or not request.data:
+            return Response({"error": "a list of operations is required"}, status=400)
+        errors = [
+            {"row": index, "errors": {field: ["NOT_ALLOWED_IN_BATCH"] for field in self.attachment_fields if field in operation}}
+            for index, operation in enumerate(request.data) if isinstance(operation, dict) and any(field in operation for field in self.attachment_fields)
+        ]
+        if errors:
+            return Response({"errors": errors}, status=400)
+        serializer = serializer_class(data=request.data, many=True, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+
+        writer = writer_class([], request.user)
+        errors = writer.write(self.get_rows(writer, serializer.validated_data))
+        if errors:
+            return Response({"errors": errors}, status=400)
+        created = queryset.filter(pk__in=[operation.pk for operation in writer.created]).order_by('pk')
+        return Response(serializer_class(created, many=True, context={"request": request}).data, status=201)
+
+    def get_rows(self, writer, operations):
+        # the validated operations as the lines of an import, one per detail for the operations with details
+        rows = []
+        for index, operation in enumerate(operations):
+            if "details" not in operation:
+                rows.append({"row": index, **{field: operation.get(field, writer.optional.get(field)) for field in writer.fields}})
+                continue
+            values = {"row": index, "operation": str(index), **{field: operation.get(field, writer.optional.get(field)) for field in writer.operation_fields}}
+            for detail in operation["details"]:
+                rows.append({**values, **{field: detail[field] for field in writer.detail_fields}})
+        return rows
+
+
+class BatchDeleteView(APIView):
+    # POST {"ids": [...]} to delete several operations in one transaction, the balances are changed once per account or vault
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, kind):
+        queryset = BATCHES[kind][0]
+        ids = request.data.get('ids', None) if isinstance(request.data, dict) else None
+        if not isinstance(ids, list) or not ids or not all(isinstance(pk, int) for pk in ids):
+            return Response({"error": "ids must be a list of ids"}, status=400)
+        instances = list(queryset.filter(pk__in=ids))
+        missing = set(ids) - {instance.pk for instance in instances}
+        if missing:
+            return Response({"error": "not found", "ids": sorted(missing)}, status=404)
+
+        with transaction.atomic():
+            # the delete of the operation endpoints, for all the operations at once
+            if not queryset.model.objects.remove(instances):
+                transaction.set_rollback(True)
+                return Response("NOT_ENOUGH_BALANCE", status=400)
+            transaction.on_commit(invalidate_stats)
+        return Response("DELETED")
@@ -1,10 +1,16 @@
-from tresor.utils import filter_query_by_date
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.filters import OrderingFilter
+from tresor.exports import STREAM_FORMATS, stream_list
+from tresor.filters import RefSearchFilter
+from tresor.sparse import sparse_fields
+from tresor.utils import filter_query_by_params
 from ..models.collection_operation import CollectionOperation, CollectionOperationSerializer
 from rest_framework.generics import ListCreateAPIView, RetrieveAPIView, RetrieveUpdateAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from ..models.account import Account
+from django.db import transaction
 
 
 
@@ -12,51 +18,48 @@ class CollectionOperationListCreateView(ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = CollectionOperationSerializer
     filterset_fields = ['created_by', 'type']
+    filter_backends = [DjangoFilterBackend, RefSearchFilter, OrderingFilter]
     search_fields = ['ref']
     ordering_fields = ['date', 'motif', 'beneficiaire']
     ordering = ['-date', '-created_at']
 
     def get_queryset(self):
         user = self.request.user
-        return CollectionOperation.objects.all()
-        return CollectionOperation.objects.filter(created_by=user)
+        return CollectionOperation.objects.with_details(sparse_fields(self.get_serializer()))
+        return CollectionOperation.objects.with_details(sparse_fields(self.get_serializer())).filter(created_by=user)
 
     def filter_queryset(self, queryset):
         ret =  super().filter_queryset(queryset)
-        date = self.request.query_params.get('date', None)
-        if date is not None:
-            ret = filter_query_by_date(ret, date)
-        return ret
+        return filter_query_by_params(ret, self.request.query_params)
     
     @property
     def pagination_class(self):
         if self.request.query_params.get('all', False) == "true":
             return None
         return super().pagination_class
+
+    def list(self, request, *args, **kwargs):
+        stream = request.query_params.get('stream', None)
+        if stream in STREAM_FORMATS:
+            return stream_list(self, self.filter_queryset(self.get_queryset()), stream, "collections")
+        return super().list(request, *args, **kwargs)
     
     
 
 
 class CollectionOperationDetail(RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
-    queryset = CollectionOperation.objects.all()
     serializer_class = CollectionOperationSerializer
 
+    def get_queryset(self):
+        return CollectionOperation.objects.with_details(sparse_fields(self.get_serializer()))
+
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
-        account_changes = {}
-        # instance has detail and each one has a destination account, the account balance should be updated but the balance should positive
-        for detail in instance.details.all():
-            account = detail.destination_account
-            account_changes[account] = account_changes.get(account, 0) + detail.montant
-        for account, amount in account_changes.items():
-            if account.balance - amount < 0:
-                return Response("NOT_ENOUGH_BALANCE")
-        for account, amount in account_changes.items():
-            account.balance -= amount
-            account.save()
-        
-        instance.delete()
+        with transaction.atomic():
+            if not CollectionOperation.objects.remove([instance]):
+                transaction.set_rollback(True)
+                return Response("NOT_ENOUGH_BALANCE", status=400)
         return Response("DELETED")
     
         
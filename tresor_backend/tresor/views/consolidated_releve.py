@@ -0,0 +1,82 @@
+import datetime
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView, Response
+
+from tresor.exports import releve_entries, stream_releve
+from ..models import Account, BalanceSnapshot, LedgerEntry, Vault
+
+
+class ConsolidatedReleve(APIView):
+    # one chronological releve for several accounts and vaults (?accounts=1,2&vaults=3&group=1)
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        start_date = request.query_params.get('start_date', None)
+        end_date = request.query_params.get('end_date', None)
+        if start_date is None or end_date is None:
+            return Response({"error": "start_date and end_date are required"}, status=400)
+        try:
+            start, end = datetime.date.fromisoformat(start_date), datetime.date.fromisoformat(end_date)
+            account_ids = self.get_ids('accounts')
+            vault_ids = self.get_ids('vaults')
+            group = self.get_ids('group')
+        except ValueError:
+            return Response({"error": "invalid parameters"}, status=400)
+        if start > end:
+            return Response({"error": "start_date must be less than end_date"}, status=400)
+        day_before_start = start - datetime.timedelta(days=1)
+
+        # opening and closing balance of every owner, one query per owner table
+        accounts = list(Account.objects.filter(pk__in=account_ids).annotate(
+            opening_balance=BalanceSnapshot.objects.balance_at_expression(day_before_start, 'account'),
+            closing_balance=BalanceSnapshot.objects.balance_at_expression(end, 'account'),
+        ).order_by('name').values('id', 'name', 'opening_balance', 'closing_balance'))
+        vaults = list(Vault.objects.filter(Q(pk__in=vault_ids) | Q(group__in=group)).annotate(
+            opening_balance=BalanceSnapshot.objects.balance_at_expression(day_before_start, 'vault'),
+            closing_balance=BalanceSnapshot.objects.balance_at_expression(end, 'vault'),
+        ).order_by('group', 'name').values('id', 'name', 'opening_balance', 'closing_balance'))
+        if not accounts and not vaults:
+            return Response({"error": "at least one account, vault or group is required"}, status=400)
+
+        balances = {
+            "start_date_balance": sum(owner['opening_balance'] for owner in accounts + vaults),
+            "end_date_balance": sum(owner['closing_balance'] for owner in accounts + vaults),
+            "accounts": accounts,
+            "vaults": vaults,
+        }
+        entries = self.get_entries([account['id'] for account in accounts], [vault['id'] for vault in vaults], start, end)
+
+        if request.query_params.get('stream', None) == "true":
+            lines = self.to_lines(entries.iterator(chunk_size=2000), balances["start_date_balance"])
+            return StreamingHttpResponse(stream_releve(balances, lines), content_type='application/json')
+        return Response({**balances, "data": list(self.to_lines(entries, balances["start_date_balance"]))})
+
+    def get_ids(self, name):
+        value = self.request.query_params.get(name, "")
+        return [int(pk) for pk in value.split(",") if pk]
+
+    def get_entries(self, account_ids, vault_ids, start_date, end_date):
+        # the per owner ledgers are merged by the database, in (date, id) order
+        return releve_entries(LedgerEntry.objects.filter(
+            Q(account__in=account_ids) | Q(vault__in=vault_ids), date__gte=start_date, date__lte=end_date,
+        ).order_by('date', 'id'), 'cheque_number').values(
+            'date', 'amount', 'balance', 'source_type', 'account', 'vault', 'operation_name', 'cheque_number', 'operation_type')
+
+    def to_lines(self, entries, total_balance):
+        for entry in entries:
+            total_balance += entry['amount']
+            operation_name = entry['operation_name']
+            if entry['source_type'] == "collection" and entry['operation_type'] == "operation":
+                operation_name = "Versement de cheque N° " + entry['cheque_number']
+            yield {
+                "date": entry['date'],
+                "amount": abs(entry['amount']),
+                "balance": entry['balance'],
+                "total_balance": total_balance,
+                "operation_name": operation_name,
+                "type": entry['source_type'],
+                "account": entry['account'],
+                "vault": entry['vault'],
+            }
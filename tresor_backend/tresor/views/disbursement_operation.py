@@ -1,8 +1,14 @@
-from tresor.utils import filter_query_by_date
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.filters import OrderingFilter
+from tresor.exports import STREAM_FORMATS, stream_list
+from tresor.filters import RefSearchFilter
+from tresor.sparse import sparse_fields
+from tresor.utils import filter_query_by_params
 from ..models.disbursement_operation import DisbursementOperation, DisbursementOperationSerializer
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView, RetrieveAPIView , RetrieveUpdateAPIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from django.db import transaction
 
 
 class DisbursementOperationListCreateView(ListCreateAPIView):
@@ -10,6 +16,7 @@ class DisbursementOperationListCreateView(ListCreateAPIView):
     
     serializer_class = DisbursementOperationSerializer
     filterset_fields = ['account', 'created_by', 'type']
+    filter_backends = [DjangoFilterBackend, RefSearchFilter, OrderingFilter]
     search_fields = ['ref']
     ordering_fields = ['date', 'motif', 'beneficiaire']
     ordering = ['-date', "-created_at"]
@@ -17,34 +24,37 @@ class DisbursementOperationListCreateView(ListCreateAPIView):
     def get_queryset(self):
         user = self.request.user
         # if user.is_admin:
-        return DisbursementOperation.objects.all()
-        return DisbursementOperation.objects.filter(created_by=user)
+        return DisbursementOperation.objects.with_details(sparse_fields(self.get_serializer()))
+        return DisbursementOperation.objects.with_details(sparse_fields(self.get_serializer())).filter(created_by=user)
 
     def filter_queryset(self, queryset):
         ret =  super().filter_queryset(queryset)
-        date = self.request.query_params.get('date', None)
-        if date is not None:
-            ret = filter_query_by_date(ret, date)
-        return ret
+        return filter_query_by_params(ret, self.request.query_params)
     
     @property
     def pagination_class(self):
         if self.request.query_params.get('all', False) == "true":
             return None
         return super().pagination_class
+
+    def list(self, request, *args, **kwargs):
+        stream = request.query_params.get('stream', None)
+        if stream in STREAM_FORMATS:
+            return stream_list(self, self.filter_queryset(self.get_queryset()), stream, "disbursements")
+        return super().list(request, *args, **kwargs)
     
 
 class DisbursementOperationDetails(RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
-    queryset = DisbursementOperation.objects.all()
     serializer_class = DisbursementOperationSerializer
 
+    def get_queryset(self):
+        return DisbursementOperation.objects.with_details(sparse_fields(self.get_serializer()))
+
     # when deleting a disbursement operation we need to update the account balance
     def perform_destroy(self, instance):
-        account = instance.account
-        account.balance += instance.total
-        account.save()
-        instance.delete()
+        with transaction.atomic():
+            DisbursementOperation.objects.remove([instance])
 
 
 
@@ -1,46 +1,121 @@
+import datetime
+import glob
+import hashlib
 import os
-from rest_framework import serializers
-from rest_framework.views import APIView
+from rest_framework.exceptions import NotAuthenticated
+from rest_framework.permissions import AllowAny
+from rest_framework.views import APIView, Response
 
+from django.conf import settings
+from tresor.exports import file_chunks, stream_to_file, stream_zip
 from tresor.models.collection_operation import CollectionOperation
-from tresor.models.disbursement_operation import DisbursementOperation    
-from django.http import FileResponse, HttpResponse
+from tresor.models.disbursement_operation import DisbursementOperation
+from tresor.storage import media_token, sign_media, signed_media_user
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 import zipfile
-    
-def download_files(request, year, month, *args, **kwargs):
-    query_params = request.GET 
-    is_count_request = query_params.get("count", None)
-    type = query_params.get("type", None)
-    if not is_count_request or is_count_request not in ["true", "false"]:
-        return HttpResponse("You must provide a count parameter", status=400)
-    if not type or type not in ["collection", "disbursement"]:
-        return HttpResponse("You must provide a type parameter", status=400)
-
-    if type == "collection":
-        instances = CollectionOperation.objects.filter(date__year=year, date__month=month).exclude(file=None)
-    else:
-        instances = DisbursementOperation.objects.filter(date__year=year, date__month=month).exclude(file=None) 
-
-    if is_count_request == "true":
-        return HttpResponse(instances.count())
- 
-    response = HttpResponse(content_type='application/zip')
-    zip_file = zipfile.ZipFile(response, 'w')
-
-    for instance in instances:
-        if not instance.file:
+
+ARCHIVE_NAMES = {"collection": "Encaissements", "disbursement": "Décaissements"}
+# already compressed formats are stored as they are, deflating them again is time spent for nothing
+STORED_EXTENSIONS = {".pdf", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".zip", ".rar", ".7z", ".docx", ".xlsx", ".pptx", ".odt", ".ods"}
+
+
+class DownloadFilesView(APIView):
+    # files/<year>/<month>/ for a month, files/?start_date=&end_date= for a range of days (both included),
+    # with an optional account: the collections with a detail on it or the disbursements of it.
+    # The attachments are only sent to an authenticated user or with a signed url, like the ones of MediaView:
+    # link=true gives the url of the archive signed for the user, for the browser which downloads it without the token
+    permission_classes = [AllowAny]
+
+    def get(self, request, year=None, month=None):
+        query_params = request.query_params
+        is_count_request = query_params.get("count", None)
+        type = query_params.get("type", None)
+        if not is_count_request or is_count_request not in ["true", "false"]:
+            return Response({"error": "You must provide a count parameter"}, status=400)
+        if not type or type not in ["collection", "disbursement"]:
+            return Response({"error": "You must provide a type parameter"}, status=400)
+
+        try:
+            if year is not None:
+                start = datetime.date(year, month, 1)
+                end = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+            else:
+                start = datetime.date.fromisoformat(query_params.get("start_date", ""))
+                end = datetime.date.fromisoformat(query_params.get("end_date", ""))
+        except ValueError:
+            return Response({"error": "You must provide a valid month or start_date and end_date"}, status=400)
+        if end < start or (end - start).days >= settings.ARCHIVE_MAX_DAYS:
+            return Response({"error": f"The range must be of 1 to {settings.ARCHIVE_MAX_DAYS} days"}, status=400)
+        account = query_params.get("account", None)
+        if account is not None and not account.isdigit():
+            return Response({"error": "account must be an account id"}, status=400)
+        archive = f"files/{type}/{start}/{end}/{account or 'all'}"
+        if not request.user.is_authenticated and signed_media_user(archive, query_params) is None:
+            raise NotAuthenticated()
+        if query_params.get("link") == "true":
+            token = media_token(request) if request.user.is_authenticated else None
+            if token is None:
+                raise NotAuthenticated()
+            params = query_params.copy()
+            params.pop("link")
+            for key, value in sign_media(request.user, token, archive).items():
+                params[key] = value
+            return Response({"url": request.build_absolute_uri(f"{request.path}?{params.urlencode()}")})
+
+        if type == "collection":
+            instances = CollectionOperation._base_manager.filter(date__gte=start, date__lte=end).exclude(file=None).exclude(file="")
+            if account is not None:
+                instances = instances.filter(details__destination_account=account).distinct()
+        else:
+            instances = DisbursementOperation._base_manager.filter(date__gte=start, date__lte=end).exclude(file=None).exclude(file="")
+            if account is not None:
+                instances = instances.filter(account=account)
+        instances = instances.order_by('date', 'pk')
+
+        if is_count_request == "true":
+            return HttpResponse(instances.count())
+
+        name = f"{ARCHIVE_NAMES[type]}_{year}_{month}" if year is not None else f"{ARCHIVE_NAMES[type]}_{start}_{end}"
+        if account is not None:
+            name = f"{name}_{account}"
+        # only the whole months are kept in ARCHIVES_ROOT, the other ranges are built for the request
+        month_end = datetime.date(start.year + start.month // 12, start.month % 12 + 1, 1) - datetime.timedelta(days=1)
+        if start.day != 1 or end != month_end:
+            response = StreamingHttpResponse(stream_zip(archive_files(instances)), content_type='application/zip')
+            response['Content-Disposition'] = f'attachment; filename="{name}.zip"'
+            return response
+
+        files = list(instances.values_list('pk', 'file', 'updated_at'))
+        # the archive is built again when a file of the selection is added, removed or replaced (which changes updated_at)
+        fingerprint = hashlib.sha256("\n".join(f"{pk}:{file}:{updated_at.isoformat()}" for pk, file, updated_at in files).encode()).hexdigest()[:16]
+        key = f"{type}_{start:%Y_%m}_{account or 'all'}"
+        path = os.path.join(settings.ARCHIVES_ROOT, f"{key}_{fingerprint}.zip")
+
+        if os.path.exists(path):
+            # the last use of an archive, clean_archives removes the ones not used for ARCHIVE_EXPIRY_DAYS
+            os.utime(path)
+            response = FileResponse(open(path, 'rb'), content_type='application/zip')
+        else:
+            # the archives of the same selection with an older content are not served anymore
+            for old in glob.glob(os.path.join(glob.escape(settings.ARCHIVES_ROOT), f"{glob.escape(key)}_*.zip")):
+                os.remove(old)
+            response = StreamingHttpResponse(stream_to_file(stream_zip(archive_files(instances)), path), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{name}.zip"'
+        return response
+
+
+def archive_files(instances):
+    # (name, chunks, compress type) of the files for stream_zip, read one at a time while the archive is sent
+    names = set()
+    for instance in instances.iterator():
+        if not instance.file or not instance.file.storage.exists(instance.file.name):
             continue
-        file_path = instance.file.path
-        file_name = os.path.basename(file_path)
-        zip_file.write(file_path, file_name)
-
-    zip_file.close()
-    name = ""
-    if type == "collection":
-        name = "Encaissements"
-    else:
-        name = "Décaissements"
-    name = f"{name}_{year}_{month}.zip"
-    response['Content-Disposition'] = f'attachment; filename="{name}"'
-    return response
-    
+        # the stored names are content hashes, the files are named after their operation in the archive
+        extension = os.path.splitext(instance.file.name)[1].lower()
+        file_name = f"{instance.ref.replace('/', '-')}{extension}" if instance.ref and instance.ref != "-" else f"{instance.pk}{extension}"
+        if file_name in names:
+            file_name = f"{instance.pk}_{file_name}"
+        names.add(file_name)
+        compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+        yield file_name, file_chunks(instance.file), compress_type
+
@@ -0,0 +1,31 @@
+import csv
+import zipfile
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView, Response
+
+from ..imports import IMPORTS, read_rows
+
+
+class ImportView(APIView):
+    # POST /import/<kind>/ with a csv or xlsx `file`, one line per operation (per detail for collections and disbursements)
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, kind):
+        if kind not in IMPORTS:
+            return Response({"error": "kind must be one of " + ", ".join(IMPORTS)}, status=404)
+        file = request.FILES.get('file', None)
+        if file is None:
+            return Response({"error": "file is required"}, status=400)
+        format = "xlsx" if file.name.lower().endswith(".xlsx") else "csv"
+        try:
+            rows = read_rows(file, format)
+        except (UnicodeDecodeError, zipfile.BadZipFile, IndexError, ValueError, csv.Error):
+            return Response({"error": "INVALID_FILE"}, status=400)
+
+        operation_import = IMPORTS[kind](rows, request.user)
+        errors = operation_import.run()
+        if errors:
+            return Response({"errors": errors}, status=400)
+        return Response({"rows": len(rows), "operations": len(operation_import.created)}, status=201)
@@ -0,0 +1,44 @@
+import mimetypes
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.http import FileResponse, HttpResponse
+from rest_framework.permissions import AllowAny
+from rest_framework.views import APIView, Response
+
+from ..models import CollectionOperation, DisbursementOperation, Rendition
+from ..storage import media_etag, signed_media_user
+
+
+class MediaView(APIView):
+    # the attachments of the operations, for a user authenticated by the token header or by the signature of the url
+    # (the file urls of the serializers are signed, for MEDIA_URL_MAX_AGE seconds). The bytes are sent by nginx (X-Accel-Redirect to
+    # MEDIA_ACCEL_PREFIX), or by this view when it is not set. A file url never gets another content so the
+    # browser can keep it without asking again
+    permission_classes = [AllowAny]
+    cache_control = "private, max-age=31536000, immutable"
+
+    def get(self, request, name):
+        if not request.user.is_authenticated:
+            if signed_media_user(name, request.query_params) is None:
+                return Response({"error": "not allowed"}, status=403)
+        # only the files of the operations and their renditions are served, not anything under MEDIA_ROOT
+        if not (CollectionOperation._base_manager.filter(file=name).exists() or DisbursementOperation._base_manager.filter(file=name).exists()
+                or Rendition.objects.filter(Q(thumbnail=name) | Q(preview=name)).exists()):
+            return Response({"error": "not found"}, status=404)
+        if not default_storage.exists(name):
+            return Response({"error": "not found"}, status=404)
+
+        etag = media_etag(name)
+        if etag in [value.strip() for value in request.META.get("HTTP_IF_NONE_MATCH", "").split(",")]:
+            response = HttpResponse(status=304)
+        elif settings.MEDIA_ACCEL_PREFIX:
+            response = HttpResponse(content_type=mimetypes.guess_type(name)[0] or "application/octet-stream")
+            response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_PREFIX + quote(name)
+        else:
+            response = FileResponse(default_storage.open(name, "rb"))
+        response["ETag"] = etag
+        response["Cache-Control"] = self.cache_control
+        return response
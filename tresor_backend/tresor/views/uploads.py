@@ -0,0 +1,89 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.generics import CreateAPIView, RetrieveDestroyAPIView
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import Response
+
+from ..models import Upload, UploadSerializer
+
+
+class UploadCreateView(CreateAPIView):
+    # POST {"file_name", "size", "sha256"} starts an upload, its parts are then sent to uploads/<id>/
+    serializer_class = UploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        serializer.save(created_by=self.request.user)
+
+
+class UploadDetailView(RetrieveDestroyAPIView):
+    # GET gives the offset to resume from, PUT sends the next part as the raw body with its offset in the
+    # Upload-Offset header; the last part checks the sha256 of the file. DELETE cancels the upload
+    serializer_class = UploadSerializer
+    permission_classes = [IsAuthenticated]
+    read_size = 64 * 1024
+
+    def get_queryset(self):
+        return Upload.objects.filter(created_by=self.request.user)
+
+    def put(self, request, pk):
+        length = request.META.get('CONTENT_LENGTH', "")
+        offset = request.META.get('HTTP_UPLOAD_OFFSET', "")
+        if not length.isdigit() or not offset.isdigit():
+            return Response({"error": "Content-Length and Upload-Offset are required"}, status=400)
+        length, offset = int(length), int(offset)
+        if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            return Response({"error": "PART_TOO_LARGE", "max_size": settings.UPLOAD_CHUNK_MAX_SIZE}, status=413)
+
+        with transaction.atomic():
+            # a part at a time for an upload, a retry of the same part waits for the first one
+            upload = self.get_queryset().select_for_update().filter(pk=pk).first()
+            if upload is None:
+                return Response({"error": "not found"}, status=404)
+            if upload.complete or offset != upload.offset:
+                # the part was already received (a retry after a lost response) or one is missing
+                return Response({"error": "INVALID_OFFSET", **self.get_serializer(upload).data}, status=409)
+            if offset + length > upload.size:
+                return Response({"error": "UPLOAD_TOO_LARGE"}, status=400)
+
+            os.makedirs(settings.UPLOADS_ROOT, exist_ok=True)
+            with open(upload.path, 'r+b' if os.path.exists(upload.path) else 'wb') as f:
+                # the end of a part that was cut is written again
+                f.seek(offset)
+                f.truncate()
+                received = self.write_part(request.stream, f, length)
+            upload.offset += received
+            if upload.offset == upload.size:
+                if self.checksum(upload.path) != upload.sha256:
+                    # the file is sent again from the start
+                    os.remove(upload.path)
+                    upload.offset = 0
+                    upload.save()
+                    return Response({"error": "CHECKSUM_MISMATCH", **self.get_serializer(upload).data}, status=400)
+                upload.complete = True
+            upload.save()
+        return Response(self.get_serializer(upload).data)
+
+    def write_part(self, stream, f, length):
+        # the body is copied to the file as it is read, the bytes received before the connection was cut are kept
+        received = 0
+        while stream is not None and received < length:
+            chunk = stream.read(min(self.read_size, length - received))
+            if not chunk:
+                break
+            f.write(chunk)
+            received += len(chunk)
+        return received
+
+    def checksum(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def perform_destroy(self, instance):
+        instance.discard()
@@ -1,11 +1,15 @@
 from rest_framework.generics import ListAPIView
 from rest_framework.generics import RetrieveUpdateAPIView
 from rest_framework import viewsets
+import datetime
+from django.utils.text import slugify
 
-from tresor.utils import filter_query_by_date
+from tresor.exports import RELEVE_HEADER, STREAM_FORMATS, export_response, releve_rows, stream_list
+from tresor.sparse import load_only, sparse_fields
+from tresor.utils import filter_query_by_params
 from ..models.vault import *
 from rest_framework.permissions import IsAdminUser, BasePermission , IsAuthenticated
-from django.db.models import F
+from django.db.models import F, Case, When, OuterRef, Subquery
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.filters import SearchFilter
@@ -22,6 +26,9 @@ class VaultGroupListView(ListAPIView):
     permission_classes = [IsAuthenticated]
     pagination_class = None
 
+    def get_queryset(self):
+        return load_only(super().get_queryset(), sparse_fields(self.get_serializer()))
+
 class VaultListView(ListAPIView):
     queryset = Vault.objects.all().annotate(can_fund_transfer=F("group__can_fund_transfer"))
     serializer_class = VaultSerializer
@@ -30,11 +37,17 @@ class VaultListView(ListAPIView):
     pagination_class = None
     ordering = ['group']
 
+    def get_queryset(self):
+        return load_only(super().get_queryset(), sparse_fields(self.get_serializer()))
+
 class VaultDetailView(RetrieveUpdateAPIView):
     queryset = Vault.objects.all()
     serializer_class = VaultSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        return load_only(super().get_queryset(), sparse_fields(self.get_serializer()))
+
 class VaultDepositViewSet(viewsets.ModelViewSet):
     queryset = VaultDeposit.objects.all().annotate(vault_name=F('vault__name'))
     serializer_class = VaultDepositSerializer
@@ -46,7 +59,13 @@ class VaultDepositViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         user = self.request.user
         ret = super().get_queryset()   
-        return ret
+        return load_only(ret, sparse_fields(self.get_serializer()))
+
+    def list(self, request, *args, **kwargs):
+        stream = request.query_params.get('stream', None)
+        if stream in STREAM_FORMATS:
+            return stream_list(self, self.filter_queryset(self.get_queryset()), stream, "deposits")
+        return super().list(request, *args, **kwargs)
 
     def filter_queryset(self, queryset):
         queryset = super().filter_queryset(queryset)
@@ -54,23 +73,15 @@ class VaultDepositViewSet(viewsets.ModelViewSet):
         if "group" in params:
             group = params["group"]
             queryset = queryset.filter(vault__group=group)
-        date = self.request.query_params.get('date', None)
-       
-        if date is not None:
-            queryset = filter_query_by_date(queryset, date)
-        
-        return queryset
+        return filter_query_by_params(queryset, params)
 
     
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
-        vault = instance.vault
-        if vault.balance < instance.amount:
-            return Response("NOT_ENOUGH_BALANCE", status=status.HTTP_400_BAD_REQUEST)
         with transaction.atomic():
-            vault.balance -= instance.amount
-            vault.save()
-            instance.delete()
+            if not VaultDeposit.objects.remove([instance]):
+                transaction.set_rollback(True)
+                return Response("NOT_ENOUGH_BALANCE", status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 class VaultWithdrawalViewSet(viewsets.ModelViewSet):
@@ -82,16 +93,21 @@ class VaultWithdrawalViewSet(viewsets.ModelViewSet):
 
     search_fields = ['motif']
 
+    def get_queryset(self):
+        return load_only(super().get_queryset(), sparse_fields(self.get_serializer()))
+
+    def list(self, request, *args, **kwargs):
+        stream = request.query_params.get('stream', None)
+        if stream in STREAM_FORMATS:
+            return stream_list(self, self.filter_queryset(self.get_queryset()), stream, "withdrawals")
+        return super().list(request, *args, **kwargs)
+
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
-        vault = instance.vault
         with transaction.atomic():
-            vault.balance += instance.amount
-            vault.save()
-            if instance.account is not None:
-                instance.account.balance -= instance.amount
-                instance.account.save()
-            instance.delete()
+            if not VaultWithdrawal.objects.remove([instance]):
+                transaction.set_rollback(True)
+                return Response("NOT_ENOUGH_BALANCE", status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_204_NO_CONTENT)
     
     def filter_queryset(self, queryset):
@@ -100,12 +116,7 @@ class VaultWithdrawalViewSet(viewsets.ModelViewSet):
         if "group" in params:
             group = params["group"]
             queryset = queryset.filter(vault__group=group)
-        date = self.request.query_params.get('date', None)
-       
-        if date is not None:
-            queryset = filter_query_by_date(queryset, date)
-        
-        return queryset
+        return filter_query_by_params(queryset, params)
     
 class VaultReleve(APIView):
     permission_classes = [IsAdminUser]
@@ -114,45 +125,46 @@ class VaultReleve(APIView):
         end_date = request.query_params.get('end_date', None)
         if start_date is None or end_date is None:
             return Response({"error": "start_date and end_date are required"}, status=400)
-        if start_date > end_date:
+        try:
+            start, end = datetime.date.fromisoformat(start_date), datetime.date.fromisoformat(end_date)
+        except ValueError:
+            return Response({"error": "invalid start_date or end_date"}, status=400)
+        if start > end:
             return Response({"error": "start_date must be less than end_date"}, status=400)
         try:
             vault = Vault.objects.get(pk=pk)
         except Vault.DoesNotExist:
             return Response({"error": "Vault not found"}, status=404)
-        
-        releve = []
-        total_change = 0
-
-        for deposit in vault.deposits.filter(date__gte=start_date, date__lte=end_date):
-            total_change += deposit.amount
-            releve.append({
-                "date": deposit.date,
-                "amount": deposit.amount,
-                "operation_name": deposit.motif,
-                "type": "deposit",
-                "meta_data": {
-                    # "account_name": deposit.account.name
-                }
-            })
-        for withdrawal in vault.withdrawals.filter(date__gte=start_date, date__lte=end_date):
-            total_change -= withdrawal.amount
-            releve.append({
-                "date": withdrawal.date,
-                "amount": withdrawal.amount,
-                "operation_name": withdrawal.motif,
-                "type": "withdrawal",
-                "meta_data": {
-                    # "account_name": withdrawal.account.name
-                }
-            })
-        
-        releve = sorted(releve, key=lambda x: x["date"])
-        end_date_balance = vault.get_solde_at_date(end_date)
-        return Response(
-            { 
-                "start_date_balance": end_date_balance - total_change,
-                "end_date_balance" : end_date_balance,
-                "data": releve
-            }
-        )
\ No newline at end of file
+        day_before_start = start - datetime.timedelta(days=1)
+
+        entries = self.get_entries(vault, start, end)
+        balances = {
+            "start_date_balance": LedgerEntry.objects.balance_at(day_before_start, vault=vault),
+            "end_date_balance": LedgerEntry.objects.balance_at(end, vault=vault),
+        }
+
+        export = request.query_params.get('export', None)
+        if export in ("csv", "xlsx"):
+            lines = (self.to_line(entry) for entry in entries.iterator(chunk_size=2000))
+            return export_response(export, f"releve_{slugify(vault.name)}_{start_date}_{end_date}", RELEVE_HEADER, releve_rows(balances, lines), vault.name)
+
+        return Response({**balances, "data": [self.to_line(entry) for entry in entries]})
+
+    def get_entries(self, vault, start_date, end_date):
+        # deposits and withdrawals of the vault in order, with the motif of the source operation
+        return LedgerEntry.objects.between(start_date, end_date, vault=vault).annotate(
+            operation_name=Case(
+                When(source_type='deposit', then=Subquery(VaultDeposit.objects.filter(pk=OuterRef('source_id')).values('motif')[:1])),
+                default=Subquery(VaultWithdrawal.objects.filter(pk=OuterRef('source_id')).values('motif')[:1]),
+            )
+        ).values('date', 'amount', 'balance', 'source_type', 'operation_name')
+
+    def to_line(self, entry):
+        return {
+            "date": entry['date'],
+            "amount": abs(entry['amount']),
+            "balance": entry['balance'],
+            "operation_name": entry['operation_name'],
+            "type": entry['source_type'],
+            "meta_data": {}
+        }
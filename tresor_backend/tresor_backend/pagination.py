@@ -1,16 +1,169 @@
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-class MPagePagination(pagination.PageNumberPagination):
-    page_size = 10 
+from tresor.utils import stats_cache_key, STATS_CACHE_TIMEOUT
+
+
+def cached_count(queryset):
+    # the count of a filtered list, cached under the stats version: any write to the operations, accounts, vaults
+    # or users changes it. Counting the annotated lists is a GROUP BY over all their rows
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    digest = hashlib.md5(f"{sql}{params}".encode()).hexdigest()
+    return cache.get_or_set(stats_cache_key(f"count:{queryset.model._meta.label}:{digest}"), lambda: queryset.order_by().count(), STATS_CACHE_TIMEOUT)
+
+
+class CachedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list)
+
+
+class KeysetPagination(pagination.BasePagination):
+    # ?pagination=cursor: the pages follow the ordering of the list then the id, the next page is the rows after the
+    # last one of this page (a WHERE on its values) instead of an OFFSET, page 500 costs as much as page 1.
+    # The count is only given with ?count=true. The ordering fields can not be null
+    cursor_query_param = 'cursor'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    @classmethod
+    def requested(cls, request):
+        return cls.cursor_query_param in request.query_params or request.query_params.get('pagination') == 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.model = queryset.model
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.count = cached_count(queryset) if request.query_params.get('count') == 'true' else None
+
+        values, self.reverse = self.decode_cursor(request)
+        ordering = [self.flip(name) for name in self.ordering] if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.after(ordering, values))
+        rows = list(queryset[:self.page_size + 1])
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+        # coming from a page there is always one to go back to
+        self.has_next = values is not None if self.reverse else more
+        self.has_previous = more if self.reverse else values is not None
+        self.rows = rows
+        return rows
 
     def get_page_size(self, request):
-        return self.page_size
-   
+        try:
+            return pagination._positive_int(request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, queryset):
+        # the ordering of the list (the ordering filter or the view), with the id to tell the equal rows apart
+        ordering = [name for name in queryset.query.order_by if isinstance(name, str)] or ['-pk']
+        names = [name.lstrip('-') for name in ordering]
+        if 'pk' not in names and 'id' not in names:
+            ordering.append('-pk' if ordering[-1].startswith('-') else 'pk')
+        return ordering
+
+    def flip(self, name):
+        return name[1:] if name.startswith('-') else '-' + name
+
+    def after(self, ordering, values):
+        # (a > x) or (a = x and b > y) or ..., with `a >= x` before it so the database reads the index from x
+        condition, equal = Q(), Q()
+        for name, value in zip(ordering, values):
+            field = name.lstrip('-')
+            condition |= equal & Q(**{f"{field}__{'lt' if name.startswith('-') else 'gt'}": value})
+            equal &= Q(**{field: value})
+        first = ordering[0]
+        return Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]}) & condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values, reverse = cursor['v'], bool(cursor['r'])
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [self.to_python(name, value) for name, value in zip(self.ordering, values)], reverse
+        except (TypeError, ValueError, KeyError):
+            raise NotFound("INVALID_CURSOR")
+
+    def to_python(self, name, value):
+        name = name.lstrip('-')
+        try:
+            field = self.model._meta.pk if name == 'pk' else self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # an annotation, compared as it was sent
+            return value
+        return field.to_python(value)
+
+    def encode_cursor(self, row, reverse):
+        # isoformat keeps the microseconds of the datetimes, DjangoJSONEncoder would cut them
+        values = [getattr(row, name.lstrip('-')) for name in self.ordering]
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        cursor = json.dumps({'v': values, 'r': int(reverse)}, default=str)
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, base64.urlsafe_b64encode(cursor.encode()).decode())
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.rows:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.rows[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        ret = {'next': self.get_next_link(), 'previous': self.get_previous_link(), 'data': data}
+        if self.count is not None:
+            ret = {'count': self.count, **ret}
+        return Response(ret)
+
+
+class MPagePagination(pagination.PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    django_paginator_class = CachedCountPaginator
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if KeysetPagination.requested(request):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
     def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
         return Response({
             'count': self.page.paginator.count,
             'page' : self.page.number,
-            'total_pages': self.page.paginator.num_pages,        
-            'data': data,  
-        })
\ No newline at end of file
+            'total_pages': self.page.paginator.num_pages,
+            'data': data,
+        })
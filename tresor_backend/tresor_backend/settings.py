@@ -87,7 +87,7 @@ WSGI_APPLICATION = 'tresor_backend.wsgi.application'
 REST_FRAMEWORK = {
        'COERCE_DECIMAL_TO_STRING': False,
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'authentication.tokens.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -120,6 +120,23 @@ DATABASES = {
 
 
 
+# Cache
+# shared by the gunicorn workers, the stats cache is invalidated by changing a version key
+
+# the users of the tokens are kept in memory for TOKEN_CACHE_TTL seconds (authentication.tokens), and in the cache
+# below for the other processes when TOKEN_CACHE_SHARED is set
+TOKEN_CACHE_SIZE = 1024
+TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL", 30))
+TOKEN_CACHE_SHARED = os.environ.get("TOKEN_CACHE_SHARED", "false") == "true"
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", os.path.join(BASE_DIR, "cache")),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -159,6 +176,26 @@ STATIC_URL = 'static/'
 
 MEDIA_ROOT =  os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+STORAGES = {
+    # the attachments are stored once per content, see tresor.storage
+    "default": {"BACKEND": "tresor.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+# internal nginx location of MEDIA_ROOT, the attachments are sent by nginx (X-Accel-Redirect) when it is set
+MEDIA_ACCEL_PREFIX = os.environ.get("MEDIA_ACCEL_PREFIX", "")
+# the seconds the signed urls of the attachments are valid, they stay the same for half of it (tresor.storage)
+MEDIA_URL_MAX_AGE = int(os.environ.get("MEDIA_URL_MAX_AGE", 24 * 3600))
+# the zip archives of the attachments of a month, built once per content and served from there
+ARCHIVES_ROOT = os.environ.get("ARCHIVES_ROOT", os.path.join(BASE_DIR, 'archives'))
+# the longest range of days of an archive, and the days an archive is kept after its last download (clean_archives)
+ARCHIVE_MAX_DAYS = 366
+ARCHIVE_EXPIRY_DAYS = 30
+# the files sent in parts before their operation (tresor.views.uploads)
+UPLOADS_ROOT = os.environ.get("UPLOADS_ROOT", os.path.join(BASE_DIR, 'uploads'))
+UPLOAD_MAX_SIZE = 200 * 1024 * 1024
+UPLOAD_CHUNK_MAX_SIZE = 8 * 1024 * 1024
+# the uploads never given to an operation are removed after this many hours (clean_uploads)
+UPLOAD_EXPIRY_HOURS = 24
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -16,12 +16,17 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from tresor.views import AccountViewSet, AccountReleve, CollectionOperationListCreateView, DisbursementOperationListCreateView, DisbursementOperationDetails, CollectionOperationDetail, StatsView
+from tresor.views import AccountViewSet, AccountReleve, CollectionOperationListCreateView, DisbursementOperationListCreateView, DisbursementOperationDetails, CollectionOperationDetail, StatsView, StatsSeriesView
 from authentication.views import LoginTokenView, LoginView, PasswordUpdateView, UsersViewSet
 from rest_framework.routers import DefaultRouter
 from django.conf import settings
-from django.conf.urls.static import static
-from tresor.views.files import download_files
+from tresor.views.files import DownloadFilesView
+from tresor.views.balance_sheet import BalanceSheetView
+from tresor.views.consolidated_releve import ConsolidatedReleve
+from tresor.views.imports import ImportView
+from tresor.views.batch import BatchCreateView, BatchDeleteView
+from tresor.views.media import MediaView
+from tresor.views.uploads import UploadCreateView, UploadDetailView
 
 from tresor.views.vault import VaultListView, VaultDetailView, VaultDepositViewSet, VaultWithdrawalViewSet, VaultGroupListView, VaultReleve
 
@@ -34,6 +39,7 @@ router.register(r'vaults/withdrawal', VaultWithdrawalViewSet, basename="vaults-w
 
 urlpatterns = [
     path('stats/', StatsView.as_view(), name="stats"),
+    path('stats/series/', StatsSeriesView.as_view(), name="stats-series"),
 
     path('admin/', admin.site.urls),
     path('auth/token/', LoginTokenView.as_view(), name="login-token"),
@@ -42,22 +48,37 @@ urlpatterns = [
 
     path('collections/', CollectionOperationListCreateView.as_view(), name="collections"),
     path('collections/<int:pk>/', CollectionOperationDetail.as_view(), name="collection-details"),
+    path('collections/batch/', BatchCreateView.as_view(), {"kind": "collections"}, name="collections-batch"),
+    path('collections/batch/delete/', BatchDeleteView.as_view(), {"kind": "collections"}, name="collections-batch-delete"),
 
     path('disbursements/', DisbursementOperationListCreateView.as_view(), name="disbursements"),
     path('disbursements/<int:pk>/', DisbursementOperationDetails.as_view(), name="disbursement-details"),
+    path('disbursements/batch/', BatchCreateView.as_view(), {"kind": "disbursements"}, name="disbursements-batch"),
+    path('disbursements/batch/delete/', BatchDeleteView.as_view(), {"kind": "disbursements"}, name="disbursements-batch-delete"),
 
     path('accounts/<int:pk>/releve/', AccountReleve.as_view(), name='account-releve'),
     path("vaults/<int:pk>/releve/", VaultReleve.as_view(), name="vault-releve"), 
+    path('releve/consolidated/', ConsolidatedReleve.as_view(), name='consolidated-releve'),
+    path('balance_sheet/', BalanceSheetView.as_view(), name='balance-sheet'),
+    path('import/<str:kind>/', ImportView.as_view(), name='import'),
 
-    path('files/<int:year>/<int:month>/', download_files, name='download_files'),
+    path('files/<int:year>/<int:month>/', DownloadFilesView.as_view(), name='download_files'),
+    path('files/', DownloadFilesView.as_view(), name='download_files_range'),
 
     path("vault_groups/", VaultGroupListView.as_view(), name="vaults_groups"),
     path('vaults/', VaultListView.as_view(), name="vaults"),
     path('vaults/<int:pk>/', VaultDetailView.as_view(), name="vault-details"),
+    path('vaults/deposit/batch/', BatchCreateView.as_view(), {"kind": "deposits"}, name="vaults-deposit-batch"),
+    path('vaults/deposit/batch/delete/', BatchDeleteView.as_view(), {"kind": "deposits"}, name="vaults-deposit-batch-delete"),
+    path('vaults/withdrawal/batch/', BatchCreateView.as_view(), {"kind": "withdrawals"}, name="vaults-withdrawal-batch"),
+    path('vaults/withdrawal/batch/delete/', BatchDeleteView.as_view(), {"kind": "withdrawals"}, name="vaults-withdrawal-batch-delete"),
+    path('uploads/', UploadCreateView.as_view(), name="uploads"),
+    path('uploads/<uuid:pk>/', UploadDetailView.as_view(), name="upload-detail"),
     
 
 ]
 
-urlpatterns += static("" +  settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# the attachments, with their access check, instead of static()
+urlpatterns += [path(settings.MEDIA_URL.lstrip("/") + "<path:name>", MediaView.as_view(), name="media")]
 urlpatterns += router.urls
 
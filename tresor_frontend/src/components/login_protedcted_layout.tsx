@@ -25,11 +25,13 @@ function FileDownloadDialog() {
   >("collection");
   const [total, setTotal] = React.useState<number | null>(null);
 
-  function downloadFile() {
-    const url = `${rootUrl}files/${selectedDate!.replace("-", "/")}?count=false&type=${selectedOption}`;
+  async function downloadFile() {
+    // the browser downloads the archive without the token, from a link signed for the user
+    const url = `${rootUrl}files/${selectedDate!.replace("-", "/")}?count=false&type=${selectedOption}&link=true`;
+    const response = await axios.get(url);
     const a = document.createElement("a");
-    a.href = url;
-    a.download = url;
+    a.href = response.data.url;
+    a.download = response.data.url;
     document.body.appendChild(a);
     a.click();
     document.body.removeChild(a);